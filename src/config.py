@@ -0,0 +1,32 @@
+"""
+全局配置
+均可通过环境变量覆盖
+"""
+import os
+
+# k线本地缓存目录
+KLINE_CACHE_DIR = os.environ.get(
+    'BTC_QUANT_KLINE_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'btc_quant', 'kline')
+)
+
+# clickhouse
+CLICKHOUSE_HOST = os.environ.get('BTC_QUANT_CLICKHOUSE_HOST', '192.168.3.64')
+CLICKHOUSE_PORT = int(os.environ.get('BTC_QUANT_CLICKHOUSE_PORT', '9000'))
+CLICKHOUSE_USER = os.environ.get('BTC_QUANT_CLICKHOUSE_USER', 'gx')
+CLICKHOUSE_PASSWORD = os.environ.get('BTC_QUANT_CLICKHOUSE_PASSWORD', '1234566')
+CLICKHOUSE_DATABASE = os.environ.get('BTC_QUANT_CLICKHOUSE_DATABASE', 'btc_quant')
+# 连接池大小 即进程内最多同时打开的连接数
+CLICKHOUSE_POOL_SIZE = int(os.environ.get('BTC_QUANT_CLICKHOUSE_POOL_SIZE', '4'))
+# 空闲超过该时间（秒）的连接在借出前先做健康检查
+CLICKHOUSE_PING_INTERVAL = float(os.environ.get('BTC_QUANT_CLICKHOUSE_PING_INTERVAL', '30'))
+# 异步写入失败时的落盘目录 数据库恢复后按顺序重放
+CLICKHOUSE_SPILL_DIR = os.environ.get(
+    'BTC_QUANT_CLICKHOUSE_SPILL_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'btc_quant', 'spill')
+)
+
+# 策略status/action数据的默认输出目标 clickhouse | parquet | journal | memory | null 见 data_collection.strategy_sink
+STRATEGY_SINK = os.environ.get('BTC_QUANT_STRATEGY_SINK', 'clickhouse')
+# parquet/journal输出目录
+STRATEGY_SINK_DIR = os.environ.get(
+    'BTC_QUANT_STRATEGY_SINK_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'btc_quant', 'strategy')
+)
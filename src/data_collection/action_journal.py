@@ -0,0 +1,198 @@
+"""
+策略action的二进制追加日志
+1.每条action为定长记录（struct打包 75字节） 写入带缓冲的本地文件 不构造namedtuple/datetime
+2.策略版本号在 {path}.versions 中登记一次（每行一个） 记录中只保存其序号
+3.action_time保存为int64毫秒时间戳（墙上时间 与backtrader.num2date一致）
+4.replay按块读取为numpy列 可用于分析 或通过replay_to_db补写入clickhouse
+进程崩溃时文件末尾可能残留半条记录 读取时忽略
+同一个journal文件只允许一个进程写入
+"""
+import os
+import struct
+from datetime import datetime, timedelta
+from typing import Iterator, List
+
+import numpy as np
+
+from data_collection.dao.strategy_action_btc_spot_trading_usdt_1m import StrategyActionBtcUSDT1mInsertDao
+from log import *
+
+# 小端 无对齐：version_id, action_time, status, 8个价格/数量字段（None记为NaN）
+RECORD_STRUCT = struct.Struct('<Hqb8d')
+RECORD_DTYPE = np.dtype([
+    ('version_id', '<u2'),
+    ('action_time', '<i8'),
+    ('status', 'i1'),
+    ('open_price', '<f8'),
+    ('close_price', '<f8'),
+    ('quantity', '<f8'),
+    ('open_cost', '<f8'),
+    ('expected_gross_value', '<f8'),
+    ('actual_gross_value', '<f8'),
+    ('expected_commission', '<f8'),
+    ('actual_commission', '<f8'),
+])
+assert RECORD_DTYPE.itemsize == RECORD_STRUCT.size
+
+EPOCH = datetime(1970, 1, 1)
+NAN = float('nan')
+
+
+def ms_to_wall_clock(ms: int) -> datetime:
+    return EPOCH + timedelta(milliseconds=ms)
+
+
+def _versions_path(path: str) -> str:
+    return f"{path}.versions"
+
+
+def load_versions(path: str) -> List[str]:
+    """
+    读取journal中登记的策略版本号 下标即version_id
+    """
+    versions_path = _versions_path(path)
+    if not os.path.exists(versions_path):
+        return []
+    with open(versions_path, 'r', encoding='utf-8') as f:
+        return [line.rstrip('\n') for line in f]
+
+
+class ActionJournal:
+    def __init__(self, path: str, buffer_size: int = 1 << 20):
+        """
+
+        :param path: journal文件路径 不存在则创建 存在则追加
+        :param buffer_size: 写缓冲大小（字节）
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.versions = {version: i for i, version in enumerate(load_versions(path))}
+        self.file = open(path, 'ab', buffering=buffer_size)
+        # 截掉崩溃时残留的半条记录 保证后续记录对齐
+        size = self.file.tell()
+        if size % RECORD_STRUCT.size != 0:
+            self.file.truncate(size - size % RECORD_STRUCT.size)
+        self.pack = RECORD_STRUCT.pack
+
+    def version_id(self, version: str) -> int:
+        """
+        登记策略版本号
+        """
+        version_id = self.versions.get(version)
+        if version_id is None:
+            version_id = len(self.versions)
+            with open(_versions_path(self.path), 'a', encoding='utf-8') as f:
+                f.write(f"{version}\n")
+            self.versions[version] = version_id
+        return version_id
+
+    def append(self, version_id: int, action_time: int, status: int, open_price: float, close_price: float,
+               quantity: float, open_cost: float, expected_gross_value: float | None,
+               actual_gross_value: float | None, expected_commission: float | None,
+               actual_commission: float | None):
+        """
+        追加一条action
+        :param version_id: 见version_id()
+        :param action_time: 毫秒时间戳
+        :param status: 见 StrategyActionBtcUSDT1mInsertDao
+        """
+        self.file.write(self.pack(
+            version_id, action_time, status, open_price, close_price, quantity, open_cost,
+            NAN if expected_gross_value is None else expected_gross_value,
+            NAN if actual_gross_value is None else actual_gross_value,
+            NAN if expected_commission is None else expected_commission,
+            NAN if actual_commission is None else actual_commission,
+        ))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def replay(path: str, chunk_records: int = 100_000) -> Iterator[np.ndarray]:
+    """
+    按块读取journal
+    :param path:
+    :param chunk_records: 每块的记录数
+    :return: 结构化数组 dtype为RECORD_DTYPE
+    """
+    chunk_bytes = chunk_records * RECORD_DTYPE.itemsize
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(chunk_bytes)
+            usable = len(data) - len(data) % RECORD_DTYPE.itemsize
+            if usable > 0:
+                yield np.frombuffer(data[:usable], dtype=RECORD_DTYPE)
+            if len(data) < chunk_bytes:
+                break
+
+
+def replay_actions(path: str, version: str | None = None, chunk_records: int = 100_000
+                   ) -> Iterator[List[StrategyActionBtcUSDT1mInsertDao]]:
+    """
+    按块读取journal并转换为StrategyActionBtcUSDT1mInsertDao
+    :param path:
+    :param version: 只读取该版本 为空则读取全部
+    :param chunk_records:
+    :return:
+    """
+    versions = load_versions(path)
+    version_id = None if version is None else versions.index(version)
+    for records in replay(path, chunk_records):
+        if version_id is not None:
+            records = records[records['version_id'] == version_id]
+        actions = []
+        for row in records.tolist():
+            values = [None if value != value else value for value in row[3:]]  # NaN -> None
+            actions.append(StrategyActionBtcUSDT1mInsertDao(
+                versions[row[0]], ms_to_wall_clock(row[1]), row[2], *values
+            ))
+        yield actions
+
+
+def replay_to_db(path: str, version: str | None = None, chunk_records: int = 100_000) -> int:
+    """
+    将journal补写入clickhouse
+    :return: 写入的条数
+    """
+    from data_collection.dao.strategy_action_btc_spot_trading_usdt_1m import StrategyActionBtcUSDT1mConnector
+    connector = StrategyActionBtcUSDT1mConnector()
+    total = 0
+    for actions in replay_actions(path, version, chunk_records):
+        if actions:
+            connector.insert_many(actions)
+            total += len(actions)
+    logging.info(f"{total} actions replayed from {path}")
+    return total
+
+
+def test():
+    import tempfile
+    import time
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'actions.journal')
+        journal = ActionJournal(path)
+        version_id = journal.version_id('2025-01-01 00:00:00:1234')
+        start = time.perf_counter()
+        for i in range(1_000_000):
+            journal.append(version_id, 1733011200000 + i * 60000, 1, 100.0, 101.0, 0.5, 50.0, 0.5, None, 0.04, None)
+        journal.close()
+        logging.info(f"append 1000000 actions in {time.perf_counter() - start:.3f}s, "
+                     f"{os.path.getsize(path) / 1024 / 1024:.1f}MB")
+        # 模拟崩溃后残留的半条记录
+        with open(path, 'ab') as f:
+            f.write(b'\x00' * 10)
+        start = time.perf_counter()
+        rows = sum(len(records) for records in replay(path))
+        logging.info(f"replay {rows} actions in {time.perf_counter() - start:.3f}s")
+        first = next(replay_actions(path, chunk_records=2))
+        logging.info(first[0])
+
+
+if __name__ == '__main__':
+    test()
@@ -1,36 +1,143 @@
-from datetime import datetime
+import calendar
+from datetime import datetime, timedelta
+from typing import Dict
 
-import requests
+import numpy as np
 import pandas as pd
 
-proxies = {"http": "http://127.0.0.1:7890", "https": "http://127.0.0.1:7890"}
+from data_collection.api.http_client import BinanceHttpClient, get_http_client
 
 '''
 limit:返回值数量 最小500 最大1000
 '''
 
+# k线周期单位 对应的毫秒数
+INTERVAL_UNIT_MS = {
+    's': 1000,
+    'm': 60 * 1000,
+    'h': 60 * 60 * 1000,
+    'd': 24 * 60 * 60 * 1000,
+    'w': 7 * 24 * 60 * 60 * 1000,
+}
 
-def get_binance_klines(
+
+def interval_to_milliseconds(interval: str) -> int:
+    """
+    将k线周期转换为毫秒数
+    :param interval: 如 '1m' '15m' '4h' '1d'
+    :return:
+    """
+    unit = interval[-1]
+    if unit not in INTERVAL_UNIT_MS or not interval[:-1].isdigit():
+        raise ValueError(f'unsupported interval "{interval}"')
+    return int(interval[:-1]) * INTERVAL_UNIT_MS[unit]
+
+
+def interval_to_timedelta(interval: str) -> timedelta:
+    return timedelta(milliseconds=interval_to_milliseconds(interval))
+
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def datetime_to_ms(date: datetime) -> int:
+    """
+    naive datetime按UTC墙上时间转换为毫秒时间戳 与数据库中的DateTime列、k线的open_time一致
+    不使用 datetime.timestamp() 其按本地时区解释naive datetime 带时区的datetime先换算为UTC
+    """
+    return calendar.timegm(date.utctimetuple()) * 1000 + date.microsecond // 1000
+
+
+def ms_to_datetime(ms: int) -> datetime:
+    """
+    毫秒时间戳转换为UTC墙上时间的naive datetime 见datetime_to_ms
+    """
+    return EPOCH + timedelta(milliseconds=int(ms))
+
+
+# 列式k线的列名及类型 与kline表的字段一致
+# open_time/close_time 为毫秒时间戳 落库时再转换为DateTime
+KLINE_COLUMNS: Dict[str, type] = {
+    'open_time': np.int64,
+    'open_price': np.float64,
+    'high_price': np.float64,
+    'low_price': np.float64,
+    'close_price': np.float64,
+    'volume': np.float64,
+    'close_time': np.int64,
+    'quote_asset_volume': np.float64,
+    'num_of_trades': np.int64,
+    'taker_buy_base_volume': np.float64,
+    'taker_buy_quote_volume': np.float64,
+}
+
+# 按行存储的k线 与KLINE_COLUMNS字段一致 用于环形缓冲区/本地缓存等预分配场景
+KLINE_DTYPE = np.dtype([(name, dtype) for name, dtype in KLINE_COLUMNS.items()])
+
+
+def fetch_binance_klines_raw(
         url: str, start_time: datetime, symbol='BTCUSDT', interval='1m',
-        limit: int = 1000
-) -> pd.DataFrame:
+        limit: int = 1000, end_time: datetime | None = None, weight: int = 2,
+        client: BinanceHttpClient | None = None
+) -> list:
     """
-    获取k线
+    获取k线 返回Binance原始的二维数组
     :param url:
-    :param start_time:
+    :param start_time: 开始时间 UTC墙上时间 见datetime_to_ms
     :param symbol:
     :param interval:
     :param limit:
+    :param end_time: 结束时间（包含） 为空则只按limit截取
+    :param weight: 请求权重 用于限流
+    :param client: http客户端 默认使用进程内共享的客户端
     :return:
     """
     params = {
         'symbol': symbol,
         'interval': interval,
-        'startTime': int(start_time.timestamp() * 1000),
+        'startTime': datetime_to_ms(start_time),
         'limit': limit
     }
-    response = requests.get(url, params=params, proxies=proxies)
-    data = response.json()
+    if end_time is not None:
+        params['endTime'] = datetime_to_ms(end_time)
+    if client is None:
+        client = get_http_client()
+    response = client.get(url, params=params, weight=weight)
+    return response.json()
+
+
+def parse_klines_columnar(data: list) -> Dict[str, np.ndarray]:
+    """
+    将Binance原始的二维数组直接解析为列式numpy数组
+    不经过DataFrame 由numpy在C层完成字符串到数值的转换
+    :param data: fetch_binance_klines_raw的返回值
+    :return: 列名 -> numpy数组 见KLINE_COLUMNS
+    """
+    if len(data) == 0:
+        return {name: np.empty(0, dtype=dtype) for name, dtype in KLINE_COLUMNS.items()}
+    table = np.array(data, dtype=object)
+    return {name: table[:, i].astype(dtype) for i, (name, dtype) in enumerate(KLINE_COLUMNS.items())}
+
+
+def get_binance_klines(
+        url: str, start_time: datetime, symbol='BTCUSDT', interval='1m',
+        limit: int = 1000, end_time: datetime | None = None, weight: int = 2,
+        client: BinanceHttpClient | None = None
+) -> pd.DataFrame:
+    """
+    获取k线
+    :param url:
+    :param start_time:
+    :param symbol:
+    :param interval:
+    :param limit:
+    :param end_time: 结束时间（包含） 为空则只按limit截取
+    :param weight: 请求权重 用于限流
+    :param client: http客户端 默认使用进程内共享的客户端
+    :return:
+    """
+    data = fetch_binance_klines_raw(url=url, start_time=start_time, symbol=symbol, interval=interval, limit=limit,
+                                    end_time=end_time, weight=weight, client=client)
     # print("data:")
     # print(data)
     df = pd.DataFrame(data, columns=[
@@ -50,31 +157,63 @@ def get_binance_klines(
 
 
 def get_binance_spot_trading_klines(start_time: datetime, symbol='BTCUSDT', interval='1m',
-                                    limit: int = 1000) -> pd.DataFrame:
+                                    limit: int = 1000, end_time: datetime | None = None) -> pd.DataFrame:
     """
     获取现货的k线
     :param start_time:
     :param symbol:
     :param interval:
     :param limit:
+    :param end_time:
     :return:
     """
     url = 'https://api.binance.com/api/v3/klines'
-    return get_binance_klines(url=url, start_time=start_time, symbol=symbol, interval=interval, limit=limit)
+    return get_binance_klines(url=url, start_time=start_time, symbol=symbol, interval=interval, limit=limit,
+                              end_time=end_time, weight=2)
+
+
+def get_binance_spot_trading_klines_columnar(start_time: datetime, symbol='BTCUSDT', interval='1m',
+                                             limit: int = 1000, end_time: datetime | None = None
+                                             ) -> Dict[str, np.ndarray]:
+    """
+    获取现货的k线 返回列式numpy数组
+    :param start_time:
+    :param symbol:
+    :param interval:
+    :param limit:
+    :param end_time:
+    :return: 见KLINE_COLUMNS
+    """
+    url = 'https://api.binance.com/api/v3/klines'
+    data = fetch_binance_klines_raw(url=url, start_time=start_time, symbol=symbol, interval=interval, limit=limit,
+                                    end_time=end_time, weight=2)
+    return parse_klines_columnar(data)
 
 
 def get_binance_spot_coin_margined_futures_klines(start_time: datetime, symbol='BTCUSD_PERP', interval='1m',
-                                                  limit: int = 1000) -> pd.DataFrame:
+                                                  limit: int = 1000, end_time: datetime | None = None
+                                                  ) -> pd.DataFrame:
     """
     获取币本位合约的k线
     :param start_time:
     :param symbol:
     :param interval:
     :param limit:
+    :param end_time:
     :return:
     """
     url = 'https://dapi.binance.com/dapi/v1/klines'
-    return get_binance_klines(url=url, start_time=start_time, symbol=symbol, interval=interval, limit=limit)
+    # 币本位合约的权重随limit变化: [1,100)=1 [100,500)=2 [500,1000]=5 >1000=10
+    if limit < 100:
+        weight = 1
+    elif limit < 500:
+        weight = 2
+    elif limit <= 1000:
+        weight = 5
+    else:
+        weight = 10
+    return get_binance_klines(url=url, start_time=start_time, symbol=symbol, interval=interval, limit=limit,
+                              end_time=end_time, weight=weight)
 
 
 def test():
@@ -82,6 +221,7 @@ def test():
     symbol = "BTCUSD_PERP"  # BTC币本位合约
     result = get_binance_spot_coin_margined_futures_klines(start_time, symbol)
     print(result)
+    get_http_client().log_stats()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,200 @@
+"""
+共享的Binance HTTP客户端
+1.requests.Session + 连接池 复用TCP/TLS连接(keep-alive)
+2.gzip压缩传输
+3.429/418/5xx及网络异常时 按抖动指数退避有限次重试 优先使用服务端返回的Retry-After
+4.请求权重由 WeightTokenBucket 控制
+5.按endpoint统计请求数、错误数、重试数及耗时
+"""
+import random
+import threading
+import time
+from typing import Dict
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from data_collection.api.rate_limiter import WeightTokenBucket, binance_rate_limiter
+from log import *
+
+DEFAULT_PROXIES = {"http": "http://127.0.0.1:7890", "https": "http://127.0.0.1:7890"}
+
+RETRY_STATUS = {418, 429, 500, 502, 503, 504}
+
+
+class EndpointStats:
+    """
+    单个endpoint的统计数据
+    """
+
+    def __init__(self):
+        self.requests = 0  # 请求次数（含重试）
+        self.errors = 0  # 失败次数（状态码异常或网络异常）
+        self.retries = 0  # 重试次数
+        self.total_latency = 0.0  # 总耗时（秒）
+        self.max_latency = 0.0  # 最大耗时（秒）
+
+    def record(self, latency: float, error: bool):
+        self.requests += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        if error:
+            self.errors += 1
+
+    def to_dict(self) -> dict:
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'retries': self.retries,
+            'total_latency': self.total_latency,
+            'avg_latency': self.total_latency / self.requests if self.requests else 0.0,
+            'max_latency': self.max_latency,
+        }
+
+
+class BinanceHttpClient:
+    def __init__(
+            self,
+            proxies: Dict[str, str] | None = None,
+            pool_size: int = 16,
+            timeout: float = 10.0,
+            max_retries: int = 5,
+            backoff_base: float = 0.5,
+            backoff_cap: float = 30.0,
+            rate_limiter: WeightTokenBucket | None = binance_rate_limiter,
+    ):
+        """
+
+        :param proxies: 代理
+        :param pool_size: 每个host的最大连接数 应不小于并发线程数
+        :param timeout: 单次请求超时（秒）
+        :param max_retries: 最大重试次数
+        :param backoff_base: 退避基数（秒）
+        :param backoff_cap: 退避上限（秒）
+        :param rate_limiter: 权重令牌桶 为空则不限流
+        """
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+        if proxies is not None:
+            self.session.proxies.update(proxies)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.rate_limiter = rate_limiter
+        self.endpoint_stats: Dict[str, EndpointStats] = {}
+        self.stats_lock = threading.Lock()
+
+    def _stats(self, endpoint: str) -> EndpointStats:
+        with self.stats_lock:
+            stats = self.endpoint_stats.get(endpoint)
+            if stats is None:
+                stats = EndpointStats()
+                self.endpoint_stats[endpoint] = stats
+            return stats
+
+    def _backoff(self, attempt: int, retry_after: str | None) -> float:
+        """
+        计算退避时间 full jitter
+        """
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def get(self, url: str, params: dict | None = None, weight: int = 1) -> requests.Response:
+        """
+        发送GET请求
+        :param url:
+        :param params:
+        :param weight: 请求权重
+        :return: 状态码正常的响应
+        """
+        parsed = urlparse(url)
+        endpoint = f"{parsed.netloc}{parsed.path}"
+        stats = self._stats(endpoint)
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(weight)
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                with self.stats_lock:
+                    stats.record(time.perf_counter() - start, error=True)
+                if attempt >= self.max_retries:
+                    raise
+                backoff = self._backoff(attempt, None)
+                logging.warning(f"GET {endpoint} failed: {e}, retry in {backoff:.2f}s")
+            else:
+                error = response.status_code >= 400
+                with self.stats_lock:
+                    stats.record(time.perf_counter() - start, error=error)
+                if self.rate_limiter is not None:
+                    self.rate_limiter.update_from_headers(response.headers)
+                if response.status_code not in RETRY_STATUS:
+                    response.raise_for_status()
+                    return response
+                retry_after = response.headers.get('Retry-After')
+                backoff = self._backoff(attempt, retry_after)
+                if response.status_code in (418, 429) and self.rate_limiter is not None:
+                    self.rate_limiter.penalize(backoff)
+                if attempt >= self.max_retries:
+                    response.raise_for_status()
+                logging.warning(f"GET {endpoint} status {response.status_code}, retry in {backoff:.2f}s")
+            with self.stats_lock:
+                stats.retries += 1
+            attempt += 1
+            time.sleep(backoff)
+
+    def stats(self) -> Dict[str, dict]:
+        """
+        获取各endpoint的统计数据
+        :return:
+        """
+        with self.stats_lock:
+            return {endpoint: stats.to_dict() for endpoint, stats in self.endpoint_stats.items()}
+
+    def log_stats(self):
+        for endpoint, stats in self.stats().items():
+            logging.info(
+                f"{endpoint}\trequests:{stats['requests']}\terrors:{stats['errors']}\tretries:{stats['retries']}\t"
+                f"avg_latency:{stats['avg_latency'] * 1000:.1f}ms\tmax_latency:{stats['max_latency'] * 1000:.1f}ms"
+            )
+
+    def close(self):
+        self.session.close()
+
+
+_shared_client: BinanceHttpClient | None = None
+_shared_client_lock = threading.Lock()
+
+
+def get_http_client() -> BinanceHttpClient:
+    """
+    获取进程内共享的客户端
+    :return:
+    """
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            _shared_client = BinanceHttpClient(proxies=DEFAULT_PROXIES)
+        return _shared_client
+
+
+def test():
+    client = get_http_client()
+    for _ in range(3):
+        client.get('https://api.binance.com/api/v3/ping')
+    client.log_stats()
+
+
+if __name__ == '__main__':
+    test()
@@ -1,25 +1,42 @@
 from data_collection.api import KlineInterface
 from datetime import datetime
 from data_collection.dao.kline_btc_spot_trading_usdt_1m import KlineBtcUSDT1mConnector, KlineBtcUSDT1mDao
+from data_collection.kline_cache import get_kline_cache, columns_to_kline_daos, empty_columns
 from log import *
-from typing import List
+from typing import Dict, List
+
+import numpy as np
 
 
 class KlineBTCUSDT1M(KlineInterface):
-    def get_kline(self, from_date: datetime, to_date: datetime, granularity: str = '1m', order: str = 'ASC') -> List[
-        KlineBtcUSDT1mDao]:
+    def get_kline_columns(self, from_date: datetime, to_date: datetime, granularity: str = '1m'
+                          ) -> Dict[str, np.ndarray]:
+        """
+        读取列式k线 优先使用本地缓存 见 data_collection.kline_cache
+        :param from_date:
+        :param to_date:
+        :param granularity: k线周期 非1m时由1m k线聚合 见 data_collection.kline_cache.ROLLUP_INTERVALS
+        :return: 见 data_collection.api.binance_api.KLINE_COLUMNS
+        """
         if from_date > to_date:
             logging.error("from_date must be lower than to_date!")
             logging.error("from_date is {}".format(from_date))
             logging.error("to_date is {}".format(to_date))
-            return []
+            return empty_columns()
         connection = KlineBtcUSDT1mConnector()
         db_last_date = connection.last_date()
         if db_last_date < to_date:
             # 历史数据不足 刷历史数据
             connection.collect_up2date_data(db_last_date)
         # 读取数据
-        return connection.select(from_date, to_date, order=order)
+        return get_kline_cache(connection).get_columns(from_date, to_date, interval=granularity)
+
+    def get_kline(self, from_date: datetime, to_date: datetime, granularity: str = '1m', order: str = 'ASC') -> List[
+        KlineBtcUSDT1mDao]:
+        result = columns_to_kline_daos(self.get_kline_columns(from_date, to_date, granularity))
+        if order.upper() == 'DESC':
+            result.reverse()
+        return result
 
 
 def test():
@@ -29,6 +46,9 @@ def test():
     for row in result:
         logging.info(row[0])
     # logging.info(result)
+    result = KlineBTCUSDT1M().get_kline(from_date=from_date, to_date=datetime(2024, 12, 24, 0, 0), granularity='1h')
+    for row in result:
+        logging.info(f"{row.open_time} {row.open_price} {row.close_price}")
 
 
 if __name__ == '__main__':
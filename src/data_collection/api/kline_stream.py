@@ -0,0 +1,237 @@
+"""
+Binance k线websocket实时采集
+1.asyncio常驻服务 订阅多个symbol的k线stream
+2.每个symbol在内存中保存最近N根已收盘k线（定长numpy环形缓冲区） 策略可直接读取 无需访问数据库
+3.已收盘的k线按数量或时间攒批 在线程池中列式写入clickhouse 不阻塞事件循环
+"""
+import asyncio
+import json
+import time
+from typing import Dict, List, Callable
+
+import numpy as np
+import websockets
+
+from data_collection.api.binance_api import KLINE_COLUMNS, KLINE_DTYPE
+from log import *
+
+BINANCE_STREAM_URL = 'wss://stream.binance.com:9443/stream'
+
+
+class KlineRingBuffer:
+    """
+    定长环形缓冲区 保存最近capacity根k线
+    底层为预分配的numpy结构化数组 追加时原地写入
+    """
+
+    def __init__(self, capacity: int):
+        if capacity <= 0:
+            raise ValueError(f'capacity must be positive, not "{capacity}"')
+        self.capacity = capacity
+        self.data = np.zeros(capacity, dtype=KLINE_DTYPE)
+        self.size = 0  # 已写入的k线数量（最多capacity）
+        self.head = 0  # 下一次写入的位置
+
+    def append(self, row: tuple):
+        """
+        追加一根k线
+        :param row: 字段顺序与KLINE_COLUMNS一致
+        :return:
+        """
+        self.data[self.head] = row
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def last_open_time(self) -> int | None:
+        if self.size == 0:
+            return None
+        return int(self.data['open_time'][(self.head - 1) % self.capacity])
+
+    def latest(self, n: int | None = None) -> Dict[str, np.ndarray]:
+        """
+        按时间升序返回最近n根k线
+        :param n: 默认返回全部
+        :return: 列名 -> numpy数组（拷贝）
+        """
+        n = self.size if n is None else min(n, self.size)
+        index = (np.arange(self.head - n, self.head)) % self.capacity
+        rows = self.data[index]
+        return {name: rows[name] for name in KLINE_COLUMNS}
+
+    def __len__(self):
+        return self.size
+
+
+def parse_kline_event(event: dict) -> tuple:
+    """
+    将websocket推送的k线事件解析为与KLINE_COLUMNS顺序一致的元组
+    :param event: {"e": "kline", "s": "BTCUSDT", "k": {...}}
+    :return:
+    """
+    k = event['k']
+    return (
+        int(k['t']), float(k['o']), float(k['h']), float(k['l']), float(k['c']), float(k['v']),
+        int(k['T']), float(k['q']), int(k['n']), float(k['V']), float(k['Q']),
+    )
+
+
+class KlineStreamService:
+    """
+    k线实时采集服务
+    """
+
+    def __init__(
+            self,
+            symbols: List[str],
+            interval: str = '1m',
+            buffer_size: int = 1440,
+            batch_size: int = 100,
+            flush_interval: float = 5.0,
+            url: str = BINANCE_STREAM_URL,
+            sink: Callable[[str, Dict[str, np.ndarray]], None] | None = None,
+    ):
+        """
+
+        :param symbols: 如 ['BTCUSDT', 'ETHUSDT']
+        :param interval: k线周期
+        :param buffer_size: 每个symbol在内存中保存的k线数量
+        :param batch_size: 攒够多少根k线后写库
+        :param flush_interval: 最长多久写一次库（秒）
+        :param url: websocket地址 测试时可指向本地服务
+        :param sink: 写库函数 参数(symbol, 列式k线) 默认写入对应的KlineStore
+        """
+        self.symbols = [symbol.upper() for symbol in symbols]
+        self.interval = interval
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.url = url
+        self.sink = sink if sink is not None else self._store_sink
+        self.buffers: Dict[str, KlineRingBuffer] = {symbol: KlineRingBuffer(buffer_size) for symbol in self.symbols}
+        self.pending: Dict[str, List[tuple]] = {symbol: [] for symbol in self.symbols}
+        self.last_flush = time.monotonic()
+        self.stop_event = asyncio.Event()
+
+    def _store_sink(self, symbol: str, columns: Dict[str, np.ndarray]):
+        from data_collection.dao.kline_store import get_kline_store
+        get_kline_store(symbol, self.interval).insert_columns(columns)
+
+    def stream_url(self) -> str:
+        streams = '/'.join(f"{symbol.lower()}@kline_{self.interval}" for symbol in self.symbols)
+        return f"{self.url}?streams={streams}"
+
+    def latest(self, symbol: str, n: int | None = None) -> Dict[str, np.ndarray]:
+        """
+        读取内存中最近n根已收盘k线
+        """
+        return self.buffers[symbol.upper()].latest(n)
+
+    def on_message(self, message: str | bytes):
+        """
+        处理一条推送 只保留已收盘的k线
+        """
+        payload = json.loads(message)
+        event = payload.get('data', payload)
+        if event.get('e') != 'kline' or not event['k']['x']:
+            return
+        symbol = event['s']
+        buffer = self.buffers.get(symbol)
+        if buffer is None:
+            return
+        row = parse_kline_event(event)
+        # 断线重连后可能收到重复的k线
+        last_open_time = buffer.last_open_time()
+        if last_open_time is not None and row[0] <= last_open_time:
+            return
+        buffer.append(row)
+        self.pending[symbol].append(row)
+
+    async def flush(self):
+        """
+        将攒批的k线写库 在默认线程池中执行
+        """
+        self.last_flush = time.monotonic()
+        loop = asyncio.get_running_loop()
+        for symbol, rows in self.pending.items():
+            if len(rows) == 0:
+                continue
+            self.pending[symbol] = []
+            table = np.array(rows, dtype=KLINE_DTYPE)
+            columns = {name: table[name] for name in KLINE_COLUMNS}
+            try:
+                await loop.run_in_executor(None, self.sink, symbol, columns)
+            except Exception as e:
+                logging.error(f"write {symbol} klines failed: {e}")
+                # 写库失败 放回队首 下次重试
+                self.pending[symbol] = rows + self.pending[symbol]
+
+    def _should_flush(self) -> bool:
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            return True
+        return any(len(rows) >= self.batch_size for rows in self.pending.values())
+
+    async def run(self):
+        """
+        常驻运行 断线后指数退避重连 直到stop()
+        """
+        backoff = 1.0
+        while not self.stop_event.is_set():
+            try:
+                async with websockets.connect(self.stream_url(), ping_interval=20) as ws:
+                    logging.info(f"kline stream connected: {self.symbols}")
+                    backoff = 1.0
+                    while not self.stop_event.is_set():
+                        try:
+                            message = await asyncio.wait_for(ws.recv(), timeout=self.flush_interval)
+                            self.on_message(message)
+                        except asyncio.TimeoutError:
+                            pass
+                        if self._should_flush():
+                            await self.flush()
+            except (OSError, websockets.WebSocketException) as e:
+                logging.warning(f"kline stream disconnected: {e}, reconnect in {backoff:.0f}s")
+                try:
+                    await asyncio.wait_for(self.stop_event.wait(), timeout=backoff)
+                except asyncio.TimeoutError:
+                    pass
+                backoff = min(backoff * 2, 60.0)
+        await self.flush()
+
+    def stop(self):
+        self.stop_event.set()
+
+
+def test():
+    """
+    使用本地websocket服务模拟Binance推送
+    """
+
+    async def fake_binance(ws):
+        for i in range(5):
+            open_time = 1735689600000 + i * 60000
+            for closed in (False, True):
+                event = {'e': 'kline', 's': 'BTCUSDT', 'k': {
+                    't': open_time, 'T': open_time + 59999, 'o': '1', 'h': '2', 'l': '0.5', 'c': str(1.5 + i),
+                    'v': '10', 'n': 3, 'x': closed, 'q': '15', 'V': '4', 'Q': '6'}}
+                await ws.send(json.dumps({'stream': 'btcusdt@kline_1m', 'data': event}))
+        await asyncio.sleep(1)
+
+    async def main():
+        written = []
+        async with websockets.serve(fake_binance, '127.0.0.1', 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            service = KlineStreamService(
+                ['BTCUSDT'], buffer_size=3, batch_size=2, flush_interval=0.2,
+                url=f'ws://127.0.0.1:{port}/stream', sink=lambda symbol, columns: written.append(columns)
+            )
+            task = asyncio.create_task(service.run())
+            await asyncio.sleep(0.5)
+            service.stop()
+            await task
+        logging.info(f"ring buffer: {service.latest('BTCUSDT')['close_price']}")  # 最近3根
+        logging.info(f"written: {sum(len(c['open_time']) for c in written)} klines in {len(written)} batches")
+
+    asyncio.run(main())
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,113 @@
+"""
+Binance请求权重限流
+Binance按IP统计每分钟的请求权重(REQUEST_WEIGHT 现货默认6000/min)
+每个响应头中的 X-MBX-USED-WEIGHT-1M 返回当前窗口已使用的权重
+"""
+import threading
+import time
+from typing import Mapping
+
+from log import *
+
+USED_WEIGHT_HEADER = 'X-MBX-USED-WEIGHT-1M'
+
+
+class WeightTokenBucket:
+    """
+    权重令牌桶
+    1.令牌以 capacity / refill_period 的速度匀速补充
+    2.每次请求前调用 acquire(weight) 扣除令牌 令牌不足时阻塞等待
+    3.每次响应后调用 update_from_headers(headers) 用服务端已用权重校准本地令牌数
+      （多进程/多机器共享同一IP时 本地计数会偏少 以服务端为准）
+    4.收到429/418时调用 penalize(retry_after) 在指定时间内暂停所有请求
+    线程安全
+    """
+
+    def __init__(self, capacity: int = 6000, refill_period: float = 60.0, safety_ratio: float = 0.8):
+        """
+
+        :param capacity: 每个周期的权重上限
+        :param refill_period: 周期长度（秒）
+        :param safety_ratio: 实际使用的权重比例 为其他程序预留余量
+        """
+        if capacity <= 0:
+            raise ValueError(f'capacity must be positive, not "{capacity}"')
+        if not 0 < safety_ratio <= 1:
+            raise ValueError(f'safety_ratio must be in (0, 1], not "{safety_ratio}"')
+        self.capacity = capacity * safety_ratio
+        self.refill_rate = self.capacity / refill_period  # 每秒补充的令牌数
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.blocked_until = 0.0  # 被服务端限流时 暂停请求直到该时刻
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.refill_rate)
+        self.last_refill = now
+
+    def acquire(self, weight: int = 1):
+        """
+        扣除weight个令牌 令牌不足时阻塞
+        :param weight: 请求权重
+        :return:
+        """
+        if weight > self.capacity:
+            raise ValueError(f'weight {weight} exceeds capacity {self.capacity}')
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.tokens >= weight:
+                    self.tokens -= weight
+                    return
+                else:
+                    wait = (weight - self.tokens) / self.refill_rate
+            time.sleep(wait)
+
+    def update_from_headers(self, headers: Mapping[str, str]):
+        """
+        根据响应头校准令牌数
+        :param headers: 响应头
+        :return:
+        """
+        used = headers.get(USED_WEIGHT_HEADER) if headers is not None else None
+        if used is None:
+            return
+        try:
+            used = int(used)
+        except ValueError:
+            return
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, self.capacity - used)
+
+    def penalize(self, retry_after: float):
+        """
+        服务端返回429/418时 暂停所有请求
+        :param retry_after: 暂停时间（秒）
+        :return:
+        """
+        logging.warning(f"binance rate limit hit, pause requests for {retry_after}s")
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            self.tokens = 0
+
+
+# 进程内共享的限流器 同一IP下的所有请求共用
+binance_rate_limiter = WeightTokenBucket()
+
+
+def test():
+    bucket = WeightTokenBucket(capacity=10, refill_period=1.0, safety_ratio=1)
+    start = time.monotonic()
+    for _ in range(20):
+        bucket.acquire(1)
+    logging.info(f"20 requests with capacity 10/s took {time.monotonic() - start:.2f}s")
+    bucket.update_from_headers({USED_WEIGHT_HEADER: '10'})
+    logging.info(f"tokens after header sync: {bucket.tokens:.2f}")
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,148 @@
+"""
+Binance历史归档文件批量导入
+支持两种格式：
+1.Binance月度归档 https://data.binance.vision 的 .zip 或解压后的 .csv
+  无表头 12列 open_time/close_time为毫秒时间戳（2025年起的现货归档为微秒）
+2.本地整理的csv 如 data/btc_data.csv
+  有表头 Open Time,Open,High,Low,Close,Volume open_time为日期字符串
+文件按块流式读取 不会一次性加载整个文件 每块向量化转换后列式写入
+"""
+import glob
+import os
+import zipfile
+from typing import Dict, Iterator, List, IO
+
+import numpy as np
+import pandas as pd
+
+from data_collection.api.binance_api import KLINE_COLUMNS, interval_to_milliseconds
+from data_collection.dao.kline_store import KlineStore, get_kline_store
+from log import *
+
+ARCHIVE_COLUMNS = list(KLINE_COLUMNS) + ['ignore']
+
+# 本地csv的表头 -> kline表字段
+HEADER_COLUMNS = {
+    'Open Time': 'open_time',
+    'Open': 'open_price',
+    'High': 'high_price',
+    'Low': 'low_price',
+    'Close': 'close_price',
+    'Volume': 'volume',
+    'Close Time': 'close_time',
+    'Quote Asset Volume': 'quote_asset_volume',
+    'Number of Trades': 'num_of_trades',
+    'Taker Buy Base Volume': 'taker_buy_base_volume',
+    'Taker Buy Quote Volume': 'taker_buy_quote_volume',
+}
+
+
+def _to_milliseconds(column: pd.Series) -> np.ndarray:
+    """
+    时间列统一转换为毫秒时间戳
+    """
+    if pd.api.types.is_numeric_dtype(column):
+        values = column.to_numpy(dtype=np.int64)
+        # 微秒时间戳（2025年起的现货归档）
+        return np.where(values > 10 ** 14, values // 1000, values)
+    return pd.to_datetime(column).to_numpy().astype('datetime64[ms]').astype(np.int64)
+
+
+def _chunk_to_columns(chunk: pd.DataFrame, interval_ms: int) -> Dict[str, np.ndarray]:
+    """
+    将一个数据块转换为列式k线 缺失的列补0 缺失的close_time由open_time推算
+    """
+    columns: Dict[str, np.ndarray] = {}
+    rows = len(chunk)
+    for name, dtype in KLINE_COLUMNS.items():
+        if name in ('open_time', 'close_time'):
+            continue
+        if name in chunk:
+            columns[name] = chunk[name].to_numpy(dtype=dtype)
+        else:
+            columns[name] = np.zeros(rows, dtype=dtype)
+    columns['open_time'] = _to_milliseconds(chunk['open_time'])
+    if 'close_time' in chunk:
+        columns['close_time'] = _to_milliseconds(chunk['close_time'])
+    else:
+        columns['close_time'] = columns['open_time'] + interval_ms - 1
+    return {name: columns[name] for name in KLINE_COLUMNS}
+
+
+def _read_chunks(f: IO[bytes], chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """
+    按块读取csv 根据首个字符判断是否有表头（peek 不消耗数据）
+    """
+    if f.peek(1)[:1].isdigit():
+        # Binance归档 无表头
+        reader = pd.read_csv(f, header=None, names=ARCHIVE_COLUMNS, chunksize=chunk_rows)
+    else:
+        reader = pd.read_csv(f, chunksize=chunk_rows)
+    for chunk in reader:
+        yield chunk.rename(columns=lambda name: HEADER_COLUMNS.get(name.strip(), name.strip()))
+
+
+def iter_archive_columns(path: str, interval: str = '1m', chunk_rows: int = 500_000
+                         ) -> Iterator[Dict[str, np.ndarray]]:
+    """
+    流式读取一个归档文件
+    :param path: .zip 或 .csv
+    :param interval: k线周期 用于推算缺失的close_time
+    :param chunk_rows: 每块的行数
+    :return: 列式k线 见 data_collection.api.binance_api.KLINE_COLUMNS
+    """
+    interval_ms = interval_to_milliseconds(interval)
+    if path.endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.namelist():
+                if not member.endswith('.csv'):
+                    continue
+                with archive.open(member) as f:
+                    for chunk in _read_chunks(f, chunk_rows):
+                        yield _chunk_to_columns(chunk, interval_ms)
+    else:
+        with open(path, 'rb') as f:
+            for chunk in _read_chunks(f, chunk_rows):
+                yield _chunk_to_columns(chunk, interval_ms)
+
+
+def load_archives(paths: List[str], store: KlineStore, chunk_rows: int = 500_000) -> int:
+    """
+    批量导入归档文件
+    库中已有的k线会被跳过 只写入缺失的k线 可填补已有区间内部的缺口 见 KlineStore.drop_existing
+    :param paths: 文件路径列表
+    :param store: 目标k线存储
+    :param chunk_rows: 每块的行数 即每次写库的行数
+    :return: 写入的数据条数
+    """
+    total = 0
+    for path in sorted(paths):
+        rows = 0
+        for columns in iter_archive_columns(path, interval=store.key.interval, chunk_rows=chunk_rows):
+            columns = store.drop_existing(columns)
+            store.insert_columns(columns)
+            rows += len(columns['open_time'])
+        logging.info(f"{os.path.basename(path)}: {rows} rows loaded into {store.table_name}")
+        total += rows
+    logging.info(f"{len(paths)} files, {total} rows loaded into {store.table_name}")
+    return total
+
+
+def load_archive_dir(directory: str, symbol: str = 'BTCUSDT', interval: str = '1m', chunk_rows: int = 500_000) -> int:
+    """
+    导入目录下的所有 .zip/.csv 归档文件
+    """
+    paths = glob.glob(os.path.join(directory, '*.zip')) + glob.glob(os.path.join(directory, '*.csv'))
+    return load_archives(paths, get_kline_store(symbol, interval), chunk_rows=chunk_rows)
+
+
+def test():
+    path = os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'btc_data.csv')
+    rows = 0
+    for columns in iter_archive_columns(path, chunk_rows=100_000):
+        rows += len(columns['open_time'])
+    logging.info(f"{rows} rows, first open_time: {columns['open_time'][0]}, last close: {columns['close_price'][-1]}")
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,151 @@
+"""
+asyncio调用方使用的非阻塞数据库访问
+clickhouse_driver是阻塞的 直接在事件循环中调用会卡住行情处理和下单
+AsyncConnector把任意connector（KlineStore、StrategyStatusBtcUSDT1mConnector、StrategyActionBtcUSDT1mConnector）
+的调用放到专用线程池中执行：
+1.select/select_columns: 可await的查询
+2.select_iter: 异步迭代器 每次取下一块时才在线程池中读取 消费方处理慢时不会堆积数据
+3.insert_nowait: 提交后立即返回 不等待数据库往返 失败时记录日志
+并发数由线程池大小和信号量共同限制 默认与连接池大小一致 超出的调用在事件循环中排队 不占用线程
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncIterator, Dict, Set
+
+import numpy as np
+
+from config import CLICKHOUSE_POOL_SIZE
+from log import *
+
+_END = object()
+
+
+class AsyncConnector:
+    def __init__(self, connector, max_concurrency: int = CLICKHOUSE_POOL_SIZE):
+        """
+
+        :param connector: 被包装的同步connector
+        :param max_concurrency: 同时进行的数据库调用数 不宜超过连接池大小
+        """
+        self.connector = connector
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='clickhouse-async')
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.inserts: Set[asyncio.Task] = set()  # 未完成的insert_nowait 保留引用防止被回收
+
+    async def call(self, method: str, *args, **kwargs) -> Any:
+        """
+        在线程池中调用connector的方法
+        :param method: 方法名
+        :return: 方法的返回值
+        """
+        function = partial(getattr(self.connector, method), *args, **kwargs)
+        async with self.semaphore:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, function)
+
+    async def select(self, *args, **kwargs) -> list:
+        return await self.call('select', *args, **kwargs)
+
+    async def select_columns(self, *args, **kwargs) -> Dict[str, np.ndarray]:
+        return await self.call('select_columns', *args, **kwargs)
+
+    async def select_iter(self, *args, **kwargs) -> AsyncIterator[Dict[str, np.ndarray]]:
+        """
+        流式读取 参数见connector的select_iter
+        迭代期间占用一个并发名额（对应一个数据库连接） 提前退出时关闭同步迭代器以归还连接
+        """
+        loop = asyncio.get_running_loop()
+        async with self.semaphore:
+            iterator = self.connector.select_iter(*args, **kwargs)
+            try:
+                while True:
+                    block = await loop.run_in_executor(self.executor, next, iterator, _END)
+                    if block is _END:
+                        return
+                    yield block
+            finally:
+                await loop.run_in_executor(self.executor, iterator.close)
+
+    def insert_nowait(self, method: str, *args, **kwargs) -> asyncio.Task:
+        """
+        提交写入后立即返回
+        多次提交的写入可能并发执行 不保证顺序
+        高频写入优先使用strategy connector的insert_*_queue 只是放入共享的BatchWriter 由其合并批次
+        :param method: 写入方法名 如insert_many、insert_columns、insert_many_queue
+        :return: 可选择await的task 失败时已记录日志
+        """
+        task = asyncio.get_running_loop().create_task(self.call(method, *args, **kwargs))
+        self.inserts.add(task)
+        task.add_done_callback(self._insert_done)
+        return task
+
+    def _insert_done(self, task: asyncio.Task):
+        self.inserts.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"async insert into {type(self.connector).__name__} failed: {task.exception()}")
+
+    async def flush(self, timeout: float | None = None) -> bool:
+        """
+        等待已提交的insert_nowait完成 以及connector异步队列中的数据写入
+        :param timeout: 超时时间（秒） 为空则一直等待
+        :return: 是否全部写入
+        """
+        if self.inserts:
+            done, pending = await asyncio.wait(set(self.inserts), timeout=timeout)
+            if pending:
+                return False
+        if hasattr(self.connector, 'flush'):
+            return await self.call('flush', timeout)
+        return True
+
+    async def close(self):
+        await self.flush()
+        self.executor.shutdown(wait=True)
+
+
+def test():
+    import time
+
+    class FakeConnector:
+        def __init__(self):
+            self.rows = []
+
+        def select(self, n):
+            time.sleep(0.2)  # 模拟数据库往返
+            return list(range(n))
+
+        def select_iter(self, n, block_size):
+            for i in range(0, n, block_size):
+                time.sleep(0.05)
+                yield {'open_time': np.arange(i, min(n, i + block_size))}
+
+        def insert_many(self, data):
+            time.sleep(0.2)
+            self.rows.extend(data)
+
+    async def main():
+        connector = AsyncConnector(FakeConnector(), max_concurrency=2)
+        ticks = 0
+
+        async def market_data():
+            nonlocal ticks
+            for _ in range(50):
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        start = time.perf_counter()
+        ticker = asyncio.create_task(market_data())
+        for i in range(5):
+            connector.insert_nowait('insert_many', [i])
+        result = await connector.select(3)
+        blocks = [len(block['open_time']) async for block in connector.select_iter(10, 4)]
+        await ticker
+        await connector.close()
+        logging.info(f"select {result}, blocks {blocks}, inserted {connector.connector.rows}, "
+                     f"{ticks} ticks in {time.perf_counter() - start:.2f}s")
+
+    asyncio.run(main())
+
+
+if __name__ == '__main__':
+    test()
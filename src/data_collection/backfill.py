@@ -0,0 +1,216 @@
+"""
+k线历史数据并发回填
+1.将 [from_date, to_date] 按 limit * interval 切分为互相独立的时间窗口 每个窗口恰好对应一次请求
+2.使用线程池并发拉取各窗口 请求权重由 WeightTokenBucket 控制 不再使用固定sleep
+3.拉取结果在主线程中顺序落库（clickhouse client非线程安全）
+4.已完成的窗口追加写入checkpoint文件 中断后重新运行会跳过已完成的窗口
+时间均为UTC墙上时间（与数据库中的DateTime列一致） 见 data_collection.api.binance_api.datetime_to_ms
+"""
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed, Future
+from datetime import datetime, timezone
+from typing import Callable, List, Set, Dict, Any
+
+import pandas as pd
+
+from data_collection.api.binance_api import interval_to_milliseconds, datetime_to_ms, ms_to_datetime
+from log import *
+
+# 时间窗口 [start, end] 毫秒时间戳 均包含
+BackfillWindow = namedtuple('BackfillWindow', ['start', 'end'])
+
+
+class KlineBackfill:
+    """
+    k线并发回填引擎
+    窗口按绝对时间对齐（窗口起点 = span的整数倍） 保证不同from_date的多次运行得到相同的窗口 checkpoint可复用
+    """
+
+    def __init__(
+            self,
+            fetch: Callable[[datetime, datetime], Any],
+            save: Callable[[Any], None],
+            interval: str = '1m',
+            limit: int = 1000,
+            max_workers: int = 8,
+            checkpoint_path: str | None = None,
+            max_retries: int = 5,
+            size: Callable[[Any], int] = len,
+    ):
+        """
+
+        :param fetch: 拉取函数 参数(start_time, end_time) 返回该区间的k线
+        :param save: 落库函数 参数为fetch的返回值
+        :param interval: k线周期
+        :param limit: 单次请求的最大条数
+        :param max_workers: 并发线程数
+        :param checkpoint_path: checkpoint文件路径 为空则不支持断点续传
+        :param max_retries: 单个窗口的最大重试次数
+        :param size: 计算fetch返回值的数据条数 默认为len（DataFrame） 列式数据需自行指定
+        """
+        self.fetch = fetch
+        self.save = save
+        self.interval_ms = interval_to_milliseconds(interval)
+        self.span_ms = self.interval_ms * limit
+        self.max_workers = max_workers
+        self.checkpoint_path = checkpoint_path
+        self.max_retries = max_retries
+        self.size = size
+        self.checkpoint_lock = threading.Lock()
+
+    def split_windows(self, from_date: datetime, to_date: datetime) -> List[BackfillWindow]:
+        """
+        切分时间窗口
+        :param from_date:
+        :param to_date:
+        :return:
+        """
+        from_ms = datetime_to_ms(from_date)
+        to_ms = datetime_to_ms(to_date)
+        windows = []
+        start = from_ms - from_ms % self.span_ms
+        while start <= to_ms:
+            windows.append(BackfillWindow(start, start + self.span_ms - 1))
+            start += self.span_ms
+        return windows
+
+    def load_checkpoint(self) -> Set[int]:
+        """
+        读取已完成窗口的起点
+        :return:
+        """
+        if self.checkpoint_path is None or not os.path.exists(self.checkpoint_path):
+            return set()
+        with open(self.checkpoint_path, 'r') as f:
+            return {int(line) for line in f if line.strip()}
+
+    def save_checkpoint(self, window: BackfillWindow):
+        if self.checkpoint_path is None:
+            return
+        with self.checkpoint_lock:
+            with open(self.checkpoint_path, 'a') as f:
+                f.write(f"{window.start}\n")
+
+    def _fetch_window(self, start: int, end: int) -> Any:
+        """
+        在线程池中执行 拉取 [start, end] 区间 失败时指数退避重试
+        """
+        for attempt in range(self.max_retries):
+            try:
+                return self.fetch(ms_to_datetime(start), ms_to_datetime(end))
+            except Exception as e:
+                if attempt == self.max_retries - 1:
+                    raise
+                backoff = min(60.0, 2 ** attempt) * (0.5 + random.random())
+                logging.warning(f"fetch window {ms_to_datetime(start)} failed: {e}, retry in {backoff:.1f}s")
+                time.sleep(backoff)
+
+    def run(self, from_date: datetime, to_date: datetime | None = None) -> int:
+        """
+        执行回填
+        :param from_date: 开始时间
+        :param to_date: 结束时间 默认为当前时间（UTC）
+        :return: 写入的数据条数
+        """
+        if to_date is None:
+            to_date = datetime.now(timezone.utc).replace(tzinfo=None)
+        from_ms = datetime_to_ms(from_date)
+        to_ms = datetime_to_ms(to_date)
+        finished = self.load_checkpoint()
+        windows = [w for w in self.split_windows(from_date, to_date) if w.start not in finished]
+        logging.info(f"backfill {len(windows)} windows from {from_date} to {to_date}, "
+                     f"{len(finished)} windows already finished")
+        # 只记录完整拉取的窗口 第一个窗口只拉取了from_ms之后的部分 最后一个窗口尚未结束 均不记录
+        # 否则更早的from_date再次运行时会跳过这些窗口的其余部分
+        tasks = [(BackfillWindow(max(w.start, from_ms), min(w.end, to_ms)),
+                  w if w.start >= from_ms and w.end <= to_ms else None)
+                 for w in windows]
+        return self._run_tasks(tasks)
+
+    def run_ranges(self, ranges: List[tuple]) -> int:
+        """
+        只回填指定的时间区间 用于修补缺失数据 不使用checkpoint
+        :param ranges: [(start, end), ...] 毫秒时间戳 均包含
+        由数据库中的DateTime（UTC墙上时间）换算时使用 data_collection.dao.kline_store.wall_clock_ms
+        :return: 写入的数据条数
+        """
+        tasks = []
+        for start, end in ranges:
+            while start <= end:
+                tasks.append((BackfillWindow(start, min(start + self.span_ms - 1, end)), None))
+                start += self.span_ms
+        logging.info(f"backfill {len(tasks)} windows in {len(ranges)} ranges")
+        return self._run_tasks(tasks)
+
+    def _run_tasks(self, tasks: List[tuple]) -> int:
+        """
+        并发拉取 主线程落库
+        :param tasks: [(拉取区间, 完成后写入checkpoint的窗口 或 None), ...]
+        :return: 写入的数据条数
+        """
+        total = 0
+        failed: List[BackfillWindow] = []
+        pending: Dict[Future, tuple] = {}
+        task_iter = iter(tasks)
+        max_pending = self.max_workers * 2  # 限制在途窗口数 避免结果堆积在内存中
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                for task in task_iter:
+                    fetch_range = task[0]
+                    pending[executor.submit(self._fetch_window, fetch_range.start, fetch_range.end)] = task
+                    if len(pending) >= max_pending:
+                        break
+                if not pending:
+                    break
+                future = next(as_completed(pending))
+                fetch_range, checkpoint_window = pending.pop(future)
+                try:
+                    data = future.result()
+                except Exception as e:
+                    logging.error(f"backfill window {ms_to_datetime(fetch_range.start)} failed: {e}")
+                    failed.append(fetch_range)
+                    continue
+                size = self.size(data)
+                if size > 0:
+                    self.save(data)
+                    total += size
+                if checkpoint_window is not None:
+                    self.save_checkpoint(checkpoint_window)
+        if failed:
+            logging.error(f"backfill finished with {len(failed)} failed windows, rerun to resume")
+        else:
+            logging.info(f"backfill finished, {total} rows saved")
+        return total
+
+
+def test():
+    import tempfile
+
+    saved = []
+
+    def fetch(start_time: datetime, end_time: datetime) -> pd.DataFrame:
+        return pd.DataFrame({'Open Time': pd.date_range(start_time, end_time, freq='1min')})
+
+    backfill = KlineBackfill(fetch=fetch, save=saved.append, max_workers=4)
+    total = backfill.run(datetime(2024, 12, 1, 0, 0), datetime(2024, 12, 10, 0, 0))
+    logging.info(f"{len(saved)} windows, {total} rows")
+
+    # 第一个窗口只拉取了一部分 不记入checkpoint 更早的from_date再次运行时补齐
+    with tempfile.TemporaryDirectory() as directory:
+        checkpoint_path = os.path.join(directory, 'checkpoint')
+        saved.clear()
+        backfill = KlineBackfill(fetch=fetch, save=saved.append, max_workers=4, checkpoint_path=checkpoint_path)
+        backfill.run(datetime(2024, 12, 1, 12, 0), datetime(2024, 12, 10, 0, 0))
+        backfill.run(datetime(2024, 12, 1, 0, 0), datetime(2024, 12, 10, 0, 0))
+        opened = pd.concat(saved)['Open Time']
+        expected = pd.date_range(datetime(2024, 12, 1, 0, 0), datetime(2024, 12, 10, 0, 0), freq='1min')
+        logging.info(f"rerun with earlier from_date: {opened.nunique()} of {len(expected)} rows")
+        assert set(expected) <= set(opened)
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,636 @@
+"""
+通用k线存储
+以 (exchange, market, symbol, interval) 为键 所有symbol共用同一套查询/写入/回填逻辑和同一个数据库连接
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Callable, Iterator
+
+import numpy as np
+import pandas as pd
+
+from data_collection.api.binance_api import get_binance_spot_trading_klines_columnar, KLINE_COLUMNS, \
+    interval_to_milliseconds, datetime_to_ms
+from data_collection.api.http_client import get_http_client
+from data_collection.backfill import KlineBackfill
+from data_collection.db import ClickHouseManager, shared_db_connection
+from log import *
+
+'''
+Binance kline接口 返回字段解析
+
+字段解释：
+1.Open time (开盘时间)：
+字段位置：[0]
+类型：时间戳（毫秒）
+解释：当前K线的开盘时间，表示K线开始的时间点。它是一个毫秒级的时间戳，可以转换为常见的日期时间格式。
+
+2.Open price (开盘价)：
+字段位置：[1]
+类型：字符串（Decimal）
+解释：当前K线的开盘价格，即K线开始时的交易价格。
+
+3.High price (最高价)：
+字段位置：[2]
+类型：字符串（Decimal）
+解释：当前K线的最高交易价格。在当前K线周期内，交易的最高价格。
+
+4.Low price (最低价)：
+字段位置：[3]
+类型：字符串（Decimal）
+解释：当前K线的最低交易价格。在当前K线周期内，交易的最低价格。
+
+5.Close price (收盘价)：
+字段位置：[4]
+类型：字符串（Decimal）
+解释：当前K线的收盘价格，即K线周期结束时的最后交易价格。
+
+6.Volume (交易量)：
+字段位置：[5]
+类型：字符串（Decimal）
+解释：当前K线周期内的交易量。它是当前K线周期内交易的总数量。
+
+7.Close time (闭盘时间)：
+字段位置：[6]
+类型：时间戳（毫秒）
+解释：当前K线的结束时间，表示K线周期的结束时间。它也是一个毫秒级的时间戳。
+
+8.Quote asset volume (成交金额)：
+字段位置：[7]
+类型：字符串（Decimal）
+解释：在当前K线周期内，以报价资产（比如 USDT）计算的交易量。例如，如果K线数据是BTC/USDT交易对，它表示的是该周期内交易的USDT总额。
+
+9.Number of trades (交易笔数)：
+字段位置：[8]
+类型：整数
+解释：当前K线周期内的交易次数（即交易的订单数量）。
+
+10.Taker buy base asset volume (主动买入的基础资产数量)：
+字段位置：[9]
+类型：字符串（Decimal）
+解释：当前K线周期内，主动买入的基础资产（如 BTC）的总量。主动买入意味着买方在订单簿的卖方价格上进行买入。
+
+11.Taker buy quote asset volume (主动买入的报价资产数量)：
+字段位置：[10]
+类型：字符串（Decimal）
+解释：当前K线周期内，主动买入的报价资产（如 USDT）的总量。
+
+12.Ignore (忽略字段)：
+字段位置：[11]
+类型：整数（通常为0）
+解释：该字段在币安API中一般不使用，可以忽略。
+'''
+
+KlineKey = namedtuple('KlineKey', ['exchange', 'market', 'symbol', 'interval'])
+
+KlineDao = namedtuple(
+    'KlineDao',
+    [
+        'open_time', 'open_price', 'high_price', 'low_price', 'close_price', 'volume',
+        'close_time', 'quote_asset_volume', 'num_of_trades',
+        'taker_buy_base_volume', 'taker_buy_quote_volume'
+    ]
+)
+
+KlineDaoSimple = namedtuple(
+    'KlineDaoSimple',
+    [
+        'datetime', 'open', 'high', 'low', 'close', 'volume'
+    ]
+)
+
+KLINE_FIELDS = ', '.join(KlineDao._fields)
+
+# 缺失的k线区间 start/end 为缺失的第一根/最后一根k线的open_time（均包含） missing 为缺失的k线数量
+KlineGap = namedtuple('KlineGap', ['start', 'end', 'missing'])
+
+# 用于从symbol中拆分出计价货币 按长度降序匹配
+QUOTE_ASSETS = ['FDUSD', 'USDT', 'USDC', 'BUSD', 'TUSD', 'USD', 'BTC', 'ETH', 'BNB']
+
+# (exchange, market) -> 列式k线拉取函数 参数(start_time, symbol, interval, limit, end_time)
+KLINE_FETCHERS: Dict[tuple, Callable[..., Dict[str, np.ndarray]]] = {
+    ('binance', 'spot'): get_binance_spot_trading_klines_columnar,
+}
+
+
+def from_KlineDao_to_KlineDaoSimple(data: KlineDao) -> KlineDaoSimple:
+    return KlineDaoSimple(data[0], data[1], data[2], data[3], data[4], data[5])
+
+
+def from_list_KlineDao_to_KlineDaoSimple(data: List[KlineDao]) -> List[KlineDaoSimple]:
+    return [from_KlineDao_to_KlineDaoSimple(x) for x in data]
+
+
+def split_symbol(symbol: str) -> tuple:
+    """
+    拆分交易对 'BTCUSDT' -> ('btc', 'usdt')
+    无法识别计价货币时 返回 (symbol, '')
+    """
+    symbol = symbol.upper()
+    for quote in QUOTE_ASSETS:
+        if symbol.endswith(quote) and len(symbol) > len(quote):
+            return symbol[:-len(quote)].lower(), quote.lower()
+    return symbol.lower(), ''
+
+
+def table_name_of(key: KlineKey) -> str:
+    """
+    表名
+    binance现货沿用原有命名 kline_btc_usdt_1m
+    其他市场加上交易所和市场前缀 kline_binance_futures_btc_usdt_1m
+    """
+    base, quote = split_symbol(key.symbol)
+    symbol_part = f"{base}_{quote}" if quote else base
+    if key.exchange == 'binance' and key.market == 'spot':
+        return f"kline_{symbol_part}_{key.interval}"
+    return f"kline_{key.exchange}_{key.market}_{symbol_part}_{key.interval}"
+
+
+def find_gaps_in_timestamps(open_times: np.ndarray, step: int, from_time: int, to_time: int) -> np.ndarray:
+    """
+    向量化计算缺失的k线区间
+    :param open_times: 升序的open_time 任意整数时间单位（秒/毫秒）
+    :param step: k线周期 与open_times同单位
+    :param from_time: 区间起点（包含）
+    :param to_time: 区间终点（包含）
+    :return: shape (n, 2) 每行为一个缺失区间 [第一根缺失k线, 最后一根缺失k线]
+    """
+    open_times = np.unique(open_times[(open_times >= from_time) & (open_times <= to_time)])
+    # 在首尾补上哨兵 使区间两端的缺失也能被差分检测到
+    bounded = np.concatenate(([from_time - step], open_times, [to_time - (to_time - from_time) % step + step]))
+    diff = np.diff(bounded)
+    holes = np.nonzero(diff > step)[0]
+    return np.stack((bounded[holes] + step, bounded[holes + 1] - step), axis=1)
+
+
+def wall_clock_ms(date: datetime) -> int:
+    """
+    与数据库返回的DateTime列一致 按墙上时间（UTC 不做本地时区换算）转换为毫秒时间戳
+    不使用 datetime.timestamp() 其按本地时区解释naive datetime
+    """
+    return int(np.datetime64(date, 'ms').astype(np.int64))
+
+
+def datetime_column_to_ms(column) -> np.ndarray:
+    """
+    数据库返回的DateTime列（numpy datetime64 或 datetime对象）转换为毫秒时间戳
+    """
+    column = np.asarray(column)
+    if column.dtype.kind != 'M':
+        column = column.astype('datetime64[ms]')
+    return column.astype('datetime64[ms]').astype(np.int64)
+
+
+def columns_from_db(result: list) -> Dict[str, np.ndarray]:
+    """
+    将columnar模式的查询结果转换为列式k线
+    :param result: 按KLINE_FIELDS顺序的列
+    :return: 见 data_collection.api.binance_api.KLINE_COLUMNS
+    """
+    if len(result) == 0:
+        return {name: np.empty(0, dtype=dtype) for name, dtype in KLINE_COLUMNS.items()}
+    columns = {}
+    for (name, dtype), column in zip(KLINE_COLUMNS.items(), result):
+        if name in ('open_time', 'close_time'):
+            columns[name] = datetime_column_to_ms(column)
+        else:
+            columns[name] = np.asarray(column).astype(dtype)
+    return columns
+
+
+class KlineStore:
+    """
+    单个 (exchange, market, symbol, interval) 的k线存储
+    """
+
+    def __init__(self, key: KlineKey, db_connection: ClickHouseManager | None = None):
+        """
+
+        :param key:
+        :param db_connection: 数据库连接 默认使用进程内共享的连接
+        """
+        self.key = key
+        self.table_name = table_name_of(key)
+        self.db_connection = db_connection if db_connection is not None else shared_db_connection()
+
+    def create_table(self):
+        """
+        建表 结构与 ddl/kline_btc_usdt_1m.sql 一致
+        ReplacingMergeTree按open_time去重 后台合并时只保留最后写入的一行
+        """
+        query = f"CREATE TABLE IF NOT EXISTS {self.table_name} ( \
+            `open_time` DateTime, `open_price` Float64, `high_price` Float64, `low_price` Float64, \
+            `close_price` Float64, `volume` Float64, `close_time` DateTime, `quote_asset_volume` Float64, \
+            `num_of_trades` Float64, `taker_buy_base_volume` Float64, `taker_buy_quote_volume` Float64 \
+            ) ENGINE = ReplacingMergeTree() PARTITION BY toYYYYMM(open_time) ORDER BY (open_time)"
+        self.db_connection.execute(query)
+
+    def select(self, from_timestamp: datetime, to_timestamp: datetime, order: str = 'ASC',
+               final: bool = False) -> List[KlineDao]:
+        """
+        按open_time顺序读取
+        写入时已过滤库中已有的区间 正常情况下不存在重复数据 因此直接顺序扫描 不再使用 SELECT DISTINCT
+        :param from_timestamp:
+        :param to_timestamp:
+        :param order:
+        :param final: 使用FINAL在读取时合并尚未去重的数据 用于存在历史重复数据且尚未执行optimize()的表
+        :return:
+        """
+        if order != 'ASC' and order != 'DESC':
+            raise ValueError('order is not ASC or DESC')
+        final_clause = ' FINAL' if final else ''
+        query = f"SELECT * FROM {self.table_name}{final_clause} WHERE open_time BETWEEN %(from_timestamp)s AND %(to_timestamp)s ORDER BY open_time {order}"
+        params = {'from_timestamp': from_timestamp, 'to_timestamp': to_timestamp}
+        result = self.db_connection.execute(query, params)
+        return result
+
+    def select_columns(self, from_timestamp: datetime, to_timestamp: datetime,
+                       right_open: bool = False) -> Dict[str, np.ndarray]:
+        """
+        按open_time升序读取 返回列式numpy数组
+        :param from_timestamp:
+        :param to_timestamp:
+        :param right_open: 为True时不包含to_timestamp
+        :return: 见 data_collection.api.binance_api.KLINE_COLUMNS open_time/close_time为毫秒时间戳
+        """
+        right = '<' if right_open else '<='
+        query = f"SELECT {KLINE_FIELDS} FROM {self.table_name} \
+            WHERE open_time >= %(from_timestamp)s AND open_time {right} %(to_timestamp)s ORDER BY open_time"
+        params = {'from_timestamp': from_timestamp, 'to_timestamp': to_timestamp}
+        result = self.db_connection.execute(query, params, columnar=True, settings={'use_numpy': True})
+        return columns_from_db(result)
+
+    def select_iter(self, from_timestamp: datetime, to_timestamp: datetime, block_size: int = 100_000
+                    ) -> Iterator[Dict[str, np.ndarray]]:
+        """
+        流式读取 按open_time升序 每次返回不超过block_size行
+        :param from_timestamp:
+        :param to_timestamp:
+        :param block_size:
+        :return: 见 data_collection.api.binance_api.KLINE_COLUMNS open_time/close_time为毫秒时间戳
+        """
+        query = f"SELECT {KLINE_FIELDS} FROM {self.table_name} \
+            WHERE open_time BETWEEN %(from_timestamp)s AND %(to_timestamp)s ORDER BY open_time"
+        params = {'from_timestamp': from_timestamp, 'to_timestamp': to_timestamp}
+        for rows in self.db_connection.execute_iter(query, params, block_size=block_size):
+            yield columns_from_db(list(zip(*rows)))
+
+    def insert_single(self, data: KlineDao):
+        values = ', '.join(f"%({field})s" for field in KlineDao._fields)
+        query = f"INSERT INTO {self.table_name} ({KLINE_FIELDS}) VALUES ({values})"
+        self.db_connection.execute(query, data._asdict())
+
+    def insert_many(self, data: List[KlineDao]):
+        query = f"INSERT INTO {self.table_name} ({KLINE_FIELDS}) VALUES"
+        self.db_connection.execute(query, data)
+
+    def insert_columns(self, columns: Dict[str, np.ndarray]):
+        """
+        列式写入
+        使用clickhouse_driver的columnar + numpy模式 整列写入 不构造逐行的python对象
+        :param columns: 见 data_collection.api.binance_api.KLINE_COLUMNS
+        :return:
+        """
+        if len(columns['open_time']) == 0:
+            return
+        query = f"INSERT INTO {self.table_name} ({KLINE_FIELDS}) VALUES"
+        data = []
+        for name in KLINE_COLUMNS:
+            column = columns[name]
+            if name in ('open_time', 'close_time'):
+                # 毫秒时间戳 -> DateTime(秒)
+                column = (column // 1000).astype('datetime64[s]')
+            else:
+                column = column.astype(np.float64, copy=False)
+            data.append(column)
+        self.db_connection.execute(query, data, columnar=True, settings={'use_numpy': True})
+
+    def stored_range(self) -> tuple:
+        """
+        库中已有数据的open_time区间
+        :return: (min_open_time, max_open_time) 表为空时返回 (None, None)
+        """
+        query = f"SELECT min(open_time), max(open_time), count() FROM {self.table_name}"
+        first_time, last_time, count = self.db_connection.execute(query)[0]
+        if count == 0:
+            return None, None
+        return first_time, last_time
+
+    def month_counts(self, from_date: datetime, to_date: datetime) -> Dict[datetime, int]:
+        """
+        [from_date, to_date) 内每个月的k线数（按open_time去重） 用于校验本地缓存 见 data_collection.kline_cache
+        :param from_date:
+        :param to_date:
+        :return: 月初 -> k线数 没有数据的月份不返回
+        """
+        query = f"SELECT toStartOfMonth(open_time) AS month, uniqExact(open_time) FROM {self.table_name} \
+            WHERE open_time >= %(from_timestamp)s AND open_time < %(to_timestamp)s GROUP BY month"
+        params = {'from_timestamp': from_date, 'to_timestamp': to_date}
+        return {datetime(month.year, month.month, 1): count for month, count in self.db_connection.execute(query, params)}
+
+    @staticmethod
+    def drop_stored(columns: Dict[str, np.ndarray], first_time: datetime | None,
+                    last_time: datetime | None) -> Dict[str, np.ndarray]:
+        """
+        写入前过滤 丢弃open_time落在库中已有区间 [first_time, last_time] 内的行
+        区间内部的缺口由 repair_gaps() 修补
+        :param columns: 见 data_collection.api.binance_api.KLINE_COLUMNS
+        :param first_time:
+        :param last_time:
+        :return:
+        """
+        if first_time is None:
+            return columns
+        open_time = columns['open_time']
+        keep = (open_time < wall_clock_ms(first_time)) | (open_time > wall_clock_ms(last_time))
+        if keep.all():
+            return columns
+        return {name: column[keep] for name, column in columns.items()}
+
+    def drop_existing(self, columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """
+        写入前过滤 丢弃库中已存在的open_time
+        与drop_stored不同 按行比较 可用于填补已有区间内部的缺口
+        只查询columns覆盖的区间 每次查询的数据量与columns相当
+        :param columns: 见 data_collection.api.binance_api.KLINE_COLUMNS
+        :return:
+        """
+        open_time = columns['open_time']
+        if len(open_time) == 0:
+            return columns
+        # toDateTime(整数)按unix时间戳解释 与毫秒时间戳一致 不受本地时区影响
+        query = f"SELECT toUnixTimestamp(open_time) FROM {self.table_name} \
+            WHERE open_time BETWEEN toDateTime(%(from_second)s) AND toDateTime(%(to_second)s)"
+        params = {'from_second': int(open_time.min()) // 1000, 'to_second': int(open_time.max()) // 1000}
+        result = self.db_connection.execute(query, params, columnar=True, settings={'use_numpy': True})
+        if len(result) == 0 or len(result[0]) == 0:
+            return columns
+        stored = np.asarray(result[0], dtype=np.int64) * 1000
+        keep = ~np.isin(open_time, stored)
+        if keep.all():
+            return columns
+        return {name: column[keep] for name, column in columns.items()}
+
+    def optimize(self, partition: str | None = None):
+        """
+        合并并去除历史遗留的重复数据
+        :param partition: 分区 如 '202412' 为空则合并整张表
+        :return:
+        """
+        partition_clause = f" PARTITION {partition}" if partition is not None else ''
+        self.db_connection.execute(f"OPTIMIZE TABLE {self.table_name}{partition_clause} FINAL")
+
+    def last_date(self) -> datetime:
+        query = f"SELECT MAX(close_time) FROM {self.table_name}"
+        result = self.db_connection.execute(query)
+        return result[0][0]
+
+    def find_gaps(self, from_date: datetime, to_date: datetime) -> List[KlineGap]:
+        """
+        在clickhouse中计算 [from_date, to_date] 内缺失的k线区间
+        使用窗口函数对相邻open_time做差分 只返回缺口 不传输k线数据
+        :param from_date:
+        :param to_date:
+        :return:
+        """
+        step = interval_to_milliseconds(self.key.interval) // 1000
+        params = {'from_timestamp': from_date, 'to_timestamp': to_date, 'step': step}
+        gaps: List[KlineGap] = []
+        # 区间首尾
+        query = f"SELECT min(open_time), max(open_time), count() FROM {self.table_name} \
+            WHERE open_time BETWEEN %(from_timestamp)s AND %(to_timestamp)s"
+        first_time, last_time, count = self.db_connection.execute(query, params)[0]
+        if count == 0:
+            return [self._gap(from_date, to_date, step, align_end=True)]
+        if first_time > from_date:
+            gaps.append(self._gap(from_date, first_time - timedelta(seconds=step), step))
+        # 区间内部
+        query = f"SELECT toDateTime(prev_time + %(step)s), toDateTime(t - %(step)s) FROM ( \
+                SELECT t, lagInFrame(t) OVER (ORDER BY t ASC ROWS BETWEEN 1 PRECEDING AND CURRENT ROW) AS prev_time \
+                FROM (SELECT DISTINCT toUnixTimestamp(open_time) AS t FROM {self.table_name} \
+                    WHERE open_time BETWEEN %(from_timestamp)s AND %(to_timestamp)s) \
+            ) WHERE prev_time > 0 AND t - prev_time > %(step)s ORDER BY t"
+        for start, end in self.db_connection.execute(query, params):
+            gaps.append(self._gap(start, end, step))
+        if last_time + timedelta(seconds=step) <= to_date:
+            gaps.append(self._gap(last_time + timedelta(seconds=step), to_date, step, align_end=True))
+        return gaps
+
+    @staticmethod
+    def _gap(start: datetime, end: datetime, step: int, align_end: bool = False) -> KlineGap:
+        if align_end:
+            # 将区间终点对齐到最后一根k线的open_time
+            end = end - timedelta(seconds=(end - start).total_seconds() % step)
+        return KlineGap(start, end, int((end - start).total_seconds()) // step + 1)
+
+    def is_contiguous(self, from_date: datetime, to_date: datetime) -> bool:
+        """
+        判断 [from_date, to_date] 内的k线是否连续
+        只比较去重后的条数 供回测前快速校验
+        :param from_date: 应为某根k线的open_time
+        :param to_date: 应为某根k线的open_time
+        :return:
+        """
+        step = interval_to_milliseconds(self.key.interval) // 1000
+        expected = int((to_date - from_date).total_seconds()) // step + 1
+        query = f"SELECT uniqExact(open_time) FROM {self.table_name} \
+            WHERE open_time BETWEEN %(from_timestamp)s AND %(to_timestamp)s"
+        params = {'from_timestamp': from_date, 'to_timestamp': to_date}
+        return self.db_connection.execute(query, params)[0][0] == expected
+
+    def assert_contiguous(self, from_date: datetime, to_date: datetime):
+        """
+        k线不连续时抛出异常 并给出缺失的区间
+        """
+        if not self.is_contiguous(from_date, to_date):
+            gaps = self.find_gaps(from_date, to_date)
+            raise RuntimeError(f'{self.table_name} is not contiguous between {from_date} and {to_date}, '
+                               f'{sum(g.missing for g in gaps)} klines missing in {len(gaps)} gaps: {gaps[:10]}')
+
+    def repair_gaps(self, from_date: datetime, to_date: datetime | None = None, limit: int = 1000,
+                    max_workers: int = 8) -> int:
+        """
+        只拉取缺失的区间 修补历史数据
+        交易所停机等原因造成的缺口无法修补 重复调用时会再次请求
+        :param from_date:
+        :param to_date: 默认为当前时间（UTC）
+        :param limit: 单次请求的最大条数
+        :param max_workers: 并发线程数
+        :return: 写入的数据条数
+        """
+        if to_date is None:
+            to_date = datetime.now(timezone.utc).replace(tzinfo=None)
+        gaps = self.find_gaps(from_date, to_date)
+        if len(gaps) == 0:
+            logging.info(f"{self.table_name} has no gap between {from_date} and {to_date}")
+            return 0
+        logging.info(f"{self.table_name} repair {sum(g.missing for g in gaps)} klines in {len(gaps)} gaps")
+        backfill = self._new_backfill(limit=limit, max_workers=max_workers)
+        # 缺口边界为数据库中的UTC墙上时间 不能按本地时区换算
+        total = backfill.run_ranges([(wall_clock_ms(g.start), wall_clock_ms(g.end)) for g in gaps])
+        get_http_client().log_stats()
+        return total
+
+    def _new_backfill(self, limit: int, max_workers: int, checkpoint_path: str | None = None,
+                      save: Callable[[Dict[str, np.ndarray]], None] | None = None) -> KlineBackfill:
+        fetcher = KLINE_FETCHERS.get((self.key.exchange, self.key.market))
+        if fetcher is None:
+            raise ValueError(f'no kline fetcher for {self.key.exchange} {self.key.market}')
+        return KlineBackfill(
+            fetch=lambda start_time, end_time: fetcher(
+                start_time, symbol=self.key.symbol, interval=self.key.interval, limit=limit, end_time=end_time),
+            save=save if save is not None else self.insert_columns,
+            size=lambda columns: len(columns['open_time']),
+            interval=self.key.interval,
+            limit=limit,
+            max_workers=max_workers,
+            checkpoint_path=checkpoint_path,
+        )
+
+    def save_dataframe_to_db(self, df: pd.DataFrame):
+        tuples = [KlineDao(
+            x[0], float(x[1]), float(x[2]), float(x[3]), float(x[4]), float(x[5]), x[6], float(x[7]), float(x[8]),
+            float(x[9]), float(x[10]),
+        ) for x in df.values]
+        self.insert_many(tuples)
+
+    def collect_up2date_data(
+            self,
+            from_date: datetime,
+            limit: int = 1000,
+            max_workers: int = 8,
+            checkpoint_path: str | None = None,
+    ):
+        """
+        并发回填 from_date 至今的历史数据
+        请求频率由权重令牌桶控制 见 data_collection.api.rate_limiter
+        :param from_date: 开始时间 UTC墙上时间 可直接使用last_date()的返回值
+        :param limit: 单次请求的最大条数
+        :param max_workers: 并发线程数
+        :param checkpoint_path: checkpoint文件路径 用于断点续传
+        :return:
+        """
+        # 库中已有的区间不再写入 避免重复数据
+        first_time, last_time = self.stored_range()
+        backfill = self._new_backfill(
+            limit=limit, max_workers=max_workers, checkpoint_path=checkpoint_path,
+            save=lambda columns: self.insert_columns(self.drop_stored(columns, first_time, last_time))
+        )
+        backfill.run(from_date)
+        get_http_client().log_stats()
+        logging.info(f"history of {self.table_name} is up2date")
+
+
+_kline_stores: Dict[KlineKey, KlineStore] = {}
+
+
+def get_kline_store(symbol: str, interval: str = '1m', exchange: str = 'binance', market: str = 'spot') -> KlineStore:
+    """
+    获取k线存储 同一个key只创建一次
+    :param symbol: 如 'BTCUSDT'
+    :param interval: 如 '1m'
+    :param exchange:
+    :param market:
+    :return:
+    """
+    key = KlineKey(exchange, market, symbol.upper(), interval)
+    store = _kline_stores.get(key)
+    if store is None:
+        store = KlineStore(key)
+        _kline_stores[key] = store
+    return store
+
+
+def test_table_name():
+    for symbol in ['BTCUSDT', 'ETHUSDT', 'ETHBTC', 'BNBFDUSD']:
+        logging.info(f"{symbol}: {table_name_of(KlineKey('binance', 'spot', symbol, '1m'))}")
+
+
+def test_find_gaps_in_timestamps():
+    open_times = np.array([0, 60, 120, 300, 360, 600])
+    gaps = find_gaps_in_timestamps(open_times, step=60, from_time=0, to_time=720)
+    logging.info(f"gaps: {gaps.tolist()}")  # [[180, 240], [420, 540], [660, 720]]
+
+
+def test_find_gaps():
+    store = get_kline_store('BTCUSDT')
+    gaps = store.find_gaps(datetime(2020, 1, 1, 0, 0), datetime(2025, 1, 1, 0, 0))
+    for gap in gaps:
+        logging.info(gap)
+
+
+def test_drop_stored():
+    columns = {'open_time': np.arange(0, 600_000, 60_000), 'close_price': np.arange(10, dtype=np.float64)}
+    # 数据库返回的DateTime为UTC墙上时间
+    first_time = datetime(1970, 1, 1, 0, 2)
+    last_time = datetime(1970, 1, 1, 0, 5)
+    logging.info(KlineStore.drop_stored(columns, first_time, last_time))  # open_time 120s ~ 300s 被丢弃
+
+
+def test_drop_existing():
+    class FakeDatabase:
+        def execute(self, query, params, **kwargs):
+            # 库中已有 0 ~ 2分钟 和 6 ~ 9分钟 3 ~ 5分钟缺失
+            stored = np.array([0, 60, 120, 360, 420, 480, 540])
+            return [stored[(stored >= params['from_second']) & (stored <= params['to_second'])]]
+
+    store = KlineStore(KlineKey('binance', 'spot', 'BTCUSDT', '1m'), db_connection=FakeDatabase())
+    columns = {'open_time': np.arange(0, 600_000, 60_000), 'close_price': np.arange(10, dtype=np.float64)}
+    logging.info(store.drop_existing(columns))  # 只保留 180000 ~ 300000
+
+
+def test_repair_gaps_timezone():
+    """
+    非UTC时区下 修补请求的区间应与缺口的UTC墙上时间一致
+    """
+    import os
+    import time
+
+    tz = os.environ.get('TZ')
+    os.environ['TZ'] = 'Asia/Shanghai'
+    time.tzset()
+    gap = KlineGap(datetime(2024, 12, 1, 0, 0), datetime(2024, 12, 1, 0, 9), 10)
+    fetched = []
+
+    class GapStore(KlineStore):
+        def find_gaps(self, from_date: datetime, to_date: datetime) -> List[KlineGap]:
+            return [gap]
+
+        def _new_backfill(self, limit: int, max_workers: int, checkpoint_path: str | None = None,
+                          save: Callable[[Dict[str, np.ndarray]], None] | None = None) -> KlineBackfill:
+            def fetch(start_time: datetime, end_time: datetime) -> Dict[str, np.ndarray]:
+                # 与binance_api一致 按UTC墙上时间将请求时间换算为毫秒时间戳
+                fetched.append((datetime_to_ms(start_time), datetime_to_ms(end_time)))
+                return {'open_time': np.empty(0, dtype=np.int64)}
+
+            return KlineBackfill(fetch=fetch, save=lambda columns: None,
+                                 size=lambda columns: len(columns['open_time']), max_workers=1)
+
+    try:
+        store = GapStore(KlineKey('binance', 'spot', 'BTCUSDT', '1m'), db_connection=object())
+        store.repair_gaps(gap.start, gap.end)
+        expected = (wall_clock_ms(gap.start), wall_clock_ms(gap.end))
+        logging.info(f"fetched {fetched} expected {expected}")
+        assert fetched == [expected]
+    finally:
+        if tz is None:
+            del os.environ['TZ']
+        else:
+            os.environ['TZ'] = tz
+        time.tzset()
+
+
+def test_last_date():
+    for symbol in ['BTCUSDT', 'ETHUSDT']:
+        store = get_kline_store(symbol)
+        logging.info(f"{store.table_name}: {store.last_date()}")
+
+
+if __name__ == '__main__':
+    test_table_name()
+    test_find_gaps_in_timestamps()
+    test_drop_stored()
+    test_drop_existing()
+    test_repair_gaps_timezone()
+    # test_find_gaps()
+    # test_last_date()
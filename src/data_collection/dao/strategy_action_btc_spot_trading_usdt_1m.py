@@ -2,14 +2,13 @@
 保存策略的action数据
 action：即挂单信息和成交信息
 """
-import time
 from collections import namedtuple
 from datetime import datetime
-from typing import List
-import queue
-import threading
+from typing import Dict, Iterator, List
 
-from data_collection.db import new_db_connection
+import numpy as np
+
+from data_collection.db import shared_db_connection, rows_to_columns
 from log import *
 
 table_name = 'strategy_action_btc_usdt_1m'
@@ -39,13 +38,14 @@ def from_StrategyActionBtcUSDT1mDao_to_StrategyActionBtcUSDT1mInsertDao(
                                             data[9], data[10], data[11])
 
 
+# 批量写入语句 异步写入时按语句合并
+insert_many_query = f"INSERT INTO {table_name} ({', '.join(StrategyActionBtcUSDT1mInsertDao._fields)}) VALUES"
+
+
 class StrategyActionBtcUSDT1mConnector:
     def __init__(self):
-        self.db_connection = new_db_connection()
-        self.data_queue = queue.Queue()
-        self.stop_event = threading.Event()
-        self.thread = threading.Thread(target=self._queue_worker, daemon=True)
-        self.thread.start()
+        # 所有connector共用一个连接池和一个异步写入线程 见 data_collection.db.BatchWriter
+        self.db_connection = shared_db_connection()
 
     def select(self, from_timestamp: datetime, to_timestamp: datetime, order: str = 'ASC') -> List[
         StrategyActionBtcUSDT1mDao]:
@@ -57,6 +57,21 @@ class StrategyActionBtcUSDT1mConnector:
         result = self.db_connection.execute(query, params)
         return result
 
+    def select_iter(self, from_timestamp: datetime, to_timestamp: datetime, block_size: int = 100_000
+                    ) -> Iterator[Dict[str, np.ndarray]]:
+        """
+        流式读取 按action_time升序 每次返回不超过block_size行 适用于长时间区间的报表
+        :param from_timestamp:
+        :param to_timestamp:
+        :param block_size:
+        :return: 列名 -> numpy数组 列名见StrategyActionBtcUSDT1mDao
+        """
+        query = f"SELECT DISTINCT {', '.join(StrategyActionBtcUSDT1mDao._fields)} FROM {table_name} \
+        WHERE action_time BETWEEN %(from_timestamp)s AND %(to_timestamp)s ORDER BY action_time"
+        params = {'from_timestamp': from_timestamp, 'to_timestamp': to_timestamp}
+        for rows in self.db_connection.execute_iter(query, params, block_size=block_size):
+            yield rows_to_columns(rows, StrategyActionBtcUSDT1mDao._fields)
+
     def insert_single(self, data: StrategyActionBtcUSDT1mInsertDao):
         query = f"INSERT INTO strategy_action_btc_usdt_1m (version, action_time, status, open_price, close_price, quantity,\
         open_cost, expected_gross_value, actual_gross_value, expected_commission, actual_commission) \
@@ -85,11 +100,10 @@ class StrategyActionBtcUSDT1mConnector:
         :param data: StrategyActionBtcUSDT1mInsertDao
         :return:
         """
-        self.data_queue.put(data)
+        self.db_connection.execute_queue(insert_many_query, [tuple(data)])
 
     def insert_many(self, data: List[StrategyActionBtcUSDT1mInsertDao]):
-        query = f"INSERT INTO strategy_action_btc_usdt_1m (version, action_time, status, open_price, close_price, quantity,\
-        open_cost, expected_gross_value, actual_gross_value, expected_commission, actual_commission) VALUES"
+        query = insert_many_query
         # logging.info(f"sql:{query}")
         # logging.info(f"data:{data}")
         self.db_connection.execute(query, data)
@@ -101,45 +115,15 @@ class StrategyActionBtcUSDT1mConnector:
         :param data: List[StrategyActionBtcUSDT1mInsertDao]
         :return:
         """
-        for d in data:
-            self.data_queue.put(d)
+        self.db_connection.execute_queue(insert_many_query, [tuple(d) for d in data])
 
-    def _queue_worker(self):
+    def flush(self, timeout: float | None = None) -> bool:
         """
-        后台线程
-        从队列读取数据
-        并写入clickhouse
-        :return:
+        等待异步写入的数据全部写入
+        :param timeout: 超时时间（秒） 为空则一直等待
+        :return: 是否全部写入
         """
-        while not self.stop_event.is_set():
-            queries: List[StrategyActionBtcUSDT1mInsertDao] = []
-            try:
-                # 批量写入数据
-                while True:
-                    while True:
-                        try:
-                            query = self.data_queue.get_nowait()
-                            # logging.info(f"append query {query}")
-                        except Exception as e:
-                            break
-                        queries.append(query)
-                    # logging.info(f"try to insert {queries}")
-                    if len(queries) > 0:
-                        self.insert_many(queries)
-                        # logging.info(f"successfully insert {queries}")
-                    time.sleep(1)   # 控制qps
-            except queue.Empty:
-                continue  # 如果队列为空，继续等待
-            except Exception as e:
-                print(f"Error writing to ClickHouse: {e}")
-                # 回写未完成插入的数据
-                for query in queries:
-                    self.data_queue.put(query)
-
-    def __del__(self):
-        """停止线程"""
-        self.stop_event.set()
-        self.thread.join()
+        return self.db_connection.flush(timeout)
 
 
 def test_select():
@@ -154,6 +138,16 @@ def test_select():
         logging.info(row)
 
 
+def test_select_iter():
+    connector = StrategyActionBtcUSDT1mConnector()
+
+    from_timestamp = datetime(2023, 12, 1, 0, 0)
+    to_timestamp = datetime(2023, 12, 2, 0, 0)
+
+    for block in connector.select_iter(from_timestamp, to_timestamp, block_size=100):
+        logging.info(f"{len(block['action_time'])} rows, first: {block['action_time'][0]}")
+
+
 def test_insert_many():
     connector = StrategyActionBtcUSDT1mConnector()
 
@@ -191,6 +185,7 @@ def test_insert_single():
         1, 2, 3, 4, 5, 6, 7, 8, 9)
     connector.insert_single_queue(data1)
     connector.insert_single_queue(data2)
+    connector.flush()
     # connector.insert_single(data1)
     # connector.insert_single(data2)
 
@@ -206,5 +201,4 @@ def test_insert_single():
 if __name__ == '__main__':
     # test_insert_many()
     test_insert_single()
-    time.sleep(50000)
     test_select()
@@ -2,14 +2,13 @@
 保存策略的status信息
 status：账户的现金、持仓、市值、借贷资金、期望收益等信息
 """
-import time
 from collections import namedtuple
 from datetime import datetime
-from typing import List
-import queue
-import threading
+from typing import Dict, Iterator, List
 
-from data_collection.db import new_db_connection
+import numpy as np
+
+from data_collection.db import shared_db_connection, rows_to_columns
 from log import *
 
 table_name = 'strategy_status_btc_usdt_1m'
@@ -66,13 +65,14 @@ StrategyStatusBtcUSDT1mDao = namedtuple(
 )
 
 
+# 批量写入语句 异步写入时按语句合并
+insert_many_query = f"INSERT INTO {table_name} ({', '.join(StrategyStatusBtcUSDT1mDao._fields)}) VALUES"
+
+
 class StrategyStatusBtcUSDT1mConnector:
     def __init__(self):
-        self.db_connection = new_db_connection()
-        self.data_queue = queue.Queue()
-        self.stop_event = threading.Event()
-        self.thread = threading.Thread(target=self._queue_worker, daemon=True)
-        self.thread.start()
+        # 所有connector共用一个连接池和一个异步写入线程 见 data_collection.db.BatchWriter
+        self.db_connection = shared_db_connection()
 
     def select(self, from_timestamp: datetime, to_timestamp: datetime, order: str = 'ASC') -> List[
         StrategyStatusBtcUSDT1mDao]:
@@ -84,6 +84,21 @@ class StrategyStatusBtcUSDT1mConnector:
         result = self.db_connection.execute(query, params)
         return result
 
+    def select_iter(self, from_timestamp: datetime, to_timestamp: datetime, block_size: int = 100_000
+                    ) -> Iterator[Dict[str, np.ndarray]]:
+        """
+        流式读取 按open_time升序 每次返回不超过block_size行 适用于长时间区间的报表
+        :param from_timestamp:
+        :param to_timestamp:
+        :param block_size:
+        :return: 列名 -> numpy数组 列名见StrategyStatusBtcUSDT1mDao
+        """
+        query = f"SELECT DISTINCT {', '.join(StrategyStatusBtcUSDT1mDao._fields)} FROM {table_name} \
+        WHERE open_time BETWEEN %(from_timestamp)s AND %(to_timestamp)s ORDER BY open_time"
+        params = {'from_timestamp': from_timestamp, 'to_timestamp': to_timestamp}
+        for rows in self.db_connection.execute_iter(query, params, block_size=block_size):
+            yield rows_to_columns(rows, StrategyStatusBtcUSDT1mDao._fields)
+
     def insert_single(self, data: StrategyStatusBtcUSDT1mDao):
         query = f"INSERT INTO strategy_status_btc_usdt_1m (open_time, version, price, opening_order_num, \
         opening_order_quantity, opening_order_value, closing_order_num, closing_order_quantity, closing_order_value, \
@@ -168,71 +183,53 @@ class StrategyStatusBtcUSDT1mConnector:
         :param data: StrategyActionBtcUSDT1mInsertDao
         :return:
         """
-        self.data_queue.put(data)
+        self.db_connection.execute_queue(insert_many_query, [tuple(data)])
 
     def insert_many(self, data: List[StrategyStatusBtcUSDT1mDao]):
-        query = f"INSERT INTO strategy_status_btc_usdt_1m (open_time, version, price, opening_order_num, \
-        opening_order_quantity, opening_order_value, closing_order_num, closing_order_quantity, closing_order_value, \
-        closing_order_cost, opened_order_num, opened_order_quantity, opened_order_value, closed_order_num, \
-        closed_order_quantity, closed_order_value, closed_order_cost, cumulative_opening_order_num, \
-        cumulative_opening_order_quantity, cumulative_opening_order_value, cumulative_closing_order_num, \
-        cumulative_closing_order_quantity, cumulative_closing_order_value, cumulative_closing_order_cost, \
-        cumulative_opened_order_num, cumulative_opened_order_quantity, cumulative_opened_order_value, \
-        cumulative_closed_order_num, cumulative_closed_order_quantity, cumulative_closed_order_value, \
-        cumulative_closed_order_cost, cash, loan, holding_quantity, holding_value, \
-        total_value, expected_closing_profit, actual_closed_profit, expected_market_close_profit, \
-        expected_closed_profit, expected_holding_value, expected_total_value, actual_net_value, \
-        expected_net_value, ave_profit_per_closed_order) VALUES"
+        query = insert_many_query
         # logging.info(f"sql:{query}")
         # logging.info(f"data:{data}")
         self.db_connection.execute(query, data)
         # logging.info(f"Data inserted into {table_name} successfully.")
 
+    def insert_columns(self, columns: Dict[str, np.ndarray]):
+        """
+        列式写入 见 strategy.status_recorder.StatusRecorder
+        :param columns: 列名 -> numpy数组 列名见StrategyStatusBtcUSDT1mDao
+        :return:
+        """
+        if len(columns['open_time']) == 0:
+            return
+        # Decimal列不支持numpy模式 整列转换为python列表后按列写入
+        data = [columns[name].tolist() for name in StrategyStatusBtcUSDT1mDao._fields]
+        self.db_connection.execute(insert_many_query, data, columnar=True)
+
+    def insert_columns_queue(self, columns: Dict[str, np.ndarray]):
+        """
+        列式数据转为行后放入异步写入队列 不等待数据库往返 见 insert_columns
+        :param columns: 列名 -> numpy数组 列名见StrategyStatusBtcUSDT1mDao
+        :return:
+        """
+        if len(columns['open_time']) == 0:
+            return
+        data = [columns[name].tolist() for name in StrategyStatusBtcUSDT1mDao._fields]
+        self.db_connection.execute_queue(insert_many_query, list(zip(*data)))
+
     def insert_many_queue(self, data: List[StrategyStatusBtcUSDT1mDao]):
         """
         使用队列进行异步写入
         :param data: List[StrategyActionBtcUSDT1mInsertDao]
         :return:
         """
-        for d in data:
-            self.data_queue.put(d)
+        self.db_connection.execute_queue(insert_many_query, [tuple(d) for d in data])
 
-    def _queue_worker(self):
+    def flush(self, timeout: float | None = None) -> bool:
         """
-        后台线程
-        从队列读取数据
-        并写入clickhouse
-        :return:
+        等待异步写入的数据全部写入
+        :param timeout: 超时时间（秒） 为空则一直等待
+        :return: 是否全部写入
         """
-        while not self.stop_event.is_set():
-            queries: List[StrategyStatusBtcUSDT1mDao] = []
-            try:
-                # 批量写入数据
-                while True:
-                    while True:
-                        try:
-                            query = self.data_queue.get_nowait()
-                            # logging.info(f"append query {query}")
-                        except Exception as e:
-                            break
-                        queries.append(query)
-                    # logging.info(f"try to insert {queries}")
-                    if len(queries) > 0:
-                        self.insert_many(queries)
-                        # logging.info(f"successfully insert {queries}")
-                    time.sleep(1)   # 控制qps
-            except queue.Empty:
-                continue  # 如果队列为空，继续等待
-            except Exception as e:
-                print(f"Error writing to ClickHouse: {e}")
-                # 回写未完成插入的数据
-                for query in queries:
-                    self.data_queue.put(query)
-
-    def __del__(self):
-        """停止线程"""
-        self.stop_event.set()
-        self.thread.join()
+        return self.db_connection.flush(timeout)
 
 
 def test_select():
@@ -247,6 +244,16 @@ def test_select():
         logging.info(row)
 
 
+def test_select_iter():
+    connector = StrategyStatusBtcUSDT1mConnector()
+
+    from_timestamp = datetime(2023, 12, 1, 0, 0)
+    to_timestamp = datetime(2023, 12, 2, 0, 0)
+
+    for block in connector.select_iter(from_timestamp, to_timestamp, block_size=100):
+        logging.info(f"{len(block['open_time'])} rows, first: {block['open_time'][0]}")
+
+
 def test_insert_many():
     connector = StrategyStatusBtcUSDT1mConnector()
 
@@ -277,6 +284,7 @@ def test_insert_single():
     # connector.insert_single(data2)
     connector.insert_single_queue(data1)
     connector.insert_single_queue(data2)
+    connector.flush()
 
     from_timestamp = datetime(2023, 12, 1, 0, 0)
     to_timestamp = datetime(2023, 12, 2, 0, 0)
@@ -291,5 +299,4 @@ if __name__ == '__main__':
     # test_select()
     # test_insert_many()
     test_insert_single()
-    time.sleep(50000)
     test_select()
@@ -1,53 +1,571 @@
+import atexit
 import queue
+import random
 import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence
+
+import numpy as np
 from clickhouse_driver import Client
+from clickhouse_driver.errors import NetworkError, SocketTimeoutError
+
+from config import CLICKHOUSE_HOST, CLICKHOUSE_PORT, CLICKHOUSE_USER, CLICKHOUSE_PASSWORD, CLICKHOUSE_DATABASE, \
+    CLICKHOUSE_POOL_SIZE, CLICKHOUSE_PING_INTERVAL, CLICKHOUSE_SPILL_DIR
+from data_collection.spill_queue import SpillQueue
+from log import *
+
+
+class ClickHousePool:
+    """
+    进程内共享的clickhouse连接池
+    1.按查询借出连接 用完归还 最多同时打开size个连接 借不到时阻塞等待
+    2.空闲超过ping_interval的连接借出前先做健康检查 失败则重建
+    3.网络异常时断开该连接 SELECT自动重试一次 写入不重试（避免重复写入）
+    """
+
+    def __init__(
+            self,
+            host: str = CLICKHOUSE_HOST,
+            port: int = CLICKHOUSE_PORT,
+            user: str = CLICKHOUSE_USER,
+            password: str = CLICKHOUSE_PASSWORD,
+            database: str = CLICKHOUSE_DATABASE,
+            size: int = CLICKHOUSE_POOL_SIZE,
+            ping_interval: float = CLICKHOUSE_PING_INTERVAL,
+    ):
+        if size <= 0:
+            raise ValueError(f'size must be positive, not "{size}"')
+        self.client_kwargs = dict(host=host, port=port, user=user, password=password, database=database)
+        self.size = size
+        self.ping_interval = ping_interval
+        self.idle: queue.LifoQueue = queue.LifoQueue()  # (client, 归还时间) 后进先出 优先复用热连接
+        self.slots = threading.BoundedSemaphore(size)
+
+    def _new_client(self) -> Client:
+        return Client(**self.client_kwargs)
+
+    def _healthy(self, client: Client) -> bool:
+        try:
+            client.execute('SELECT 1')
+            return True
+        except Exception as e:
+            logging.warning(f"clickhouse connection health check failed: {e}")
+            client.disconnect()
+            return False
+
+    def _borrow(self) -> Client:
+        self.slots.acquire()
+        try:
+            client, returned_at = self.idle.get_nowait()
+        except queue.Empty:
+            return self._new_client()
+        if time.monotonic() - returned_at >= self.ping_interval and not self._healthy(client):
+            return self._new_client()
+        return client
+
+    def _return(self, client: Client):
+        self.idle.put((client, time.monotonic()))
+        self.slots.release()
+
+    @contextmanager
+    def connection(self) -> Iterator[Client]:
+        """
+        借出一个连接
+        with pool.connection() as client:
+            client.execute(...)
+        """
+        client = self._borrow()
+        try:
+            yield client
+        except (NetworkError, SocketTimeoutError, EOFError, OSError):
+            # 连接已不可用 断开后归还 下次使用时自动重连
+            client.disconnect()
+            raise
+        finally:
+            self._return(client)
+
+    def execute(self, query, params=None, **kwargs):
+        for attempt in range(2):
+            try:
+                with self.connection() as client:
+                    return client.execute(query, params, **kwargs)
+            except (NetworkError, SocketTimeoutError, EOFError, OSError) as e:
+                if attempt > 0 or not query.lstrip().upper().startswith('SELECT'):
+                    raise
+                logging.warning(f"clickhouse query failed: {e}, reconnect and retry")
+
+    def close(self):
+        while True:
+            try:
+                client, _ = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            client.disconnect()
+
+
+_shared_pool: ClickHousePool | None = None
+_shared_pool_lock = threading.Lock()
+
+
+def get_pool() -> ClickHousePool:
+    """
+    获取进程内共享的连接池 连接参数见config.py
+    :return:
+    """
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = ClickHousePool()
+        return _shared_pool
+
+
+class BatchWriter:
+    """
+    异步批量写入
+    1.同一条 INSERT ... VALUES 语句的数据合并为一次写入 单次最多max_rows行
+    2.攒够max_rows行或最早的数据等待超过max_delay秒时写入
+    3.待写入的数据超过max_pending行时 生产者阻塞等待（背压） 内存有上限
+      配置了spill时不阻塞 超出的数据直接落盘
+    4.写入失败时按抖动指数退避重试max_retries次 仍失败则落盘到spill（未配置spill则丢弃并计数） 不会无限回写
+    5.spill中有数据时 新批次直接落盘以保证顺序 每隔probe_interval秒按顺序重放 数据库恢复后清空
+    6.每个INSERT批次带有去重token 重试/重放时重复写入会被clickhouse去重
+      （非Replicated表需要设置non_replicated_deduplication_window）
+    7.flush()等待已提交的数据全部写入或落盘 close()写入剩余数据后停止写入线程 未能重放的数据保留在磁盘上
+    写入线程在首次提交数据时才启动
+    """
+
+    def __init__(
+            self,
+            execute: Callable,
+            max_rows: int = 10_000,
+            max_delay: float = 1.0,
+            max_pending: int = 100_000,
+            max_retries: int = 3,
+            backoff_base: float = 0.5,
+            backoff_cap: float = 10.0,
+            spill: SpillQueue | None = None,
+            probe_interval: float = 5.0,
+    ):
+        """
+
+        :param execute: 同步执行函数 参数(query, params)
+        :param max_rows: 单次写入的最大行数
+        :param max_delay: 数据最长等待时间（秒）
+        :param max_pending: 待写入的最大行数
+        :param max_retries: 单次写入的最大重试次数
+        :param backoff_base: 退避基数（秒）
+        :param backoff_cap: 退避上限（秒）
+        :param spill: 落盘队列 为空则写入失败时丢弃
+        :param probe_interval: 数据库不可用时 重放spill的间隔（秒）
+        """
+        self.execute = execute
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.spill = spill
+        self.probe_interval = probe_interval
+        self.spilled = spill is not None and len(spill) > 0  # spill中是否有待重放的数据（含上次运行遗留）
+        self.last_probe = 0.0
+        self.condition = threading.Condition()
+        self.pending: Dict[str, list] = {}  # INSERT语句 -> 待写入的行 其他语句 -> [params, ...]
+        self.pending_rows = 0
+        self.oldest: float | None = None  # 最早一条待写入数据的提交时间
+        self.submitted = 0  # 已提交的行数
+        self.finished = 0  # 已处理（写入、落盘或丢弃）的行数
+        self.dropped = 0  # 写入失败丢弃的行数
+        self.flush_requested = False
+        self.writing = False  # 写入线程正在重放spill或写入取出的批次
+        self.spilling = False  # 生产者正在将取出的待写入数据落盘 写入线程需等待其完成以保证顺序
+        self.closed = False
+        self.thread: threading.Thread | None = None
+
+    @staticmethod
+    def is_batch_insert(query: str) -> bool:
+        return query.rstrip().upper().endswith('VALUES')
+
+    def put(self, query: str, params=None):
+        """
+        提交写入
+        :param query: INSERT ... VALUES 时params为一行（tuple/dict）或多行（list） 其他语句单独执行
+        :param params:
+        :return:
+        """
+        if self.is_batch_insert(query):
+            rows = params if isinstance(params, list) else [params]
+        else:
+            rows = [params]
+        spill_batch = None
+        with self.condition:
+            if self.closed:
+                raise RuntimeError('BatchWriter is closed')
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._worker, name='clickhouse-batch-writer', daemon=True)
+                self.thread.start()
+            if self.pending_rows >= self.max_pending and self.spill is not None:
+                # 数据库长时间不可用 超出内存上限的数据直接落盘
+                # 先等待正在重试的批次写入或落盘 保证落盘顺序与提交顺序一致
+                self.condition.wait_for(
+                    lambda: not (self.writing or self.spilling) or self.pending_rows < self.max_pending)
+                if self.pending_rows >= self.max_pending:
+                    spill_batch, spill_rows = self.pending, self.pending_rows
+                    self.pending = {}
+                    self.pending_rows = 0
+                    self.oldest = None
+                    self.spilled = True
+                    self.spilling = True
+        if spill_batch is not None:
+            # 文件读写不持有condition 其他生产者和写入线程不会被阻塞在磁盘IO上
+            try:
+                self._spill_batch(spill_batch, spill_rows)
+            finally:
+                with self.condition:
+                    self.spilling = False
+                    self.finished += spill_rows
+                    self.condition.notify_all()
+        with self.condition:
+            while self.pending_rows >= self.max_pending and not self.closed:
+                self.condition.wait()
+            if self.closed:
+                # 等待背压期间close()已执行 写入线程不会再处理新数据
+                raise RuntimeError('BatchWriter is closed')
+            self.pending.setdefault(query, []).extend(rows)
+            self.pending_rows += len(rows)
+            self.submitted += len(rows)
+            if self.oldest is None:
+                # 写入线程需要按新数据的提交时间重新计算等待时间
+                self.oldest = time.monotonic()
+                self.condition.notify_all()
+            elif self.pending_rows >= self.max_rows:
+                self.condition.notify_all()
+
+    def _spill_batch(self, batch: Dict[str, list], rows: int):
+        """
+        将从pending中取出的数据落盘 调用前需在持有condition时设置spilling 不持有condition调用
+        """
+        for query, params_list in batch.items():
+            if self.is_batch_insert(query):
+                for i in range(0, len(params_list), self.max_rows):
+                    self.spill.push(query, params_list[i:i + self.max_rows], uuid.uuid4().hex)
+            else:
+                for params in params_list:
+                    self.spill.push(query, params, None)
+        logging.warning(f"{rows} rows spilled to {self.spill.directory}")
+
+    def _probe_due(self) -> bool:
+        return self.spilled and time.monotonic() - self.last_probe >= self.probe_interval
+
+    def _wait_timeout(self) -> float | None:
+        deadlines = []
+        if self.oldest is not None:
+            deadlines.append(self.oldest + self.max_delay)
+        if self.spilled:
+            deadlines.append(self.last_probe + self.probe_interval)
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - time.monotonic())
+
+    def _ready(self) -> bool:
+        if self.pending_rows == 0:
+            return False
+        return self.closed or self.flush_requested or self.pending_rows >= self.max_rows or \
+            time.monotonic() - self.oldest >= self.max_delay
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                while (not self._ready() and not self._probe_due() and not self.closed) or self.spilling:
+                    self.condition.wait(self._wait_timeout())
+                closing = self.closed and not self._ready()
+                batch = self.pending
+                self.pending = {}
+                self.pending_rows = 0
+                self.oldest = None
+                self.flush_requested = False
+                self.writing = True
+                self.condition.notify_all()  # 唤醒因背压阻塞的生产者
+            if self.spilled and (closing or self._probe_due()):
+                self._replay_spill()
+            for query, rows in batch.items():
+                self._write(query, rows)
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()  # 唤醒等待flush和等待落盘的线程
+            if closing:
+                return
+
+    def _replay_spill(self):
+        """
+        按顺序重放spill 遇到失败即停止 等待下次重放
+        """
+        self.last_probe = time.monotonic()
+        replayed = 0
+        for path in self.spill.segments():
+            segment = self.spill.read(path)
+            if segment is None:
+                continue
+            query, params, token = segment
+            try:
+                self._execute(query, params, token)
+            except Exception as e:
+                logging.warning(f"replay spilled data failed: {e}, retry in {self.probe_interval:.0f}s")
+                return
+            self.spill.remove(path)
+            replayed += 1
+        with self.condition:
+            # 重放期间其他进程可能写入了新的segment 留到下次重放
+            if len(self.spill) == 0:
+                self.spilled = False
+        logging.info(f"{replayed} spilled batches replayed")
+
+    def _execute(self, query: str, params, token: str | None):
+        if token is None:
+            self.execute(query, params)
+        else:
+            self.execute(query, params, settings={'insert_deduplication_token': token})
+
+    def _write(self, query: str, rows: list):
+        if self.is_batch_insert(query):
+            chunks = [rows[i:i + self.max_rows] for i in range(0, len(rows), self.max_rows)]
+        else:
+            chunks = [[params] for params in rows]
+        for chunk in chunks:
+            if self.is_batch_insert(query):
+                params, token = chunk, uuid.uuid4().hex
+            else:
+                params, token = chunk[0], None
+            # spill中有更早的数据 直接落盘保证顺序
+            written = self.spilled
+            for attempt in range(self.max_retries + 1):
+                if written:
+                    break
+                try:
+                    self._execute(query, params, token)
+                    written = True
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        logging.error(f"batch write {len(chunk)} rows failed: {e}")
+                        break
+                    backoff = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+                    logging.warning(f"batch write {len(chunk)} rows failed: {e}, retry in {backoff:.2f}s")
+                    time.sleep(backoff)
+            if self.spilled or not written:
+                if self.spill is not None:
+                    self.spill.push(query, params, token)
+                    with self.condition:
+                        if not self.spilled:
+                            self.spilled = True
+                            self.last_probe = time.monotonic()
+                else:
+                    logging.error(f"{len(chunk)} rows dropped")
+                    with self.condition:
+                        self.dropped += len(chunk)
+            with self.condition:
+                self.finished += len(chunk)
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """
+        等待已提交的数据全部写入
+        :param timeout: 超时时间（秒） 为空则一直等待
+        :return: 是否全部写入
+        """
+        with self.condition:
+            target = self.submitted
+            if self.finished >= target:
+                return True
+            self.flush_requested = True
+            self.condition.notify_all()
+            return self.condition.wait_for(lambda: self.finished >= target, timeout)
+
+    def close(self, timeout: float | None = None):
+        """
+        写入剩余数据 停止写入线程
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout)
 
 
 class ClickHouseManager:
-    def __init__(self, host: str, user: str, password: str, database: str):
-        self.client = Client(
-            host=host,
-            user=user,
-            password=password,
-            database=database
-        )
-        self.data_queue = queue.Queue()
-        self.stop_event = threading.Event()
-        self.thread = threading.Thread(target=self._queue_worker, daemon=True)
-        self.thread.start()
-
-
-    def execute(self, query, params=None):
-        return self.client.execute(query, params)
+    """
+    连接池之上的轻量封装 不持有连接 可以随意创建
+    """
 
-    def execute_queue(self, query, params=None):
+    def __init__(self, pool: ClickHousePool | None = None, spill_dir: str | None = None):
         """
-        使用队列进行异步计算
-        只执行写入
+
+        :param pool: 连接池 默认为进程内共享的连接池
+        :param spill_dir: 异步写入失败时的落盘目录 为空则失败时丢弃 见 BatchWriter
+        """
+        self.pool = pool if pool is not None else get_pool()
+        spill = SpillQueue(spill_dir) if spill_dir is not None else None
+        self.writer = BatchWriter(self.execute, spill=spill)
+
+    def execute(self, query, params=None, **kwargs):
+        """
+        同步执行 每次查询从连接池借出一个连接
         :param query:
         :param params:
+        :param kwargs: 透传给clickhouse_driver.Client.execute 如 columnar=True settings={'use_numpy': True}
         :return:
         """
-        self.data_queue.put((query, params))
+        return self.pool.execute(query, params, **kwargs)
 
-    def _queue_worker(self):
+    def execute_iter(self, query, params=None, block_size: int = 100_000, settings: dict | None = None
+                     ) -> Iterator[List[tuple]]:
         """
-        后台线程
-        从队列读取数据
-        并写入clickhouse
-        :return:
+        流式读取 查询结果按块返回 不会一次性加载到内存
+        迭代期间占用连接池中的一个连接 中途停止迭代时断开该连接以丢弃未读完的结果
+        :param query:
+        :param params:
+        :param block_size: 每块的行数 同时作为服务端的max_block_size
+        :param settings:
+        :return: 每次返回不超过block_size行
         """
-        while not self.stop_event.is_set():
+        settings = dict(settings or {})
+        settings.setdefault('max_block_size', block_size)
+        with self.pool.connection() as client:
+            finished = False
             try:
-                # 批量写入数据
-                while True:
-                    query, params = self.data_queue.get()
-                    if query is not None:
-                        self.execute_queue(query, params)
-            except queue.Empty:
-                continue  # 如果队列为空，继续等待
-            except Exception as e:
-                print(f"Error writing to ClickHouse: {e}")
+                yield from client.execute_iter(query, params, settings=settings, chunk_size=block_size)
+                finished = True
+            finally:
+                if not finished:
+                    client.disconnect()
+
+    def execute_queue(self, query, params=None):
+        """
+        异步写入 见 BatchWriter
+        INSERT ... VALUES 语句按语句合并批量写入
+        :param query:
+        :param params: 一行（tuple/dict）或多行（list）
+        :return:
+        """
+        self.writer.put(query, params)
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """
+        等待execute_queue提交的数据全部写入
+        """
+        return self.writer.flush(timeout)
+
+    def close(self):
+        """
+        写入剩余数据并停止写入线程
+        """
+        self.writer.close()
+
+
+def rows_to_columns(rows: List[tuple], names: Sequence[str]) -> Dict[str, np.ndarray]:
+    """
+    将一块行数据转置为列式numpy数组 DateTime列转换为datetime64
+    :param rows: execute_iter 返回的一块
+    :param names: 列名 与查询的字段顺序一致
+    :return: 列名 -> numpy数组
+    """
+    columns = {}
+    for name, column in zip(names, zip(*rows)):
+        array = np.asarray(column)
+        if array.dtype == object and len(array) > 0 and hasattr(array[0], 'timetuple'):
+            array = array.astype('datetime64[s]')
+        columns[name] = array
+    return columns
+
+
+def new_db_connection(spill_dir: str | None = None) -> ClickHouseManager:
+    return ClickHouseManager(spill_dir=spill_dir)
+
+
+_shared_db_connection: ClickHouseManager | None = None
+_shared_db_connection_lock = threading.Lock()
+
+
+def shared_db_connection() -> ClickHouseManager:
+    """
+    进程内共享的ClickHouseManager 供多个symbol的kline存储及策略status/action共用
+    所有execute_queue共用一个写入线程 进程退出时写入剩余数据
+    :return:
+    """
+    global _shared_db_connection
+    with _shared_db_connection_lock:
+        if _shared_db_connection is None:
+            _shared_db_connection = new_db_connection(spill_dir=CLICKHOUSE_SPILL_DIR)
+            atexit.register(_shared_db_connection.close)
+        return _shared_db_connection
+
+
+def test_batch_writer():
+    written = []
+
+    def execute(query, params, settings=None):
+        time.sleep(0.01)  # 模拟网络耗时
+        written.append(len(params))
+
+    writer = BatchWriter(execute, max_rows=100, max_delay=0.2, max_pending=250)
+    start = time.perf_counter()
+    for i in range(1000):
+        writer.put('INSERT INTO t (a) VALUES', (i,))
+    logging.info(f"put 1000 rows in {time.perf_counter() - start:.3f}s")
+    writer.flush()
+    logging.info(f"{sum(written)} rows written in {len(written)} inserts")
+    writer.close()
+
+    # 生产者因背压阻塞时close() 生产者收到异常 已提交的数据全部写入 flush不会卡住
+    writer = BatchWriter(lambda query, params, settings=None: time.sleep(0.2), max_rows=10, max_pending=10)
+    errors = []
+
+    def produce():
+        try:
+            for i in range(100):
+                writer.put('INSERT INTO t (a) VALUES', (i,))
+        except RuntimeError as e:
+            errors.append(e)
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    time.sleep(0.05)
+    writer.close()
+    producer.join()
+    logging.info(f"closed while blocked: {errors}, {writer.submitted} rows submitted, flushed: {writer.flush(1)}")
+
+
+def test_spill():
+    import tempfile
+
+    class FakeDatabase:
+        def __init__(self):
+            self.available = False
+            self.tokens = set()
+            self.rows = 0
+
+        def execute(self, query, params, settings=None):
+            if not self.available:
+                raise NetworkError('database unavailable')
+            token = settings['insert_deduplication_token']
+            if token not in self.tokens:
+                self.tokens.add(token)
+                self.rows += len(params)
+
+    db = FakeDatabase()
+    with tempfile.TemporaryDirectory() as directory:
+        writer = BatchWriter(db.execute, max_rows=100, max_delay=0.05, max_pending=500, max_retries=1,
+                             backoff_base=0.01, spill=SpillQueue(directory), probe_interval=0.2)
+        for i in range(2000):
+            writer.put('INSERT INTO t (a) VALUES', (i,))
+        writer.flush()
+        logging.info(f"database down: {len(writer.spill)} segments spilled, {db.rows} rows written")
+        db.available = True
+        time.sleep(0.5)
+        logging.info(f"database up: {len(writer.spill)} segments left, {db.rows} rows written")
+        writer.close()
+
 
-def new_db_connection() -> ClickHouseManager:
-    return ClickHouseManager(host='192.168.3.64', user='gx', password='1234566', database='btc_quant')
+if __name__ == '__main__':
+    test_batch_writer()
+    test_spill()
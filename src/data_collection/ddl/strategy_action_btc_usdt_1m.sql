@@ -18,4 +18,9 @@ create table strategy_action_btc_usdt_1m
 )
 engine = MergeTree()
 PARTITION BY version -- 按策略分区
-ORDER BY (version, action_time, id) comment 'btc现货交易策略的action信息';
\ No newline at end of file
+ORDER BY (version, action_time, id)
+SETTINGS non_replicated_deduplication_window = 1000 -- 异步写入重试/重放时按insert_deduplication_token去重
+comment 'btc现货交易策略的action信息';
+
+-- 已有的表：
+-- ALTER TABLE strategy_action_btc_usdt_1m MODIFY SETTING non_replicated_deduplication_window = 1000;
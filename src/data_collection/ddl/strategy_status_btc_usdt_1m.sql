@@ -69,4 +69,9 @@ create table strategy_status_btc_usdt_1m
 )
     engine = ReplacingMergeTree()
         PARTITION BY version -- 按策略分区
-        ORDER BY (open_time, version) comment 'btc现货交易策略的status信息';
\ No newline at end of file
+        ORDER BY (open_time, version)
+        SETTINGS non_replicated_deduplication_window = 1000 -- 异步写入重试/重放时按insert_deduplication_token去重
+        comment 'btc现货交易策略的status信息';
+
+-- 已有的表：
+-- ALTER TABLE strategy_status_btc_usdt_1m MODIFY SETTING non_replicated_deduplication_window = 1000;
@@ -0,0 +1,336 @@
+"""
+k线本地列式缓存
+1.按 表名/月份 存储 每个月一个 .npy 文件（结构化数组 字段见 KLINE_DTYPE）
+2.读取时使用内存映射（mmap_mode='r'） 多个进程共享同一份page cache
+3.已结束且数据库中已有后续数据的月份标记为完整 之后不再读取k线
+  每次读取时按月核对数据库中的k线数（一次聚合查询） 月份被修补后（repair_gaps/load_archives）不一致则重建
+4.当前月份增量追加：只从数据库读取缓存中最后一根k线之后的数据 追加后k线数少于数据库时（缓存之前的区间被修补）重新读取整月
+5.写入时先写临时文件再原子替换 并发读取的进程不会读到半个文件
+6.高周期k线（5m/15m/1h/4h/1d）由1m k线按月向量化聚合 完整月份的聚合结果同样缓存在 表名/周期/月份.npy
+"""
+import os
+from datetime import datetime
+from typing import Dict, List
+
+import numpy as np
+
+from config import KLINE_CACHE_DIR
+from data_collection.api.binance_api import KLINE_COLUMNS, KLINE_DTYPE, interval_to_milliseconds
+from data_collection.dao.kline_store import KlineStore, KlineDao, KlineKey, wall_clock_ms
+from log import *
+
+
+def month_start(date: datetime) -> datetime:
+    return datetime(date.year, date.month, 1)
+
+
+def next_month(date: datetime) -> datetime:
+    if date.month == 12:
+        return datetime(date.year + 1, 1, 1)
+    return datetime(date.year, date.month + 1, 1)
+
+
+def iter_months(from_date: datetime, to_date: datetime) -> List[datetime]:
+    months = []
+    month = month_start(from_date)
+    while month <= to_date:
+        months.append(month)
+        month = next_month(month)
+    return months
+
+
+def wall_clock_datetime(ms: int) -> datetime:
+    return np.datetime64(int(ms), 'ms').astype(datetime)
+
+
+# 可由低周期k线聚合得到的周期 均能整除一天 保证聚合后的k线不跨月
+ROLLUP_INTERVALS = ('3m', '5m', '15m', '30m', '1h', '2h', '4h', '6h', '8h', '12h', '1d')
+
+# 聚合方式 open取第一根 close取最后一根 high/low取极值 其余累加
+ROLLUP_SUM_COLUMNS = ('volume', 'quote_asset_volume', 'num_of_trades', 'taker_buy_base_volume',
+                      'taker_buy_quote_volume')
+
+
+def resample_rows(rows: np.ndarray, interval: str) -> np.ndarray:
+    """
+    将低周期k线聚合为高周期k线 缺失k线的周期不会补齐
+    :param rows: 结构化数组 按open_time升序
+    :param interval: 目标周期 如 '1h'
+    :return: 结构化数组 dtype为KLINE_DTYPE
+    """
+    step = interval_to_milliseconds(interval)
+    if len(rows) == 0:
+        return np.empty(0, dtype=KLINE_DTYPE)
+    bucket = rows['open_time'] - rows['open_time'] % step
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], len(rows)] - 1
+    result = np.empty(len(starts), dtype=KLINE_DTYPE)
+    result['open_time'] = bucket[starts]
+    result['close_time'] = bucket[starts] + step - 1
+    result['open_price'] = rows['open_price'][starts]
+    result['close_price'] = rows['close_price'][ends]
+    result['high_price'] = np.maximum.reduceat(rows['high_price'], starts)
+    result['low_price'] = np.minimum.reduceat(rows['low_price'], starts)
+    for name in ROLLUP_SUM_COLUMNS:
+        result[name] = np.add.reduceat(rows[name], starts)
+    return result
+
+
+def empty_columns() -> Dict[str, np.ndarray]:
+    return {name: np.empty(0, dtype=dtype) for name, dtype in KLINE_COLUMNS.items()}
+
+
+class KlineCache:
+    """
+    单个k线表的本地缓存
+    """
+
+    def __init__(self, store: KlineStore, cache_dir: str = KLINE_CACHE_DIR):
+        """
+
+        :param store: 数据来源
+        :param cache_dir: 缓存根目录
+        """
+        self.store = store
+        self.directory = os.path.join(cache_dir, store.table_name)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, month: datetime) -> str:
+        return os.path.join(self.directory, f"{month:%Y%m}.npy")
+
+    def _rollup_path(self, month: datetime, interval: str) -> str:
+        return os.path.join(self.directory, interval, f"{month:%Y%m}.npy")
+
+    def _complete_path(self, month: datetime) -> str:
+        return os.path.join(self.directory, f"{month:%Y%m}.complete")
+
+    def _load(self, month: datetime) -> np.ndarray | None:
+        path = self._path(month)
+        if not os.path.exists(path):
+            return None
+        return np.load(path, mmap_mode='r')
+
+    def _save(self, month: datetime, rows: np.ndarray, complete: bool):
+        self._write(self._path(month), rows)
+        if complete:
+            with open(self._complete_path(month), 'w'):
+                pass
+
+    @staticmethod
+    def _write(path: str, rows: np.ndarray):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, rows)
+        os.replace(tmp_path, path)
+
+    def load_month(self, month: datetime, db_last_date: datetime | None = None, db_count: int | None = None
+                   ) -> np.ndarray:
+        """
+        读取一个月的k线 缓存缺失或不完整时从数据库补齐
+        :param month: 月初
+        :param db_last_date: 数据库中最新的k线时间 用于判断该月是否已完整 为空时查询数据库
+        :param db_count: 数据库中该月的k线数 见 KlineStore.month_counts 为空则不校验
+        :return: 结构化数组 按open_time升序
+        """
+        cached = self._load(month)
+        if cached is not None and os.path.exists(self._complete_path(month)):
+            if db_count is None or len(cached) == db_count:
+                return cached
+            # 该月已被修补 缓存过期
+            logging.info(f"cache {self.store.table_name} {month:%Y%m} is stale: {len(cached)} rows, db {db_count} rows")
+            self.invalidate(month)
+            cached = None
+
+        end = next_month(month)
+        if cached is not None and len(cached) > 0:
+            # 增量追加 只读取缓存之后的数据
+            last_open_time = wall_clock_datetime(cached['open_time'][-1])
+            columns = self.store.select_columns(last_open_time, end, right_open=True)
+            keep = columns['open_time'] > cached['open_time'][-1]
+            columns = {name: column[keep] for name, column in columns.items()}
+        else:
+            cached = np.empty(0, dtype=KLINE_DTYPE)
+            columns = self.store.select_columns(month, end, right_open=True)
+
+        if db_count is not None and len(cached) + len(columns['open_time']) < db_count:
+            # 缓存之前的区间被修补 增量追加无法读到 重新读取整月
+            cached = np.empty(0, dtype=KLINE_DTYPE)
+            columns = self.store.select_columns(month, end, right_open=True)
+
+        if db_last_date is None:
+            db_last_date = self.store.last_date()
+        complete = db_last_date is not None and db_last_date >= end
+        if len(columns['open_time']) == 0 and not complete:
+            return cached
+
+        rows = np.empty(len(cached) + len(columns['open_time']), dtype=KLINE_DTYPE)
+        rows[:len(cached)] = cached
+        for name in KLINE_COLUMNS:
+            rows[name][len(cached):] = columns[name]
+        self._save(month, rows, complete)
+        logging.info(f"cache {self.store.table_name} {month:%Y%m}: {len(rows)} rows, complete: {complete}")
+        return np.load(self._path(month), mmap_mode='r')
+
+    def load_rollup(self, month: datetime, interval: str, db_last_date: datetime | None = None,
+                    db_count: int | None = None) -> np.ndarray:
+        """
+        读取一个月的高周期k线 只缓存完整月份的聚合结果
+        :param month: 月初
+        :param interval: 目标周期 见 ROLLUP_INTERVALS
+        :param db_last_date: 见 load_month
+        :param db_count: 见 load_month
+        :return: 结构化数组 按open_time升序
+        """
+        path = self._rollup_path(month, interval)
+        if os.path.exists(path) and (db_count is None or self._cached_count(month) == db_count):
+            return np.load(path, mmap_mode='r')
+        rows = resample_rows(self.load_month(month, db_last_date, db_count), interval)
+        if os.path.exists(self._complete_path(month)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._write(path, rows)
+        return rows
+
+    def get_columns(self, from_date: datetime, to_date: datetime, interval: str | None = None
+                    ) -> Dict[str, np.ndarray]:
+        """
+        读取 [from_date, to_date] 的k线
+        :param from_date: 高周期时向下取整到周期起点 即包含from_date所在的k线
+        :param to_date:
+        :param interval: k线周期 默认为表本身的周期
+        :return: 见 data_collection.api.binance_api.KLINE_COLUMNS
+        """
+        if interval is None or interval == self.store.key.interval:
+            step = None
+        elif interval in ROLLUP_INTERVALS and \
+                interval_to_milliseconds(interval) > interval_to_milliseconds(self.store.key.interval):
+            step = interval_to_milliseconds(interval)
+        else:
+            raise ValueError(f'can not rollup {self.store.key.interval} klines to "{interval}"')
+        months = iter_months(from_date, to_date)
+        counts = self.store.month_counts(months[0], next_month(months[-1]))
+        db_last_date = None
+        if not all(os.path.exists(self._complete_path(month)) for month in months):
+            db_last_date = self.store.last_date()
+        if step is None:
+            parts = [self.load_month(month, db_last_date, counts.get(month, 0)) for month in months]
+        else:
+            parts = [self.load_rollup(month, interval, db_last_date, counts.get(month, 0)) for month in months]
+        parts = [part for part in parts if len(part) > 0]
+        if len(parts) == 0:
+            return empty_columns()
+        from_ms = wall_clock_ms(from_date)
+        if step is not None:
+            from_ms -= from_ms % step
+        to_ms = wall_clock_ms(to_date)
+        # 首尾两个月按时间截取
+        first = parts[0]
+        parts[0] = first[np.searchsorted(first['open_time'], from_ms, side='left'):]
+        last = parts[-1]
+        parts[-1] = last[:np.searchsorted(last['open_time'], to_ms, side='right')]
+        if len(parts) == 1:
+            rows = parts[0]
+            return {name: rows[name] for name in KLINE_COLUMNS}
+        return {name: np.concatenate([part[name] for part in parts]) for name in KLINE_COLUMNS}
+
+    def _cached_count(self, month: datetime) -> int | None:
+        cached = self._load(month)
+        return None if cached is None else len(cached)
+
+    def invalidate(self, month: datetime | None = None):
+        """
+        删除缓存
+        :param month: 为空则删除全部月份
+        """
+        months = [month] if month is not None else [
+            datetime.strptime(name[:6], '%Y%m') for name in os.listdir(self.directory) if name.endswith('.npy')
+        ]
+        rollups = [name for name in os.listdir(self.directory) if os.path.isdir(os.path.join(self.directory, name))]
+        for m in months:
+            paths = [self._path(m), self._complete_path(m)] + [self._rollup_path(m, interval) for interval in rollups]
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+def columns_to_kline_daos(columns: Dict[str, np.ndarray]) -> List[KlineDao]:
+    """
+    列式k线转换为KlineDao列表 与 KlineStore.select 的返回格式一致
+    """
+    values = [
+        column.astype('datetime64[ms]').astype(datetime).tolist() if name in ('open_time', 'close_time')
+        else column.tolist()
+        for name, column in columns.items()
+    ]
+    return [KlineDao(*row) for row in zip(*values)]
+
+
+_kline_caches: Dict[str, KlineCache] = {}
+
+
+def get_kline_cache(store: KlineStore) -> KlineCache:
+    cache = _kline_caches.get(store.table_name)
+    if cache is None:
+        cache = KlineCache(store)
+        _kline_caches[store.table_name] = cache
+    return cache
+
+
+def test():
+    import tempfile
+
+    class FakeStore:
+        """
+        内存中的k线表 2024-12-01 ~ 2025-01-01 每分钟一根
+        """
+        table_name = 'kline_test_1m'
+        key = KlineKey('binance', 'spot', 'TEST', '1m')
+
+        def __init__(self):
+            self.open_time = np.arange(wall_clock_ms(datetime(2024, 12, 1)), wall_clock_ms(datetime(2025, 1, 1)),
+                                       60000, dtype=np.int64)
+            self.queries = 0
+
+        def last_date(self) -> datetime:
+            return wall_clock_datetime(self.open_time[-1])
+
+        def month_counts(self, from_date, to_date):
+            values, counts = np.unique(self.open_time.astype('datetime64[ms]').astype('datetime64[M]'),
+                                       return_counts=True)
+            months = [datetime(value.year, value.month, 1) for value in values.astype(datetime)]
+            return {month: int(count) for month, count in zip(months, counts) if from_date <= month < to_date}
+
+        def select_columns(self, from_timestamp, to_timestamp, right_open=False):
+            self.queries += 1
+            keep = (self.open_time >= wall_clock_ms(from_timestamp)) & (self.open_time < wall_clock_ms(to_timestamp))
+            open_time = self.open_time[keep]
+            return {name: open_time + 59999 if name == 'close_time' else open_time.astype(dtype)
+                    for name, dtype in KLINE_COLUMNS.items()}
+
+    store = FakeStore()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = KlineCache(store, cache_dir)
+        columns = cache.get_columns(datetime(2024, 12, 30), datetime(2025, 1, 2))
+        logging.info(f"{len(columns['open_time'])} rows, {store.queries} queries")
+        # 数据库新增数据后 当前月份增量追加 12月已完整不再查询
+        store.open_time = np.append(store.open_time, store.open_time[-1] + np.arange(1, 61) * 60000)
+        columns = cache.get_columns(datetime(2024, 12, 30), datetime(2025, 1, 2))
+        logging.info(f"{len(columns['open_time'])} rows, {store.queries} queries")
+        # 修补已完整月份中的缺口 缓存按k线数校验后重建
+        hole = (store.open_time >= wall_clock_ms(datetime(2024, 12, 31))) & \
+               (store.open_time < wall_clock_ms(datetime(2024, 12, 31, 1)))
+        filled = store.open_time
+        store.open_time = store.open_time[~hole]
+        cache.invalidate()
+        cache.get_columns(datetime(2024, 12, 30), datetime(2025, 1, 2))
+        store.open_time = filled
+        columns = cache.get_columns(datetime(2024, 12, 30), datetime(2025, 1, 2))
+        logging.info(f"after repair: {len(columns['open_time'])} rows, {store.queries} queries")
+        daos = columns_to_kline_daos({name: column[:2] for name, column in columns.items()})
+        logging.info(daos[0])
+        hourly = cache.get_columns(datetime(2024, 12, 30, 0, 30), datetime(2025, 1, 2), interval='1h')
+        logging.info(f"1h: {len(hourly['open_time'])} rows, volume of first: {hourly['volume'][0]}")
+        logging.info(f"rollups cached: {os.listdir(os.path.join(cache.directory, '1h'))}")
+
+
+if __name__ == '__main__':
+    test()
@@ -11,7 +11,8 @@ def scrypt(first_date: datetime = datetime(2020, 1, 1, 0, 0)):
     # if last_date > first_date:
     #     first_date = last_date
     first_date = datetime(2019, 5, 15, 2, 55)
-    connection.collect_up2date_data(first_date)
+    # 中断后重新运行 会跳过checkpoint中已完成的时间窗口
+    connection.collect_up2date_data(first_date, checkpoint_path='kline_btc_usdt_1m.backfill')
 
 
 if __name__ == '__main__':
@@ -10,7 +10,8 @@ def scrypt(first_date: datetime = datetime(2020, 1, 1, 0, 0)):
     logging.info(f'last_date {last_date}')
     if last_date > first_date:
         first_date = last_date
-    connection.collect_up2date_data(first_date)
+    # 中断后重新运行 会跳过checkpoint中已完成的时间窗口
+    connection.collect_up2date_data(first_date, checkpoint_path='kline_eth_usdt_1m.backfill')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,15 @@
+"""
+从Binance月度归档文件批量导入k线
+归档下载地址 https://data.binance.vision/?prefix=data/spot/monthly/klines/BTCUSDT/1m/
+"""
+from data_collection.archive_loader import load_archive_dir
+
+ARCHIVE_DIR = './data/spot/monthly/klines/BTCUSDT/1m'
+
+
+def scrypt(directory: str = ARCHIVE_DIR, symbol: str = 'BTCUSDT', interval: str = '1m'):
+    load_archive_dir(directory, symbol=symbol, interval=interval)
+
+
+if __name__ == '__main__':
+    scrypt()
@@ -0,0 +1,24 @@
+"""
+在同一进程中回填多个交易对的k线历史数据
+所有交易对共用一个数据库连接和一个Binance限流器
+"""
+from datetime import datetime
+from typing import List
+
+from data_collection.dao.kline_store import get_kline_store
+from log import *
+
+SYMBOLS = ['BTCUSDT', 'ETHUSDT']
+
+
+def scrypt(symbols: List[str] = SYMBOLS, interval: str = '1m', first_date: datetime = datetime(2020, 1, 1, 0, 0)):
+    for symbol in symbols:
+        store = get_kline_store(symbol, interval)
+        last_date = store.last_date()
+        logging.info(f'{store.table_name} last_date {last_date}')
+        from_date = max(first_date, last_date) if last_date is not None else first_date
+        store.collect_up2date_data(from_date, checkpoint_path=f'{store.table_name}.backfill')
+
+
+if __name__ == '__main__':
+    scrypt()
@@ -0,0 +1,22 @@
+"""
+修补k线历史数据中的缺口
+只拉取缺失的区间 不重新爬取整段历史
+"""
+from datetime import datetime
+from typing import List
+
+from data_collection.dao.kline_store import get_kline_store
+from log import *
+
+SYMBOLS = ['BTCUSDT', 'ETHUSDT']
+
+
+def scrypt(symbols: List[str] = SYMBOLS, interval: str = '1m', first_date: datetime = datetime(2020, 1, 1, 0, 0)):
+    for symbol in symbols:
+        store = get_kline_store(symbol, interval)
+        total = store.repair_gaps(first_date)
+        logging.info(f'{store.table_name} repaired {total} klines')
+
+
+if __name__ == '__main__':
+    scrypt()
@@ -0,0 +1,18 @@
+"""
+常驻运行 通过websocket实时采集k线并写库
+"""
+import asyncio
+from typing import List
+
+from data_collection.api.kline_stream import KlineStreamService
+
+SYMBOLS = ['BTCUSDT', 'ETHUSDT']
+
+
+def scrypt(symbols: List[str] = SYMBOLS, interval: str = '1m'):
+    service = KlineStreamService(symbols, interval=interval)
+    asyncio.run(service.run())
+
+
+if __name__ == '__main__':
+    scrypt()
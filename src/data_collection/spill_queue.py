@@ -0,0 +1,73 @@
+"""
+写入失败时的本地落盘队列
+1.每个批次一个segment文件 文件名以纳秒时间戳开头 按文件名排序即提交顺序
+2.写入时先写临时文件再原子替换 进程崩溃不会留下半个segment
+3.每个批次带有去重token（insert_deduplication_token） 重放时重复写入会被clickhouse去重 保证至少一次且不重复
+  非Replicated表需要设置non_replicated_deduplication_window 见 ddl/strategy_action_btc_usdt_1m.sql
+"""
+import itertools
+import os
+import pickle
+import threading
+import time
+from typing import List, Tuple
+
+from log import *
+
+SEGMENT_SUFFIX = '.seg'
+
+
+class SpillQueue:
+    def __init__(self, directory: str):
+        """
+
+        :param directory: segment文件目录 多个进程可共用
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def push(self, query: str, rows: list, token: str | None):
+        """
+        追加一个批次
+        :param query: INSERT ... VALUES 语句
+        :param rows: 行数据
+        :param token: 去重token
+        :return:
+        """
+        with self.lock:
+            name = f"{time.time_ns():020d}-{os.getpid()}-{next(self.counter):06d}{SEGMENT_SUFFIX}"
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((query, rows, token), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def segments(self) -> List[str]:
+        """
+        按提交顺序返回全部segment文件
+        """
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+        return [os.path.join(self.directory, name) for name in names]
+
+    @staticmethod
+    def read(path: str) -> Tuple[str, list, str | None] | None:
+        """
+        读取一个segment 已被其他进程重放删除时返回None
+        """
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def __len__(self):
+        return len(self.segments())
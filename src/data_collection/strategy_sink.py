@@ -0,0 +1,245 @@
+"""
+策略status/action数据的输出目标
+1.ClickHouseSink: 写入clickhouse 实盘使用 connector在首次写入时才创建
+2.ParquetSink: 写入本地parquet文件 回测使用 无需数据库 并行回测互不影响
+3.JournalSink: action写入本地二进制追加日志 见 data_collection.action_journal status交给另一个sink
+4.MemorySink: 保存在内存中 用于单元测试和notebook分析
+5.NullSink: 丢弃全部数据 用于参数扫描等只关心最终结果的场景
+通过 new_sink(kind) 按名称创建 默认值见 config.STRATEGY_SINK
+"""
+import importlib.util
+import os
+from datetime import datetime
+from abc import ABC, abstractmethod
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from config import STRATEGY_SINK, STRATEGY_SINK_DIR
+from data_collection.action_journal import ActionJournal, ms_to_wall_clock
+from data_collection.dao.strategy_action_btc_spot_trading_usdt_1m import StrategyActionBtcUSDT1mInsertDao
+from log import *
+
+
+class StrategySink(ABC):
+    @abstractmethod
+    def write_status(self, columns: Dict[str, np.ndarray]):
+        """
+        写入一块status数据
+        :param columns: 列名 -> numpy数组 列名见StrategyStatusBtcUSDT1mDao
+        """
+
+    @abstractmethod
+    def write_action(self, action: StrategyActionBtcUSDT1mInsertDao):
+        """
+        写入一条action数据
+        """
+
+    def write_action_values(self, version: str, action_time: int, status: int, open_price: float,
+                            close_price: float, quantity: float, open_cost: float,
+                            expected_gross_value: float | None, actual_gross_value: float | None,
+                            expected_commission: float | None, actual_commission: float | None):
+        """
+        写入一条action数据 策略调用的入口
+        默认构造StrategyActionBtcUSDT1mInsertDao后调用write_action 子类可直接写入原始值
+        :param action_time: 毫秒时间戳（墙上时间）
+        """
+        self.write_action(StrategyActionBtcUSDT1mInsertDao(
+            version, ms_to_wall_clock(action_time), status, open_price, close_price, quantity, open_cost,
+            expected_gross_value, actual_gross_value, expected_commission, actual_commission,
+        ))
+
+    def flush(self):
+        """
+        写出缓冲中的数据
+        """
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class NullSink(StrategySink):
+    def write_status(self, columns: Dict[str, np.ndarray]):
+        pass
+
+    def write_action(self, action: StrategyActionBtcUSDT1mInsertDao):
+        pass
+
+    def write_action_values(self, *values):
+        pass
+
+
+class MemorySink(StrategySink):
+    def __init__(self):
+        self.status_blocks: List[Dict[str, np.ndarray]] = []
+        self.actions: List[StrategyActionBtcUSDT1mInsertDao] = []
+
+    def write_status(self, columns: Dict[str, np.ndarray]):
+        self.status_blocks.append(columns)
+
+    def write_action(self, action: StrategyActionBtcUSDT1mInsertDao):
+        self.actions.append(action)
+
+    def status(self) -> pd.DataFrame:
+        """
+        全部status数据
+        """
+        if len(self.status_blocks) == 0:
+            return pd.DataFrame()
+        return pd.concat([pd.DataFrame(block) for block in self.status_blocks], ignore_index=True)
+
+    def action(self) -> pd.DataFrame:
+        """
+        全部action数据
+        """
+        return pd.DataFrame(self.actions, columns=StrategyActionBtcUSDT1mInsertDao._fields)
+
+
+def version_file_name(version: str) -> str:
+    """
+    版本号中含有冒号等文件名不支持的字符 替换为下划线
+    """
+    return ''.join(c if c.isalnum() or c in '-_' else '_' for c in version)
+
+
+class ClickHouseSink(StrategySink):
+    def __init__(self):
+        self.status_connector = None
+        self.action_connector = None
+
+    def write_status(self, columns: Dict[str, np.ndarray]):
+        if self.status_connector is None:
+            from data_collection.dao.strategy_status_btc_spot_trading_usdt_1m import StrategyStatusBtcUSDT1mConnector
+            self.status_connector = StrategyStatusBtcUSDT1mConnector()
+        # 与action一样放入异步写入队列 不在bar循环中等待数据库
+        self.status_connector.insert_columns_queue(columns)
+
+    def write_action(self, action: StrategyActionBtcUSDT1mInsertDao):
+        if self.action_connector is None:
+            from data_collection.dao.strategy_action_btc_spot_trading_usdt_1m import StrategyActionBtcUSDT1mConnector
+            self.action_connector = StrategyActionBtcUSDT1mConnector()
+        self.action_connector.insert_single_queue(action)
+
+    def flush(self):
+        if self.status_connector is not None:
+            self.status_connector.flush()
+        if self.action_connector is not None:
+            self.action_connector.flush()
+
+
+class ParquetSink(StrategySink):
+    """
+    每次运行一个目录 {directory}/{version}/ version取自写入的数据
+    status每块一个文件 status-00000.parquet ...
+    action攒够block_size条写一个文件 action-00000.parquet ...
+    需要安装pyarrow或fastparquet
+    """
+
+    def __init__(self, directory: str = STRATEGY_SINK_DIR, block_size: int = 100_000):
+        if importlib.util.find_spec('pyarrow') is None and importlib.util.find_spec('fastparquet') is None:
+            raise ImportError('ParquetSink requires pyarrow or fastparquet')
+        self.root = directory
+        self.directory: str | None = None  # 首次写入时按version创建
+        self.block_size = block_size
+        self.status_parts = 0
+        self.action_parts = 0
+        self.actions: List[StrategyActionBtcUSDT1mInsertDao] = []
+
+    def _run_directory(self, version: str) -> str:
+        if self.directory is None:
+            self.directory = os.path.join(self.root, version_file_name(version))
+            os.makedirs(self.directory, exist_ok=True)
+        return self.directory
+
+    def write_status(self, columns: Dict[str, np.ndarray]):
+        if len(columns['open_time']) == 0:
+            return
+        path = os.path.join(self._run_directory(columns['version'][0]), f"status-{self.status_parts:05d}.parquet")
+        pd.DataFrame(columns).to_parquet(path, index=False)
+        self.status_parts += 1
+
+    def write_action(self, action: StrategyActionBtcUSDT1mInsertDao):
+        self.actions.append(action)
+        if len(self.actions) >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.actions) == 0:
+            return
+        path = os.path.join(self._run_directory(self.actions[0].version), f"action-{self.action_parts:05d}.parquet")
+        pd.DataFrame(self.actions, columns=StrategyActionBtcUSDT1mInsertDao._fields).to_parquet(path, index=False)
+        self.action_parts += 1
+        self.actions = []
+        logging.info(f"strategy data saved to {self.directory}")
+
+
+class JournalSink(StrategySink):
+    """
+    action写入二进制追加日志 之后可通过 data_collection.action_journal.replay_to_db 补写入数据库
+    默认每次运行一个文件 {directory}/{version}.journal 并发运行的回测互不干扰（journal文件只允许一个进程写入）
+    """
+
+    def __init__(self, path: str | None = None, status_sink: StrategySink | None = None,
+                 directory: str = STRATEGY_SINK_DIR):
+        """
+
+        :param path: journal文件路径 为空则按version写入directory下的文件 指定时由调用方保证只有一个进程写入
+        :param status_sink: status数据的输出目标 默认丢弃
+        :param directory: path为空时journal文件所在目录
+        """
+        self.path = path
+        self.directory = directory
+        self.journal = ActionJournal(path) if path is not None else None
+        self.status_sink = status_sink if status_sink is not None else NullSink()
+        self.version = None
+        self.version_id = None
+
+    def write_status(self, columns: Dict[str, np.ndarray]):
+        self.status_sink.write_status(columns)
+
+    def write_action(self, action: StrategyActionBtcUSDT1mInsertDao):
+        action_time = int((action.action_time - datetime(1970, 1, 1)).total_seconds() * 1000)
+        self.write_action_values(action.version, action_time, *action[2:])
+
+    def write_action_values(self, version: str, *values):
+        if version != self.version:
+            if self.path is None:
+                if self.journal is not None:
+                    self.journal.close()
+                self.journal = ActionJournal(os.path.join(self.directory, f"{version_file_name(version)}.journal"))
+            self.version = version
+            self.version_id = self.journal.version_id(version)
+        self.journal.append(self.version_id, *values)
+
+    def flush(self):
+        if self.journal is not None:
+            self.journal.flush()
+        self.status_sink.flush()
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+        self.status_sink.close()
+
+
+SINKS = {
+    'clickhouse': ClickHouseSink,
+    'parquet': ParquetSink,
+    'journal': JournalSink,
+    'memory': MemorySink,
+    'null': NullSink,
+}
+
+
+def new_sink(kind: str = STRATEGY_SINK, **kwargs) -> StrategySink:
+    """
+    按名称创建sink
+    :param kind: clickhouse | parquet | journal | memory | null
+    :param kwargs: 透传给对应的构造函数 如ParquetSink的directory
+    :return:
+    """
+    if kind not in SINKS:
+        raise ValueError(f'sink must be one of {list(SINKS)}, not "{kind}"')
+    return SINKS[kind](**kwargs)
@@ -1,13 +1,21 @@
 from abc import ABC, abstractmethod
+from array import array
+from collections import namedtuple
 from datetime import datetime
 import time
 import random
-from typing import List, Callable
+from typing import Callable, Dict
+
+import numpy as np
+
 from log import *
 
 import backtrader as bt
 
 
+NAN = float('nan')
+
+
 class StrategyInterface(ABC):
     @abstractmethod
     def next(self):
@@ -21,6 +29,12 @@ class StrategyInterface(ABC):
     def init(self, super_strategy: bt.Strategy):
         pass
 
+    def stop(self):
+        """
+        运行结束时调用 默认不做任何操作
+        """
+        pass
+
     @staticmethod
     def generate_random_version():
         timestamp = int(time.time())  # 当前时间戳（秒）
@@ -32,6 +46,13 @@ class StrategyInterface(ABC):
 
 
 class VirtualOrder(ABC):
+    # 订单数量多且长期存活 使用__slots__ 不为每个订单创建__dict__
+    __slots__ = (
+        'open_price', 'close_price', 'quantity', 'direction', 'status', 'leverage', 'principal', 'loan',
+        'expected_gross_value', 'actual_gross_value', 'expected_commission', 'actual_commission',
+        'forced_liquidation_price', 'observer', 'handle',
+    )
+
     def __init__(self, open_price: float, close_price: float, quantity: float, direction: str, leverage: float = 1):
         """
 
@@ -68,6 +89,7 @@ class VirtualOrder(ABC):
             self.forced_liquidation_price = open_price * (1 + 1 / leverage)
 
         self.observer: Callable[[any], None] | None = None
+        self.handle = None  # 在所属订单集合中的句柄 由订单集合维护
 
     def is_buy(self) -> bool:
         if self.direction == 'long':
@@ -146,6 +168,52 @@ class VirtualOrder(ABC):
         self.observer = observer
 
 
+# 已完成订单的紧凑记录 字段与VirtualOrder同名
+ClosedOrder = namedtuple('ClosedOrder', [
+    'open_price', 'close_price', 'quantity', 'leverage',
+    'expected_gross_value', 'actual_gross_value', 'expected_commission', 'actual_commission',
+])
+
+
+class ClosedOrderList:
+    """
+    已完成订单列表
+    已完成的订单只用于统计 不再修改 按列保存为array('d') 每单只占8个double 不保留订单对象及其observer
+    None保存为NaN 读取时还原
+    """
+
+    def __init__(self):
+        self.data: Dict[str, array] = {field: array('d') for field in ClosedOrder._fields}
+
+    def append(self, order: VirtualOrder):
+        self.append_values(*(getattr(order, field) for field in ClosedOrder._fields))
+
+    def append_values(self, *values: float | None):
+        """
+        按ClosedOrder的字段顺序追加一条记录
+        """
+        for column, value in zip(self.data.values(), values):
+            column.append(NAN if value is None else value)
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """
+        列名 -> numpy数组 不复制数据
+        """
+        return {field: np.frombuffer(column, dtype=np.float64) for field, column in self.data.items()}
+
+    def __getitem__(self, index: int) -> ClosedOrder:
+        return ClosedOrder(*(None if value != value else value for value in (
+            column[index] for column in self.data.values()
+        )))
+
+    def __len__(self):
+        return len(self.data['open_price'])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
 class VirtualOrderArrayInterface(ABC):
     """
     虚拟订单集合
@@ -304,7 +372,7 @@ class VirtualOrderBookInterface(ABC):
         """
         1.open_order_array: open订单集合 继承VirtualOrderArrayInterface的类型
         2.close_order_array: close订单集合 继承VirtualOrderArrayInterface的类型
-        3.closed_order_list: close订单集合 list类型
+        3.closed_order_list: 已完成订单集合 ClosedOrderList类型
         :param max_open_price: 开仓最高价格
         :param min_open_price: 开仓最低价格
         :param max_close_price: 平仓最高价格
@@ -333,7 +401,7 @@ class VirtualOrderBookInterface(ABC):
 
         self.open_order_array: VirtualOrderArrayInterface | None = None  # 由子类注入
         self.close_order_array: VirtualOrderArrayInterface | None = None  # 由子类注入
-        self.closed_order_list: List[VirtualOrder] = []
+        self.closed_order_list: ClosedOrderList = ClosedOrderList()
 
     @staticmethod
     def check_direction(direction: str):
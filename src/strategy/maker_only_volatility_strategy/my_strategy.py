@@ -8,16 +8,18 @@ import logging
 import math
 
 import backtrader as bt
+import numpy as np
 
-from data_collection.dao.strategy_action_btc_spot_trading_usdt_1m import StrategyActionBtcUSDT1mConnector, \
-    StrategyActionBtcUSDT1mInsertDao
-from data_collection.dao.strategy_status_btc_spot_trading_usdt_1m import StrategyStatusBtcUSDT1mDao, \
-    StrategyStatusBtcUSDT1mConnector
+from data_collection.strategy_sink import StrategySink, new_sink
 from log import *
-from strategy import StrategyInterface, VirtualOrder
+from strategy import StrategyInterface, VirtualOrder, ClosedOrderList
 from strategy.maker_only_volatility_strategy.order_scheduler import OrderScheduler
 from strategy.virtual_order import VirtualOrderOne
 from strategy.maker_only_volatility_strategy.order_book import PriceOrderGroupVirtualOrderBook
+from strategy.status_recorder import StatusRecorder, StatusSampler, BT_EPOCH, LIVE_BLOCK_SIZE, LIVE_MAX_DELAY
+
+# 订单状态 -> action表的status
+ACTION_STATUS = {'opening': 1, 'opened': 2, 'closing': 3, 'closed': 4, 'canceled': 5}
 
 
 class MakerOnlyLongOnlyVolatilityStrategy(StrategyInterface):
@@ -43,7 +45,14 @@ class MakerOnlyLongOnlyVolatilityStrategy(StrategyInterface):
 
     # CLOSING_ORDER_NUM = 20  # 盘口附近的平单数量
 
-    def __init__(self):
+    def __init__(self, sink: StrategySink | None = None, status_sampler: StatusSampler | None = None,
+                 live: bool = False):
+        """
+
+        :param sink: status/action数据的输出目标 默认见 config.STRATEGY_SINK
+        :param status_sampler: status采样策略 默认每个bar都写入
+        :param live: 是否实盘 实盘时status按时间定期写出 避免崩溃时丢失大量数据
+        """
         self.super_strategy: bt.Strategy | None = None  # 由backtrader注入
         self.order_scheduler: OrderScheduler | None = None  # 由backtrader注入
         self.order_book: PriceOrderGroupVirtualOrderBook | None = None  # 由self.update_param()生成
@@ -74,10 +83,16 @@ class MakerOnlyLongOnlyVolatilityStrategy(StrategyInterface):
         # db相关
         self.STRATEGY_VERSION = self.generate_random_version()
         logging.info("Strategy Version: {}".format(self.STRATEGY_VERSION))
-        self.db_status_connector = StrategyStatusBtcUSDT1mConnector()
-        self.db_action_connector = StrategyActionBtcUSDT1mConnector()
+        self.sink = sink if sink is not None else new_sink()
+        if live:
+            self.status_recorder = StatusRecorder(self.STRATEGY_VERSION, self.sink.write_status, LIVE_BLOCK_SIZE,
+                                                  status_sampler, LIVE_MAX_DELAY)
+        else:
+            self.status_recorder = StatusRecorder(self.STRATEGY_VERSION, self.sink.write_status,
+                                                  sampler=status_sampler)
+        self.status_event = False  # 上次记录status之后是否有订单事件
         ##
-        self.closed_order_list = []  # 保存已完成的订单 MyOrderPair类型 用于数据统计
+        self.closed_order_list = ClosedOrderList()  # 保存已完成的订单 用于数据统计
         ## 原子指标
         ### opening
         self.opening_order_num = 0  # 开仓挂单数
@@ -125,60 +140,65 @@ class MakerOnlyLongOnlyVolatilityStrategy(StrategyInterface):
         :return:
         """
         logging.info(self)
-        self.upload_status_data()  # 状态数据落库
-        self.reset_incremental_status()  # 重置增量数据
+        if self.upload_status_data():  # 状态数据落库
+            self.reset_incremental_status()  # 重置增量数据 未写入时增量数据累加到下一次写入
         self.update_param()  # 更新参数
 
         # 获取当前的收盘价
         current_price = self.get_price()
 
         # self.debug_log()
-        # 向下挂满开单
+        # 向下挂满开单 只为空闲的position构造订单
         open_order_array = self.order_book.open_order_array
-        current_position = self.order_book.open_order_array.get_position_by_price(current_price)
-
-        for position_diff in range(0, self.OPENING_ORDER_NUM):
-            open_position = current_position + position_diff
-            if (
-                    0 <= open_position <= self.OPEN_PRICE_SLOT_NUM  # 判断position是否合法
-                    and self.get_cash() >= self.bet_cash_size  # 判断现金是否足够
-            ):
-                open_price = open_order_array.get_price_by_position(open_position)
-                leverage = self.get_leverage_by_price(open_price)  # 计算杠杆率
-                loan = self.bet_cash_size * (leverage - 1)  # 需要借入的资金量
-                quantity = self.bet_cash_size / current_price * leverage  # 计算带杠杆的买入BTC总量
-                # 向 virtual_open_order_array 上挂开单
-                virtual_order = self.order_book.add_order(
-                    VirtualOrderOne(
-                        open_price=open_price,
-                        close_price=open_price,
-                        quantity=quantity,
-                        direction=self.direction,
-                        leverage=leverage
-                    )
+        current_position = open_order_array.get_position_by_price(current_price)
+        positions = open_order_array.free_positions(current_position, self.OPENING_ORDER_NUM)
+        if len(positions) == 0:
+            return
+        open_prices = open_order_array.price_list[positions]
+        leverages = open_order_array.leverage_list[positions]  # 杠杆率
+        quantities = self.bet_cash_size / current_price * leverages  # 带杠杆的买入BTC总量
+
+        for position, open_price, leverage, quantity in zip(
+                positions.tolist(), open_prices.tolist(), leverages.tolist(), quantities.tolist()
+        ):
+            if self.get_cash() < self.bet_cash_size:  # 判断现金是否足够
+                break
+            if math.isnan(leverage):
+                raise ValueError(f"Error open_price: {open_price} must be greater than {self.min_open_price}")
+            loan = self.bet_cash_size * (leverage - 1)  # 需要借入的资金量
+            # 向 virtual_open_order_array 上挂开单
+            virtual_order = self.order_book.add_order_at(
+                position,
+                VirtualOrderOne(
+                    open_price=open_price,
+                    close_price=open_price,
+                    quantity=quantity,
+                    direction=self.direction,
+                    leverage=leverage
                 )
-                # 生成 actual_order
-                if virtual_order is not None:
-                    # 借入杠杆资金
-                    self.loan += loan
-                    self.super_strategy.broker.add_cash(loan)
-                    # 创建限价单
-                    open_price = virtual_order.open_price
-                    open_quantity = virtual_order.quantity
-                    actual_order = self.super_strategy.buy(
-                        price=open_price,
-                        size=open_quantity,
-                        exectype=bt.Order.Limit
-                    )
-                    # 用于数据统计
-                    self.analysis_opening_order(open_price=open_price, quantity=open_quantity)
-                    # logging.info(f"Order Placed\tDirection: Buy,\tPrice: {new_open_order.price},\tSize: {new_open_order.size}")
+            )
+            # 生成 actual_order
+            if virtual_order is not None:
+                # 借入杠杆资金
+                self.loan += loan
+                self.super_strategy.broker.add_cash(loan)
+                # 创建限价单
+                open_price = virtual_order.open_price
+                open_quantity = virtual_order.quantity
+                actual_order = self.super_strategy.buy(
+                    price=open_price,
+                    size=open_quantity,
+                    exectype=bt.Order.Limit
+                )
+                # 用于数据统计
+                self.analysis_opening_order(open_price=open_price, quantity=open_quantity)
+                # logging.info(f"Order Placed\tDirection: Buy,\tPrice: {new_open_order.price},\tSize: {new_open_order.size}")
 
-                    # order_scheduler
-                    self.order_scheduler.bind(virtual_order=virtual_order, actual_order=actual_order)
+                # order_scheduler
+                self.order_scheduler.bind(virtual_order=virtual_order, actual_order=actual_order)
 
-                    # 上传action数据
-                    self.upload_action_data(virtual_order)
+                # 上传action数据
+                self.upload_action_data(virtual_order)
         # self.debug_log()
 
     def debug_log(self):
@@ -295,107 +315,87 @@ class MakerOnlyLongOnlyVolatilityStrategy(StrategyInterface):
                 * self.OPEN_PRICE_SLOT_NUM
                 / (self.max_open_price - self.min_open_price)
             )
-            # 重构数据结构
-            direction = 'long'
-            order_book = PriceOrderGroupVirtualOrderBook(
-                max_open_price=self.max_open_price,
-                min_open_price=self.min_open_price,
-                max_close_price=self.max_close_price,
-                min_close_price=self.min_close_price,
-                direction=direction,
-                open_array_length=self.OPEN_PRICE_SLOT_NUM,
-                close_array_length=self.CLOSE_PRICE_SLOT_NUM,
-                percentage_minimum_profit=self.PERCENTAGE_MINIMUM_PROFIT,
-                percentage_close_price_step=self.PERCENTAGE_CLOSE_PRICE_STEP,
-                percentage_maximum_profit=self.PERCENTAGE_MAXIMUM_PROFIT
+            if self.order_book is None:
+                direction = 'long'
+                self.order_book = PriceOrderGroupVirtualOrderBook(
+                    max_open_price=self.max_open_price,
+                    min_open_price=self.min_open_price,
+                    max_close_price=self.max_close_price,
+                    min_close_price=self.min_close_price,
+                    direction=direction,
+                    open_array_length=self.OPEN_PRICE_SLOT_NUM,
+                    close_array_length=self.CLOSE_PRICE_SLOT_NUM,
+                    percentage_minimum_profit=self.PERCENTAGE_MINIMUM_PROFIT,
+                    percentage_close_price_step=self.PERCENTAGE_CLOSE_PRICE_STEP,
+                    percentage_maximum_profit=self.PERCENTAGE_MAXIMUM_PROFIT
+                )
+                self.order_scheduler.link_order_book(self.order_book)
+            else:
+                # 就地重建价格网格 只撤销不再有效的开仓挂单 其余挂单保持不变
+                dropped_orders = self.order_book.regrid(
+                    max_open_price=self.max_open_price,
+                    min_open_price=self.min_open_price,
+                    max_close_price=self.max_close_price,
+                    min_close_price=self.min_close_price,
+                    open_array_length=self.OPEN_PRICE_SLOT_NUM,
+                    close_array_length=self.CLOSE_PRICE_SLOT_NUM,
+                )
+                for virtual_order in dropped_orders:
+                    self.order_scheduler.cancel(virtual_order)
+            self.order_book.open_order_array.set_leverage_list(
+                self.get_leverage_by_prices(self.order_book.open_order_array.price_list)
             )
-            self.order_book = order_book
-            self.order_scheduler.link_order_book(order_book)
-            # self.data = MyOrderArrayTriple(
-            #     max_open_price=self.max_open_price, min_open_price=self.min_open_price,
-            #     max_close_price=self.max_close_price, min_close_price=self.min_close_price,
-            #     open_array_length=self.OPEN_PRICE_SLOT_NUM, close_array_length=self.CLOSE_PRICE_SLOT_NUM,
-            #     direction=direction, commission_rate=self.commission_rate
-            # )
-            # 清除所有订单
-            open_orders = self.super_strategy.broker.get_orders_open()
-            if open_orders:
-                for order in open_orders:
-                    self.super_strategy.cancel(order)
-
-    def upload_status_data(self):
-        """
-        上传status数据至数据库
-        :return:
+
+    def upload_status_data(self) -> bool:
+        """
+        记录status数据 由status_recorder按采样策略过滤 攒批后列式写入sink
+        各指标的含义见 data_collection/ddl/strategy_status_btc_usdt_1m.sql
+        账户数据每个bar只向broker读取一次 复合指标在本地计算 与对应的get_*方法一致
+        :return: 是否写入
         """
-        open_time = bt.num2date(self.super_strategy.datetime[0])  # 开盘时间
-        version = self.STRATEGY_VERSION  # 策略版本
         price = self.get_price()  # 市场价格
-
-        opening_order_num = self.opening_order_num  # 开仓挂单数
-        opening_order_quantity = self.opening_order_quantity  # 开仓挂单BTC总量
-        opening_order_value = self.opening_order_value  # 开仓挂单总价；开仓成本=开仓总价 因此不单独计算开仓成本
-
-        closing_order_num = self.closing_order_num  # 平仓挂单数
-        closing_order_quantity = self.closing_order_quantity  # 平仓挂单BTC总量
-        closing_order_value = self.closing_order_value  # 平仓挂单总价
-        closing_order_cost = self.closing_order_cost  # 平仓挂单成本 = sum(每单成本(每单BTC总量 * 每单开仓挂单价格))
-
-        opened_order_num = self.opened_order_num  # 开仓成交单数
-        opened_order_quantity = self.opened_order_quantity  # 开仓成交BTC总量
-        opened_order_value = self.opened_order_value  # 开仓成交总价；开仓成本=开仓总价 因此不单独计算开仓成本
-
-        closed_order_num = self.closed_order_num  # 平仓成交单数
-        closed_order_quantity = self.closed_order_quantity  # 平仓成交BTC总量
-        closed_order_value = self.closed_order_value  # 平仓成交总价
-        closed_order_cost = self.closed_order_cost  # 平仓成交成本 = sum(每单成本(每单BTC总量 * 每单开仓挂单价格))
-
-        cumulative_opening_order_quantity = self.cumulative_opening_order_quantity  # 累计开仓挂单BTC总量
-        cumulative_opening_order_num = self.cumulative_opening_order_num  # 累计开仓挂单数
-        cumulative_opening_order_value = self.cumulative_opening_order_value  # 累计开仓挂单总价 -- 开仓成本=开仓总价 因此不单独计算开仓成本
-        cumulative_closing_order_num = self.cumulative_closing_order_num  # 累计平仓挂单数
-        cumulative_closing_order_quantity = self.cumulative_closing_order_quantity  # 累计平仓挂单BTC总量
-        cumulative_closing_order_value = self.cumulative_closing_order_value  # 累计平仓挂单总价
-        cumulative_closing_order_cost = self.cumulative_closing_order_cost  # 累计平仓挂单成本 = sum(每单成本(每单BTC总量 * 每单开仓挂单价格))
-        cumulative_opened_order_num = self.cumulative_opened_order_num  # 累计开仓成交单数
-        cumulative_opened_order_quantity = self.cumulative_opened_order_quantity  # 累计开仓成交BTC总量'
-        cumulative_opened_order_value = self.cumulative_opened_order_value  # 累计开仓成交总价 -- 开仓成本=开仓总价 因此不单独计算开仓成本
-        cumulative_closed_order_num = self.cumulative_closed_order_num  # 累计平仓成交单数（累计已成交订单数）
-        cumulative_closed_order_quantity = self.cumulative_closed_order_quantity  # 累计平仓成交BTC总量
-        cumulative_closed_order_value = self.cumulative_closed_order_value  # 累计平仓成交总价
-        cumulative_closed_order_cost = self.cumulative_closed_order_cost  # 累计平仓成交成本 = sum(每单成本(每单BTC总量 * 每单开仓挂单价格))',
-
         cash = self.get_cash()  # 现金余额（包含本金和借贷资金）
-        loan = self.loan  # 借贷资金（欠款）
-        holding_quantity = self.get_hold_quantity()  # 实际持仓BTC总量
-        holding_value = self.get_holding_value()  # 实际持仓BTC总价
         total_value = self.get_total_value()  # 实际总资产 = 现金 + 实际持仓BTC总价
-
-        expected_closing_profit = self.get_expected_closing_profit()  # 期望未成交收益 = 平仓挂单总价 - 平仓挂单成本
-        actual_closed_profit = self.get_actual_closed_profit()  # 实际已成交收益 =平仓成交总价 - 平仓成交成本
-        expected_market_close_profit = self.get_expected_market_close_profit()  # 市价平仓期望收益(亏损) = sum((市场价格 - 每单开仓挂单价格) * 每单BTC总量）
-        expected_closed_profit = self.get_expected_closed_profit()  # 期望总收益 = 实际已成交收益 + 期望未成交收益
-        expected_holding_value = self.get_expected_holding_value()  # 期望持仓市值 = 平仓挂单总价
-        expected_total_value = self.get_expected_total_value()  # 期望总资产 = 现金余额 + 期望持仓市值（平仓挂单BTC总价）
-        actual_net_value = self.get_actual_net_value()  # 实际净资产 = 总资产 - 借贷资金；若净资产归零 则强制平仓
-        expected_net_value = self.get_expected_net_value()  # 期望净资产 = 净资产 - 平仓挂单亏损
-
-        ave_profit_per_closed_order = self.get_ave_profit_per_closed_order()  # 已成交订单平均每单盈利
-        status = StrategyStatusBtcUSDT1mDao(
-            open_time, version, price, opening_order_num, opening_order_quantity, opening_order_value,
-            closing_order_num, closing_order_quantity, closing_order_value, closing_order_cost, opened_order_num,
-            opened_order_quantity, opened_order_value, closed_order_num, closed_order_quantity, closed_order_value,
-            closed_order_cost, cumulative_opening_order_num, cumulative_opening_order_quantity,
-            cumulative_opening_order_value, cumulative_closing_order_num, cumulative_closing_order_quantity,
-            cumulative_closing_order_value, cumulative_closing_order_cost, cumulative_opened_order_num,
-            cumulative_opened_order_quantity, cumulative_opened_order_value, cumulative_closed_order_num,
-            cumulative_closed_order_quantity, cumulative_closed_order_value, cumulative_closed_order_cost, cash, loan,
-            holding_quantity, holding_value, total_value, expected_closing_profit,
-            actual_closed_profit, expected_market_close_profit, expected_closed_profit, expected_holding_value,
-            expected_total_value, actual_net_value, expected_net_value, ave_profit_per_closed_order
-        )
-
-        self.db_status_connector.insert_single_queue(status)
+        holding_value = total_value - cash  # 实际持仓BTC总价
+
+        expected_closing_profit = self.cumulative_closing_order_value - self.cumulative_closing_order_cost  # 期望未成交收益
+        actual_closed_profit = self.cumulative_closed_order_value - self.cumulative_closed_order_cost  # 实际已成交收益
+        expected_market_close_profit = \
+            self.cumulative_closing_order_quantity * price - self.cumulative_closing_order_value  # 市价平仓期望收益(亏损)
+        actual_net_value = total_value - self.loan  # 实际净资产
+
+        event = self.status_event
+        self.status_event = False
+        return self.status_recorder.record((
+            self.super_strategy.datetime[0],  # 开盘时间（backtrader日期数值）
+            price,
+            self.opening_order_num, self.opening_order_quantity, self.opening_order_value,
+            self.closing_order_num, self.closing_order_quantity, self.closing_order_value, self.closing_order_cost,
+            self.opened_order_num, self.opened_order_quantity, self.opened_order_value,
+            self.closed_order_num, self.closed_order_quantity, self.closed_order_value, self.closed_order_cost,
+            self.cumulative_opening_order_num, self.cumulative_opening_order_quantity,
+            self.cumulative_opening_order_value,
+            self.cumulative_closing_order_num, self.cumulative_closing_order_quantity,
+            self.cumulative_closing_order_value, self.cumulative_closing_order_cost,
+            self.cumulative_opened_order_num, self.cumulative_opened_order_quantity,
+            self.cumulative_opened_order_value,
+            self.cumulative_closed_order_num, self.cumulative_closed_order_quantity,
+            self.cumulative_closed_order_value, self.cumulative_closed_order_cost,
+            cash,
+            self.loan,  # 借贷资金（欠款）
+            self.get_hold_quantity(),  # 实际持仓BTC总量
+            holding_value,
+            total_value,
+            expected_closing_profit,
+            actual_closed_profit,
+            expected_market_close_profit,
+            actual_closed_profit + expected_closing_profit,  # 期望总收益
+            self.cumulative_closing_order_value,  # 期望持仓市值
+            cash + self.cumulative_closing_order_value,  # 期望总资产
+            actual_net_value,
+            actual_net_value - expected_market_close_profit,  # 期望净资产
+            self.get_ave_profit_per_closed_order(),  # 已成交订单平均每单盈利
+        ), event=event)
 
     def reset_incremental_status(self):
         """
@@ -419,7 +419,7 @@ class MakerOnlyLongOnlyVolatilityStrategy(StrategyInterface):
 
     def upload_action_data(self, order: VirtualOrder):
         """
-        上传action数据至数据库
+        写入action数据至sink
         :return:
         """
         """
@@ -435,44 +435,24 @@ class MakerOnlyLongOnlyVolatilityStrategy(StrategyInterface):
             `expected_commission`  Nullable(Decimal(26, 6)) comment '期望佣金值',
             `actual_commission`    Nullable(Decimal(26, 6)) comment '实际佣金值',
         """
-        version = self.STRATEGY_VERSION  # 策略版本
-        action_time = bt.num2date(self.super_strategy.datetime[0])  # 挂单时间/交易完成时间
+        # 挂单时间/交易完成时间 backtrader日期数值 -> 毫秒时间戳
+        action_time = round((self.super_strategy.datetime[0] - BT_EPOCH) * 86400000)
         # 订单状态: 1.开仓挂单opening 2.已开仓opened 3.平仓挂单closing 4.已平仓closed 5.已取消canceled -1.未知
-        if order.status == "opening":
-            status = 1
-        elif order.status == "opened":
-            status = 2
-        elif order.status == "closing":
-            status = 3
-        elif order.status == "closed":
-            status = 4
-        elif order.status == "canceled":
-            status = 5
-        else:
-            status = -1
-        open_price = order.open_price  # 开仓价格
-        close_price = order.close_price  # 平仓价格
-        quantity = order.quantity  # 交易量
-        open_cost = open_price * quantity  # 开仓成本 = 开仓价格 * 交易量
-        expected_gross_value = order.expected_gross_value  # 期望毛利润
-        actual_gross_value = order.expected_gross_value  # 实际毛利润
-        expected_commission = order.expected_commission  # 期望佣金值
-        actual_commission = order.actual_commission  # 实际佣金值
-
-        action = StrategyActionBtcUSDT1mInsertDao(
-              version,
-              action_time,
-              status,
-              open_price,
-              close_price,
-              quantity,
-              open_cost,
-              expected_gross_value,
-              actual_gross_value,
-              expected_commission,
-              actual_commission,
+        status = ACTION_STATUS.get(order.status, -1)
+        self.sink.write_action_values(
+            self.STRATEGY_VERSION,  # 策略版本
+            action_time,
+            status,
+            order.open_price,  # 开仓价格
+            order.close_price,  # 平仓价格
+            order.quantity,  # 交易量
+            order.open_price * order.quantity,  # 开仓成本 = 开仓价格 * 交易量
+            order.expected_gross_value,  # 期望毛利润
+            order.expected_gross_value,  # 实际毛利润
+            order.expected_commission,  # 期望佣金值
+            order.actual_commission,  # 实际佣金值
         )
-        self.db_action_connector.insert_single_queue(action)
+        self.status_event = True
 
     def analysis_opening_order(self, open_price: float, quantity: float):
         """
@@ -545,16 +525,16 @@ class MakerOnlyLongOnlyVolatilityStrategy(StrategyInterface):
         self.cumulative_closed_order_cost += abs(quantity) * open_price  # 已成交的平仓挂单BTC成本 = sum(每单BTC总量 * 每单开仓挂单价格)
 
     def analysis_add_closed_order(self, open_price: float, close_price: float, quantity: float, ):
-        """用于分析"""
-        virtual_order = VirtualOrderOne(
-            open_price=open_price, close_price=close_price,
-            quantity=abs(quantity),
-            commission_rate=self.commission_rate,
-            direction=self.direction,
+        """
+        用于分析
+        与按该价格新建VirtualOrderOne并依次转为closing、closed后的数值一致 不构造订单对象
+        """
+        quantity = abs(quantity)
+        gross_value = (close_price - open_price) * quantity
+        commission = (open_price + close_price) * self.commission_rate * quantity
+        self.closed_order_list.append_values(
+            open_price, close_price, quantity, 1.0, gross_value, gross_value, commission, commission
         )
-        virtual_order.update_status_closing()
-        virtual_order.update_status_closed()
-        self.closed_order_list.append(virtual_order)
 
     def get_leverage_by_price(self, open_price: float) -> float:
         """
@@ -567,6 +547,17 @@ class MakerOnlyLongOnlyVolatilityStrategy(StrategyInterface):
         else:
             return min(open_price / (open_price - self.min_open_price), self.LEVERAGE)
 
+    def get_leverage_by_prices(self, open_prices: np.ndarray) -> np.ndarray:
+        """
+        get_leverage_by_price()的向量版本 用于一次性计算整个开仓价格网格的杠杆率
+        :param open_prices:
+        :return: 杠杆率数组 open_price <= self.min_open_price的位置为NaN
+        """
+        valid = open_prices > self.min_open_price
+        leverages = np.full(len(open_prices), np.nan)
+        leverages[valid] = np.minimum(open_prices[valid] / (open_prices[valid] - self.min_open_price), self.LEVERAGE)
+        return leverages
+
     def __repr__(self):
         cash = self.get_cash()  # 现金余额
         expected_holding_value = self.get_expected_holding_value()  # 期望持仓市值
@@ -604,6 +595,14 @@ class MakerOnlyLongOnlyVolatilityStrategy(StrategyInterface):
                 f"已成交订单数:{cumulative_closed_order_num}\t平均每单盈利:{ave_profit_per_order:.5f}\t"
         )
 
+    def stop(self):
+        """
+        回测结束 写出剩余的status/action数据
+        :return:
+        """
+        self.status_recorder.close()
+        self.sink.close()
+
     def init(self, super_strategy: bt.Strategy):
         self.commission_rate = super_strategy.broker.getcommissioninfo(super_strategy.data).p.commission
         self.super_strategy = super_strategy
@@ -692,13 +691,15 @@ class MakerOnlyLongOnlyVolatilityStrategy(StrategyInterface):
     def get_ave_profit_per_closed_order(self) -> float:
         """
         用于分析
-        已成交订单平均每单盈利
+        已成交订单平均每单盈利 = 实际已成交收益 / 累计平仓成交单数
+        只使用累计值 与status的采样频率无关
         :return:
         """
         if self.cumulative_closed_order_num == 0:
             return 0
         else:
-            return self.closed_order_value / self.cumulative_closed_order_num
+            return (self.cumulative_closed_order_value - self.cumulative_closed_order_cost) / \
+                self.cumulative_closed_order_num
 
     def get_expected_net_value(self) -> float:
         """
@@ -714,5 +715,38 @@ def test_strategy():
     by_backtrader_btc.test()
 
 
+def test_status_sampling():
+    """
+    采样前后 累计指标和平均每单盈利一致 使用随机行情 不需要数据库
+    """
+    import pandas as pd
+    from data_collection.strategy_sink import MemorySink
+    from trade.backtesting.by_backtrader_btc import BacktraderStrategy
+
+    n = 4000
+    close = 100000 * np.exp(np.cumsum(np.random.default_rng(1).normal(0.00005, 0.002, n)))
+    df = pd.DataFrame({
+        'datetime': pd.date_range('2024-12-01', periods=n, freq='1min'),
+        'open': close, 'high': close * 1.001, 'low': close * 0.999, 'close': close, 'volume': 1.0,
+    })
+
+    def run(status_sampler: StatusSampler | None) -> pd.DataFrame:
+        sink = MemorySink()
+        cerebro = bt.Cerebro()
+        cerebro.adddata(bt.feeds.PandasData(dataname=df, datetime=0, open=1, high=2, low=3, close=4, volume=5))
+        cerebro.addstrategy(BacktraderStrategy, MakerOnlyLongOnlyVolatilityStrategy(sink, status_sampler))
+        cerebro.broker.set_cash(1000000)
+        cerebro.broker.setcommission(commission=0.0002, leverage=1.0)
+        cerebro.run()
+        return sink.status()
+
+    full = run(None)
+    sampled = run(StatusSampler(every=None, tolerance=0.001, on_event=True, heartbeat=60))
+    fields = ['cumulative_closed_order_num', 'cumulative_closed_order_value', 'ave_profit_per_closed_order']
+    logging.info(f"{len(sampled)} of {len(full)} rows sampled\n"
+                 f"full:    {full[fields].iloc[-1].tolist()}\nsampled: {sampled[fields].iloc[-1].tolist()}")
+    assert np.allclose(full[fields].iloc[-1].astype(float), sampled[fields].iloc[-1].astype(float))
+
+
 if __name__ == '__main__':
     test_strategy()
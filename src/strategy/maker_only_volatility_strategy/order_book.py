@@ -1,35 +1,132 @@
-from typing import List, Dict
+from collections import namedtuple
+from typing import List, Dict, Set
+
+import numpy as np
 
 from strategy import VirtualOrderArrayInterface, VirtualOrderBookInterface, VirtualOrder
 from strategy.virtual_order import VirtualOrderOne
 from log import *
 
 
+# 订单在订单组中的句柄 position为订单组所在价位 slot为订单组中的槽位 generation为槽位的版本号
+# 槽位被释放后版本号加一 旧句柄随之失效 不会误删复用该槽位的新订单
+OrderHandle = namedtuple('OrderHandle', ['position', 'slot', 'generation'])
+
+
 class OrderGroup:
     """
     订单组：表示在同一open价格下的订单集合。
+    使用槽位存储订单 按句柄(slot, generation)查找/删除均为O(1) 不依赖价格比较
+    槽位之间以双向链表维护插入顺序 get(0)/get_last()分别为最早/最晚插入的订单
     """
+    NIL = -1
 
     def __init__(self):
-        self.data: List[VirtualOrder] = []
+        self.slots: List[VirtualOrder | None] = []
+        self.generations: List[int] = []
+        self.prev: List[int] = []
+        self.next: List[int] = []
+        self.free_slots: List[int] = []
+        self.head = self.NIL
+        self.tail = self.NIL
+        self.size = 0
+
+    def add(self, order: VirtualOrder) -> tuple:
+        """
+        在末尾插入一个订单
+        :param order:
+        :return: (slot, generation)
+        """
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.slots[slot] = order
+        else:
+            slot = len(self.slots)
+            self.slots.append(order)
+            self.generations.append(0)
+            self.prev.append(self.NIL)
+            self.next.append(self.NIL)
+        self.prev[slot] = self.tail
+        self.next[slot] = self.NIL
+        if self.tail == self.NIL:
+            self.head = slot
+        else:
+            self.next[self.tail] = slot
+        self.tail = slot
+        self.size += 1
+        return slot, self.generations[slot]
 
-    def add(self, order: VirtualOrder):
-        self.data.append(order)
+    def lookup(self, slot: int, generation: int) -> VirtualOrder | None:
+        """
+        按句柄查找订单 句柄已失效时返回None
+        """
+        if 0 <= slot < len(self.slots) and self.generations[slot] == generation:
+            return self.slots[slot]
+        return None
+
+    def remove_at(self, slot: int, generation: int) -> VirtualOrder | None:
+        """
+        按句柄删除订单
+        :return: 被删除的订单 句柄已失效时返回None
+        """
+        order = self.lookup(slot, generation)
+        if order is None:
+            return None
+        prev_slot, next_slot = self.prev[slot], self.next[slot]
+        if prev_slot == self.NIL:
+            self.head = next_slot
+        else:
+            self.next[prev_slot] = next_slot
+        if next_slot == self.NIL:
+            self.tail = prev_slot
+        else:
+            self.prev[next_slot] = prev_slot
+        self.slots[slot] = None
+        self.generations[slot] += 1
+        self.free_slots.append(slot)
+        self.size -= 1
+        return order
 
     def remove(self, order: VirtualOrder):
-        self.data.remove(order)
+        """
+        按对象删除订单 需遍历 有句柄时使用remove_at
+        """
+        for slot, generation in self.iter_handles():
+            if self.slots[slot] is order:
+                self.remove_at(slot, generation)
+                return
+        raise ValueError(f'{order} not in OrderGroup')
+
+    def iter_handles(self):
+        """
+        按插入顺序遍历 (slot, generation)
+        """
+        slot = self.head
+        while slot != self.NIL:
+            next_slot = self.next[slot]
+            yield slot, self.generations[slot]
+            slot = next_slot
+
+    @property
+    def data(self) -> List[VirtualOrder]:
+        """
+        按插入顺序排列的订单
+        """
+        return [self.slots[slot] for slot, _ in self.iter_handles()]
 
     def get(self, index: int):
+        if index == 0 and self.head != self.NIL:
+            return self.slots[self.head]
         return self.data[index]
 
     def get_last(self) -> VirtualOrder | None:
-        if len(self.data) == 0:
+        if self.tail == self.NIL:
             return None
         else:
-            return self.data[-1]
+            return self.slots[self.tail]
 
     def len(self):
-        return len(self.data)
+        return self.size
 
 
 class PriceOrderGroupVirtualCloseOrderArray(VirtualOrderArrayInterface):
@@ -118,25 +215,66 @@ class PriceOrderGroupVirtualCloseOrderArray(VirtualOrderArrayInterface):
                     # if close_price > self.max_close_price - self.price_step:    # 挂单价格不得超过 self.max_close_price
                     close_price = order_group.get(0).close_price
             order.update_close_price(close_price)
-            order_group.add(order)
+            slot, generation = order_group.add(order)
+            order.handle = OrderHandle(position, slot, generation)
             return order
         return None
 
     def remove_order(self, order: VirtualOrder) -> VirtualOrder | None:
         """
         删除一个order
+        由add_order插入的订单按句柄删除 O(1)
+        没有句柄的订单（如外部构造的查询对象）按open_price和close_price查找
         :param order:
         :return: VirtualOrder | None
         若删除成功 返回VirtualOrder对象
         若删除失败 返回None
         """
+        handle = order.handle
+        if handle is not None:
+            removed = self.price_order_group_dict[handle.position].remove_at(handle.slot, handle.generation)
+            if removed is not None:
+                removed.handle = None
+            return removed
         position = self.get_position_by_price(order.open_price)
         if self.check_position(position):
             order_group = self.price_order_group_dict[position]
-            for o in order_group.data:
-                if o.close_price == order.close_price:
-                    order_group.remove(o)
-                    return o
+            for slot, generation in order_group.iter_handles():
+                if order_group.slots[slot].close_price == order.close_price:
+                    removed = order_group.remove_at(slot, generation)
+                    removed.handle = None
+                    return removed
+        return None
+
+    def lookup(self, handle: OrderHandle) -> VirtualOrder | None:
+        """
+        按句柄查找订单 句柄已失效时返回None
+        """
+        return self.price_order_group_dict[handle.position].lookup(handle.slot, handle.generation)
+
+    def update_close_price(self, handle: OrderHandle, close_price: float) -> VirtualOrder | None:
+        """
+        按句柄修改订单的close_price
+        :return: 被修改的订单 句柄已失效时返回None
+        """
+        order = self.lookup(handle)
+        if order is not None:
+            order.update_close_price(close_price)
+        return order
+
+    def keep_order(self, order: VirtualOrder) -> VirtualOrder | None:
+        """
+        重建网格时放入已挂出的order 不修改其close_price 见PriceOrderGroupVirtualOrderBook.regrid()
+        :param order:
+        :return: VirtualOrder | None
+        若order的open_price在网格内 返回VirtualOrder对象
+        否则返回None
+        """
+        position = self.get_position_by_price(order.open_price)
+        if 0 <= position < self.length:
+            slot, generation = self.price_order_group_dict[position].add(order)
+            order.handle = OrderHandle(position, slot, generation)
+            return order
         return None
 
     def check_order(self, order: VirtualOrder) -> VirtualOrder | None:
@@ -158,7 +296,11 @@ class PriceOrderGroupVirtualOpenOrderArray(VirtualOrderArrayInterface):
     """
     固定价格虚拟订单集合
     只存储open订单
-    使用定长list存储挂单数据
+    每个价位最多一个订单
+    1.price_list: 每个position的价格 numpy数组 初始化时一次性计算
+    2.occupied: 占用位图 position上是否有订单
+    3.leverage_list: 每个position的杠杆率 由策略通过set_leverage_list()设置
+    free_positions()一次返回窗口内的空闲position 只为需要挂单的position构造订单
     """
 
     def __init__(self, max_open_price: float, min_open_price: float, max_close_price: float, min_close_price: float,
@@ -181,12 +323,49 @@ class PriceOrderGroupVirtualOpenOrderArray(VirtualOrderArrayInterface):
             direction=direction,
             length=length
         )
-        self.price_list: List[float] = list()
+        self.price_list: np.ndarray = np.array(
+            [self.get_price_by_position(position) for position in range(self.length)], dtype=np.float64
+        )
+        self.leverage_list: np.ndarray | None = None
+        self.occupied: np.ndarray = np.zeros(self.length, dtype=bool)
         self.position_order_dict: Dict[int, VirtualOrder] = dict()
 
-        for position in range(self.length):
-            price = self.get_price_by_position(position)
-            self.price_list.append(price)
+    def set_leverage_list(self, leverage_list: np.ndarray):
+        """
+        设置每个position的杠杆率
+        :param leverage_list: 长度与price_list一致
+        :return:
+        """
+        if len(leverage_list) != self.length:
+            raise ValueError(f'leverage_list length must be {self.length}, not "{len(leverage_list)}"')
+        self.leverage_list = leverage_list
+
+    def free_positions(self, position: int, window: int) -> np.ndarray:
+        """
+        [position, position + window) 中没有订单的position 超出范围的部分忽略
+        :param position: 起始position
+        :param window: 窗口大小
+        :return: 升序的position数组
+        """
+        start = min(max(position, 0), self.length)
+        end = min(max(position + window, 0), self.length)
+        return np.flatnonzero(~self.occupied[start:end]) + start
+
+    def add_order_at(self, position: int, order: VirtualOrder) -> VirtualOrder | None:
+        """
+        在指定position插入一个order 省去由价格反算position
+        :param position: 见free_positions()
+        :param order: open_price应为price_list[position]
+        :return: VirtualOrder | None
+        若插入成功 返回VirtualOrder对象
+        若插入失败 返回None
+        """
+        if self.check_position(position) and not self.occupied[position]:
+            order.update_open_price(float(self.price_list[position]))
+            self.position_order_dict[position] = order
+            self.occupied[position] = True
+            return order
+        return None
 
     def add_order(self, order: VirtualOrder) -> VirtualOrder | None:
         """
@@ -197,14 +376,25 @@ class PriceOrderGroupVirtualOpenOrderArray(VirtualOrderArrayInterface):
         若插入成功 返回VirtualOrder对象
         若插入失败 返回None
         """
+        return self.add_order_at(self.get_position_by_price(order.open_price), order)
+
+    def keep_order(self, order: VirtualOrder) -> VirtualOrder | None:
+        """
+        重建网格时放入已挂出的order 不修改其open_price 见PriceOrderGroupVirtualOrderBook.regrid()
+        :param order:
+        :return: VirtualOrder | None
+        若order价格在网格内且对应position空闲 返回VirtualOrder对象
+        否则返回None
+        """
         position = self.get_position_by_price(order.open_price)
-        if self.check_position(position):
-            # 判断当前position是否有order 若无 则插入
-            if not self.position_order_dict.__contains__(position):
-                price = self.get_price_by_position(position)
-                order.update_open_price(price)
-                self.position_order_dict[position] = order
-                return order
+        if (
+                0 <= position < self.length
+                and not self.occupied[position]
+                and self.min_open_price < order.open_price <= self.max_open_price
+        ):
+            self.position_order_dict[position] = order
+            self.occupied[position] = True
+            return order
         return None
 
     def remove_order(self, order: VirtualOrder) -> VirtualOrder | None:
@@ -219,6 +409,7 @@ class PriceOrderGroupVirtualOpenOrderArray(VirtualOrderArrayInterface):
         if self.check_position(position):
             if self.position_order_dict.__contains__(position):
                 order = self.position_order_dict.pop(position)
+                self.occupied[position] = False
                 return order
         return None
 
@@ -253,7 +444,7 @@ class PriceOrderGroupVirtualOrderBook(VirtualOrderBookInterface):
         """
         1.open_order_array: open订单集合 继承VirtualOrderArrayInterface的类型
         2.close_order_array: close订单集合 继承VirtualOrderArrayInterface的类型
-        3.closed_order_list: close订单集合 list类型
+        3.closed_order_list: 已完成订单集合 ClosedOrderList类型
         :param max_open_price: 开仓最高价格
         :param min_open_price: 开仓最低价格
         :param max_close_price: 平仓最高价格
@@ -270,26 +461,84 @@ class PriceOrderGroupVirtualOrderBook(VirtualOrderBookInterface):
         super().__init__(max_open_price, min_open_price, max_close_price, min_close_price, open_array_length,
                          close_array_length, direction, commission_rate)
 
-        self.open_order_array: VirtualOrderArrayInterface = PriceOrderGroupVirtualOpenOrderArray(
-            max_open_price=max_open_price,
-            min_open_price=min_open_price,
-            max_close_price=max_close_price,
-            min_close_price=min_close_price,
-            direction=direction,
-            length=open_array_length,
+        self.percentage_minimum_profit = percentage_minimum_profit
+        self.percentage_close_price_step = percentage_close_price_step
+        self.percentage_maximum_profit = percentage_maximum_profit
+        self.open_order_array: PriceOrderGroupVirtualOpenOrderArray = self._new_open_order_array()
+        self.close_order_array: PriceOrderGroupVirtualCloseOrderArray = self._new_close_order_array()
+        # regrid后open_price超出网格的close订单 不属于任何订单组 仍然挂单 见regrid()
+        self.overflow_close_orders: Set[VirtualOrder] = set()
+
+    def _new_open_order_array(self) -> PriceOrderGroupVirtualOpenOrderArray:
+        return PriceOrderGroupVirtualOpenOrderArray(
+            max_open_price=self.max_open_price,
+            min_open_price=self.min_open_price,
+            max_close_price=self.max_close_price,
+            min_close_price=self.min_close_price,
+            direction=self.direction,
+            length=self.open_array_length,
         )
-        self.close_order_array: VirtualOrderArrayInterface = PriceOrderGroupVirtualCloseOrderArray(
-            max_open_price=max_open_price,
-            min_open_price=min_open_price,
-            max_close_price=max_close_price,
-            min_close_price=min_close_price,
-            direction=direction,
-            length=close_array_length,
-            percentage_minimum_profit=percentage_minimum_profit,
-            percentage_close_price_step=percentage_close_price_step,
-            percentage_maximum_profit=percentage_maximum_profit
+
+    def _new_close_order_array(self) -> PriceOrderGroupVirtualCloseOrderArray:
+        return PriceOrderGroupVirtualCloseOrderArray(
+            max_open_price=self.max_open_price,
+            min_open_price=self.min_open_price,
+            max_close_price=self.max_close_price,
+            min_close_price=self.min_close_price,
+            direction=self.direction,
+            length=self.close_array_length,
+            percentage_minimum_profit=self.percentage_minimum_profit,
+            percentage_close_price_step=self.percentage_close_price_step,
+            percentage_maximum_profit=self.percentage_maximum_profit
         )
 
+    def regrid(self, max_open_price: float, min_open_price: float, max_close_price: float, min_close_price: float,
+               open_array_length: int, close_array_length: int) -> List[VirtualOrder]:
+        """
+        价格区间变化时（如创新高）就地重建价格网格 保留仍然有效的挂单 不重建订单簿
+        1.open订单保持原价格 放入新网格中最近的position 离盘口近的优先
+          超出新网格 或与已保留的订单落在同一position的 不再保留 返回给调用方撤单
+        2.close订单保持原close_price 按open_price放入新网格的订单组
+          超出新网格的订单不再属于任何订单组 放入overflow_close_orders 仍然挂单 成交时照常处理
+        3.closed_order_list保持不变
+        :param max_open_price: 开仓最高价格
+        :param min_open_price: 开仓最低价格
+        :param max_close_price: 平仓最高价格
+        :param min_close_price: 平仓最低价格
+        :param open_array_length: open价格数量
+        :param close_array_length: close价格数量
+        :return: 需要撤销的open订单
+        """
+        old_open_order_array = self.open_order_array
+        old_close_order_array = self.close_order_array
+        self.max_open_price = max_open_price
+        self.min_open_price = min_open_price
+        self.max_close_price = max_close_price
+        self.min_close_price = min_close_price
+        self.open_array_length = open_array_length
+        self.close_array_length = close_array_length
+        self.open_order_array = self._new_open_order_array()
+        self.close_order_array = self._new_close_order_array()
+
+        dropped = []
+        positions = sorted(old_open_order_array.position_order_dict, reverse=self.direction != 'long')
+        for position in positions:
+            order = old_open_order_array.position_order_dict[position]
+            if self.open_order_array.keep_order(order) is None:
+                dropped.append(order)
+        closing_orders = [
+            order
+            for position in sorted(old_close_order_array.price_order_group_dict)
+            for order in old_close_order_array.price_order_group_dict[position].data
+        ]
+        overflow = set()
+        for order in closing_orders + list(self.overflow_close_orders):
+            order.handle = None
+            if self.close_order_array.keep_order(order) is None:
+                overflow.add(order)
+        self.overflow_close_orders = overflow
+        return dropped
+
     def add_order(self, order: VirtualOrder) -> VirtualOrder | None:
         """
         插入一个open order
@@ -301,6 +550,15 @@ class PriceOrderGroupVirtualOrderBook(VirtualOrderBookInterface):
         """
         return self.open_order_array.add_order(order)
 
+    def add_order_at(self, position: int, order: VirtualOrder) -> VirtualOrder | None:
+        """
+        在open_order_array的指定position插入一个open order 见PriceOrderGroupVirtualOpenOrderArray.free_positions()
+        :param position:
+        :param order:
+        :return: VirtualOrder | None
+        """
+        return self.open_order_array.add_order_at(position, order)
+
     def update_order_closing(self, order: VirtualOrder) -> VirtualOrder | None:
         """
         将一个open order 变为close order
@@ -323,7 +581,10 @@ class PriceOrderGroupVirtualOrderBook(VirtualOrderBookInterface):
         若成功 返回VirtualOrder对象
         若失败 返回None
         """
-        order = self.close_order_array.remove_order(order)
+        if order in self.overflow_close_orders:
+            self.overflow_close_orders.discard(order)
+        else:
+            order = self.close_order_array.remove_order(order)
         if order is not None:
             self.closed_order_list.append(order)
             return order
@@ -340,6 +601,7 @@ def test_close_array():
     length: int = 10
     percentage_minimum_profit: float = 0.5
     percentage_close_price_step: float = 0.25
+    percentage_maximum_profit: float = 2
     array = PriceOrderGroupVirtualCloseOrderArray(
         max_open_price=max_open_price,
         min_open_price=min_open_price,
@@ -349,6 +611,7 @@ def test_close_array():
         length=length,
         percentage_minimum_profit=percentage_minimum_profit,
         percentage_close_price_step=percentage_close_price_step,
+        percentage_maximum_profit=percentage_maximum_profit,
     )
 
     logging.info(f"======== add =========")
@@ -383,6 +646,12 @@ def test_close_array():
     array.log()
     logging.info(f"order:{order}\n")
 
+    logging.info(f"======== remove by handle =========")
+    handle = order.handle
+    order = array.remove_order(order)
+    array.log()
+    logging.info(f"order:{order}\tstale handle:{handle} -> {array.lookup(handle)}\n")
+
     logging.info(f"======== remove =========")
     order = array.remove_order(VirtualOrderOne(open_price=10, close_price=15, quantity=1, direction='long'))
     array.log()
@@ -433,6 +702,11 @@ def test_open_array():
     order = array.add_order(VirtualOrderOne(open_price=6, close_price=10, quantity=1, direction='long'))
     logging.info(f"order:{order}\tarray:{array}")
 
+    logging.info(f"======== free positions =========")
+    logging.info(f"price_list:{array.price_list}")
+    logging.info(f"free_positions(5, 6):{array.free_positions(5, 6)}")
+    logging.info(f"free_positions(-3, 5):{array.free_positions(-3, 5)}")
+
     logging.info(f"======== remove =========")
 
     order = array.remove_order(VirtualOrderOne(open_price=10, close_price=10, quantity=1, direction='long'))
@@ -457,6 +731,7 @@ def test_order_book():
     close_array_length: int = 10
     percentage_minimum_profit: float = 0.5
     percentage_close_price_step: float = 0.25
+    percentage_maximum_profit: float = 2
     book = PriceOrderGroupVirtualOrderBook(
         max_open_price=max_open_price,
         min_open_price=min_open_price,
@@ -467,6 +742,7 @@ def test_order_book():
         close_array_length=close_array_length,
         percentage_minimum_profit=percentage_minimum_profit,
         percentage_close_price_step=percentage_close_price_step,
+        percentage_maximum_profit=percentage_maximum_profit,
     )
 
     open_array = book.open_order_array
@@ -504,6 +780,38 @@ def test_order_book():
         logging.info(f"order:{order}\narray:{book.close_order_array}")
 
 
+def test_regrid():
+    book = PriceOrderGroupVirtualOrderBook(
+        max_open_price=95, min_open_price=55, max_close_price=100, min_close_price=55,
+        open_array_length=40, close_array_length=45,
+        percentage_minimum_profit=0.002, percentage_close_price_step=0.001, percentage_maximum_profit=0.01,
+    )
+    open_array = book.open_order_array
+    for position in open_array.free_positions(0, 41).tolist():
+        price = float(open_array.price_list[position])
+        book.add_order_at(position, VirtualOrderOne(open_price=price, close_price=price, quantity=1, direction='long'))
+    book.update_order_closing(open_array.position_order_dict[10])
+    # 最低价位的订单 重建网格后超出网格
+    book.update_order_closing(open_array.position_order_dict[int(np.argmin(open_array.price_list))])
+
+    # 创新高 价格区间上移约5%
+    dropped = book.regrid(
+        max_open_price=99.75, min_open_price=57.75, max_close_price=105, min_close_price=57.75,
+        open_array_length=40, close_array_length=45,
+    )
+    logging.info(f"kept:{len(book.open_order_array.position_order_dict)}\tdropped:{len(dropped)}")
+    logging.info(f"dropped prices:{[round(order.open_price, 2) for order in dropped]}")
+    logging.info(f"free positions:{book.open_order_array.free_positions(0, 41)}")
+    logging.info(f"closing:{[g.data for g in book.close_order_array.price_order_group_dict.values() if g.len()]}")
+
+    # 超出新网格的close订单成交时仍记入closed_order_list
+    overflow = list(book.overflow_close_orders)
+    logging.info(f"overflow:{overflow}")
+    for order in overflow:
+        book.update_order_closed(order)
+    logging.info(f"closed:{len(book.closed_order_list)}	overflow left:{len(book.overflow_close_orders)}")
+
+
 if __name__ == '__main__':
     # test_open_array()
     # test_close_array()
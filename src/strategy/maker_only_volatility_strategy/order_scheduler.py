@@ -80,6 +80,17 @@ class OrderScheduler:
             self.unbind(virtual_order)
             self.bind(virtual_order, new_actual_order)
 
+    def cancel(self, virtual_order: VirtualOrder):
+        """
+        撤销virtual_order关联的actual_order
+        绑定关系保留到收到撤单通知 见actual_order_cancelled()
+        :param virtual_order:
+        :return:
+        """
+        actual_order = self.order_bindings_virtual2actual.get(virtual_order)
+        if actual_order is not None:
+            self.strategy.cancel(actual_order)
+
     def link_order_book(self, order_book: VirtualOrderBookInterface):
         self.order_book = order_book
 
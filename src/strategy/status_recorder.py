@@ -0,0 +1,219 @@
+"""
+策略status的列式记录器
+1.预分配定长numpy结构化数组 每个bar原地写入一行 不构造namedtuple
+2.写满block_size行（或手动flush）时整块交给flush函数 缓冲区复用
+  实盘设置max_delay 最早一行缓冲超过max_delay秒时也写出 进程崩溃时最多丢失max_delay秒的数据 见 LIVE_BLOCK_SIZE
+3.open_time记录为backtrader的日期数值 flush时向量化转换为datetime64
+4.可选的采样策略（StatusSampler） 跳过的bar不写入 增量指标由调用方累加到下一次写入
+"""
+import time
+from typing import Callable, Dict, Sequence
+
+import numpy as np
+
+from data_collection.dao.strategy_status_btc_spot_trading_usdt_1m import StrategyStatusBtcUSDT1mDao
+
+# version为整次运行的常量 不逐行记录
+STATUS_FIELDS = [name for name in StrategyStatusBtcUSDT1mDao._fields if name != 'version']
+STATUS_DTYPE = np.dtype([(name, np.float64) for name in STATUS_FIELDS])
+
+# 实盘使用的缓冲区行数和最长缓冲时间（秒） 回测使用默认值 只在写满或结束时写出
+LIVE_BLOCK_SIZE = 1_000
+LIVE_MAX_DELAY = 60.0
+
+# backtrader日期数值中1970-01-01的值 即 date(1970, 1, 1).toordinal()
+BT_EPOCH = 719163.0
+
+
+def bt_num_to_datetime64(num: np.ndarray) -> np.ndarray:
+    """
+    backtrader的日期数值（自0001-01-01起的天数） 转换为datetime64[s]
+    与 backtrader.num2date 结果一致（不含时区）
+    """
+    return np.round((num - BT_EPOCH) * 86400).astype(np.int64).astype('datetime64[s]')
+
+
+class StatusSampler:
+    """
+    status采样策略 满足任一条件即写入：
+    1.every: 距上次写入已满every个bar
+    2.tolerance: tracked中任一字段相对上次写入的值的变化超过tolerance（相对值）
+    3.on_event: 本bar有订单事件
+    4.heartbeat: 距上次写入已满heartbeat个bar（与2、3配合 保证最低写入频率）
+    第一个bar总是写入 默认every=1 即每个bar都写入
+    """
+
+    DEFAULT_TRACKED = ('price', 'holding_quantity', 'total_value', 'actual_net_value')
+
+    def __init__(
+            self,
+            every: int | None = 1,
+            tolerance: float | None = None,
+            tracked: Sequence[str] = DEFAULT_TRACKED,
+            on_event: bool = False,
+            heartbeat: int | None = None,
+    ):
+        """
+
+        :param every: 每N个bar写入一次 为空则不按固定间隔写入
+        :param tolerance: 相对变化阈值 如0.001 为空则不检测变化
+        :param tracked: 检测变化的字段 见STATUS_FIELDS
+        :param on_event: 有订单事件的bar是否写入
+        :param heartbeat: 最长多少个bar必须写入一次 为空则不限制
+        """
+        self.every = every
+        self.tolerance = tolerance
+        self.tracked = [STATUS_FIELDS.index(name) for name in tracked]
+        self.on_event = on_event
+        self.heartbeat = heartbeat
+
+    def should_record(self, row: tuple, last_row: tuple | None, bars: int, event: bool) -> bool:
+        """
+        :param row: 本bar的数据
+        :param last_row: 上次写入的数据
+        :param bars: 距上次写入的bar数
+        :param event: 本bar是否有订单事件
+        :return:
+        """
+        if last_row is None:
+            return True
+        if self.every is not None and bars >= self.every:
+            return True
+        if self.heartbeat is not None and bars >= self.heartbeat:
+            return True
+        if self.on_event and event:
+            return True
+        if self.tolerance is not None:
+            for i in self.tracked:
+                old = last_row[i]
+                if abs(row[i] - old) > self.tolerance * max(abs(old), 1e-12):
+                    return True
+        return False
+
+
+class StatusRecorder:
+    """
+    status记录器
+    """
+
+    def __init__(self, version: str, flush: Callable[[Dict[str, np.ndarray]], None], block_size: int = 100_000,
+                 sampler: StatusSampler | None = None, max_delay: float | None = None):
+        """
+
+        :param version: 策略版本
+        :param flush: 写出函数 参数为列式数据 列名见StrategyStatusBtcUSDT1mDao open_time为datetime64[s]
+        :param block_size: 缓冲区行数 即每次写出的最大行数
+        :param sampler: 采样策略 为空则每个bar都写入
+        :param max_delay: 数据最长缓冲时间（秒） 为空则只在写满时写出
+        """
+        if block_size <= 0:
+            raise ValueError(f'block_size must be positive, not "{block_size}"')
+        self.version = version
+        self.sink = flush
+        self.rows = np.zeros(block_size, dtype=STATUS_DTYPE)
+        self.size = 0  # 缓冲区中的行数
+        self.max_delay = max_delay
+        self.oldest = 0.0  # 缓冲区中第一行的写入时间（time.monotonic）
+        self.total = 0  # 累计记录的行数
+        self.sampler = sampler
+        self.last_row: tuple | None = None  # 上次写入的数据
+        self.skipped_row: tuple | None = None  # 上次写入之后最近一个被跳过的bar
+        self.bars = 0  # 距上次写入的bar数
+
+    def record(self, row: tuple, event: bool = False) -> bool:
+        """
+        记录一行 由采样策略决定是否写入
+        :param row: 字段顺序与STATUS_FIELDS一致 open_time为backtrader的日期数值
+        :param event: 本bar是否有订单事件
+        :return: 是否写入 未写入时调用方不应重置增量指标 以便累加到下一次写入
+        """
+        self.bars += 1
+        if self.max_delay is not None and self.size > 0 and time.monotonic() - self.oldest >= self.max_delay:
+            self.flush()
+        if self.sampler is not None and not self.sampler.should_record(row, self.last_row, self.bars, event):
+            self.skipped_row = row
+            return False
+        self._append(row)
+        return True
+
+    def _append(self, row: tuple):
+        self.last_row = row
+        self.skipped_row = None
+        self.bars = 0
+        if self.size == 0 and self.max_delay is not None:
+            self.oldest = time.monotonic()
+        self.rows[self.size] = row
+        self.size += 1
+        self.total += 1
+        if self.size == len(self.rows):
+            self.flush()
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """
+        缓冲区中的数据（拷贝）
+        :return: 列名 -> numpy数组
+        """
+        rows = self.rows[:self.size]
+        columns = {'version': np.full(self.size, self.version, dtype=object)}
+        for name in STATUS_FIELDS:
+            columns[name] = bt_num_to_datetime64(rows[name]) if name == 'open_time' else rows[name].copy()
+        return {name: columns[name] for name in StrategyStatusBtcUSDT1mDao._fields}
+
+    def flush(self):
+        if self.size == 0:
+            return
+        columns = self.columns()
+        self.size = 0
+        self.sink(columns)
+
+    def close(self):
+        """
+        写入最后一个被跳过的bar（保证最终状态被记录） 并写出全部数据
+        """
+        if self.skipped_row is not None:
+            self._append(self.skipped_row)
+        self.flush()
+
+    def __len__(self):
+        return self.total
+
+
+def test():
+    import time
+    import backtrader as bt
+    from datetime import datetime
+    from log import logging
+
+    blocks = []
+    recorder = StatusRecorder('version1', blocks.append, block_size=10_000)
+    start_num = bt.date2num(datetime(2024, 12, 1))
+    start = time.perf_counter()
+    for i in range(100_000):
+        recorder.record((start_num + i / 1440,) + (float(i),) * (len(STATUS_FIELDS) - 1))
+    recorder.flush()
+    logging.info(f"record {len(recorder)} rows in {time.perf_counter() - start:.3f}s, {len(blocks)} blocks")
+    logging.info(f"first open_time: {blocks[0]['open_time'][0]}, {bt.num2date(start_num)}")
+    logging.info(f"last open_time: {blocks[-1]['open_time'][-1]}, {bt.num2date(start_num + 99_999 / 1440)}")
+
+    # 价格变化超过0.1%或有订单事件时写入 至少每60个bar写入一次
+    blocks = []
+    sampler = StatusSampler(every=None, tolerance=0.001, on_event=True, heartbeat=60)
+    recorder = StatusRecorder('version1', blocks.append, sampler=sampler)
+    price = 100000.0
+    for i in range(100_000):
+        price *= 1 + (0.002 if i % 500 == 0 else 0.00001)
+        recorder.record((start_num + i / 1440, price) + (0.0,) * (len(STATUS_FIELDS) - 2), event=i % 1000 == 0)
+    recorder.close()
+    logging.info(f"sampled {len(recorder)} of 100000 rows")
+
+    # 实盘 缓冲未满时按时间写出
+    blocks = []
+    recorder = StatusRecorder('version1', blocks.append, block_size=LIVE_BLOCK_SIZE, max_delay=0.05)
+    for i in range(10):
+        recorder.record((start_num + i / 1440,) + (float(i),) * (len(STATUS_FIELDS) - 1))
+        time.sleep(0.02)
+    logging.info(f"live: {[len(block['open_time']) for block in blocks]} rows flushed before close")
+
+
+if __name__ == '__main__':
+    test()
@@ -1,4 +1,5 @@
-from typing import List, Callable
+from contextlib import contextmanager
+from typing import List, Callable, Dict
 from log import *
 from strategy import VirtualOrderArrayInterface, VirtualOrder
 
@@ -7,6 +8,13 @@ class VirtualOrderOne(VirtualOrder):
     """
     虚拟订单
     """
+    __slots__ = ('commission_rate', 'actual_order_hash', 'batch_depth', 'batch_snapshot')
+
+    # 批量修改时比较的字段 即observer关心的挂单参数
+    BATCH_FIELDS = ('open_price', 'close_price', 'quantity', 'leverage')
+    # 批量修改中途出错时恢复的字段 包括由挂单参数计算的字段
+    ROLLBACK_FIELDS = BATCH_FIELDS + (
+        'principal', 'loan', 'forced_liquidation_price', 'expected_commission', 'expected_gross_value')
 
     def __init__(
             self, open_price: float, close_price: float, quantity: float, direction: str,
@@ -32,6 +40,8 @@ class VirtualOrderOne(VirtualOrder):
         :param observer: 观察者 参数[self]
         :param actual_order_hash: 实际订单的hash
         """
+        self.batch_depth = 0  # begin()嵌套层数 大于0时推迟通知observer
+        self.batch_snapshot: tuple | None = None  # 最外层begin()时ROLLBACK_FIELDS的值
         super().__init__(open_price, close_price, quantity, direction, leverage=leverage)
         self.expected_gross_value = (close_price - open_price) * quantity
         self.actual_gross_value = None
@@ -84,13 +94,14 @@ class VirtualOrderOne(VirtualOrder):
             raise ValueError(f'open_price can not be update while in statue:"{self.status}"')
         self.check_price(price)
         if self.open_price != price:
-            # 为保证订单的总金额不变 需要调整quantity
-            self.update_quantity(self.quantity * self.open_price / price, self.leverage)
+            # quantity和open_price一起修改 只通知一次observer
+            with self.batch():
+                # 为保证订单的总金额不变 需要调整quantity
+                self.update_quantity(self.quantity * self.open_price / price, self.leverage)
 
-            self.open_price = price
-            self.expected_commission = (self.open_price + self.close_price) * self.commission_rate * self.quantity
-            self.expected_gross_value = (self.close_price - self.open_price) * self.quantity
-            self.notify_observer()
+                self.open_price = price
+                self.expected_commission = (self.open_price + self.close_price) * self.commission_rate * self.quantity
+                self.expected_gross_value = (self.close_price - self.open_price) * self.quantity
 
     def update_close_price(self, price: float):
         """
@@ -140,9 +151,66 @@ class VirtualOrderOne(VirtualOrder):
         self.observer = observer
 
     def notify_observer(self):
-        if self.observer is not None:
+        if self.observer is not None and self.batch_depth == 0:
             self.observer(self)
 
+    def begin(self):
+        """
+        开始批量修改 期间的update_*不通知observer 可嵌套
+        :return:
+        """
+        if self.batch_depth == 0:
+            self.batch_snapshot = tuple(getattr(self, field) for field in self.ROLLBACK_FIELDS)
+        self.batch_depth += 1
+
+    def commit(self) -> Dict[str, tuple]:
+        """
+        结束批量修改 最外层commit()时若挂单参数有变化 通知observer一次
+        :return: 最外层为变化的字段 -> (修改前, 修改后) 内层或没有变化时为空
+        """
+        if self.batch_depth == 0:
+            raise RuntimeError('commit() without begin()')
+        self.batch_depth -= 1
+        if self.batch_depth > 0:
+            return {}
+        diff = {}
+        for field, old in zip(self.BATCH_FIELDS, self.batch_snapshot):
+            new = getattr(self, field)
+            if new != old:
+                diff[field] = (old, new)
+        self.batch_snapshot = None
+        if diff:
+            self.notify_observer()
+        return diff
+
+    def rollback(self):
+        """
+        放弃批量修改 最外层rollback()时恢复begin()时的值 不通知observer
+        :return:
+        """
+        if self.batch_depth == 0:
+            raise RuntimeError('rollback() without begin()')
+        self.batch_depth -= 1
+        if self.batch_depth > 0:
+            return
+        for field, old in zip(self.ROLLBACK_FIELDS, self.batch_snapshot):
+            setattr(self, field, old)
+        self.batch_snapshot = None
+
+    @contextmanager
+    def batch(self):
+        """
+        批量修改 with order.batch(): ... 见begin()/commit()
+        出现异常时回滚 见rollback()
+        """
+        self.begin()
+        try:
+            yield self
+        except BaseException:
+            self.rollback()
+            raise
+        self.commit()
+
     def link_actual_order_hash(self, actual_order_hash: any):
         self.actual_order_hash = actual_order_hash
 
@@ -162,3 +230,38 @@ class VirtualOrderOne(VirtualOrder):
 
     def __repr__(self):
         return f"MyOrderPair({self.status},{self.open_price},{self.close_price},{self.quantity},{self.expected_commission},{self.actual_commission},{self.expected_gross_value},{self.actual_gross_value},{self.actual_net_value()})"
+
+
+def test():
+    events = []
+    order = VirtualOrderOne(open_price=100, close_price=101, quantity=1, direction='long', leverage=2)
+    order.link_observer(lambda o: events.append((o.open_price, o.close_price, o.quantity)))
+
+    order.update_open_price(99)
+    logging.info(f"update_open_price: {len(events)} event(s) {events}")
+
+    events.clear()
+    order.begin()
+    order.update_open_price(98)
+    order.update_close_price(100)
+    order.update_quantity(2, 3)
+    diff = order.commit()
+    logging.info(f"batch: {len(events)} event(s) {events} diff {diff}")
+
+    events.clear()
+    with order.batch():
+        order.update_close_price(101)
+        order.update_close_price(100)
+    logging.info(f"no net change: {len(events)} event(s)")
+
+    events.clear()
+    try:
+        with order.batch():
+            order.update_close_price(105)
+            order.update_quantity(-1, 2)
+    except ValueError as e:
+        logging.info(f"rolled back: {len(events)} event(s), close_price {order.close_price}, error: {e}")
+
+
+if __name__ == '__main__':
+    test()
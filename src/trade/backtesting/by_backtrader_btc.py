@@ -1,11 +1,12 @@
 from strategy import StrategyInterface
 from datetime import datetime
 from data_collection.api.kline_btc_usdt_1m import KlineBTCUSDT1M
-from data_collection.dao.kline_btc_spot_trading_usdt_1m import from_list_KlineBtcUSDT1mDao_to_KlineBtcUSDT1mDaoSimple
 import backtrader as bt
 import pandas as pd
 
+from data_collection.strategy_sink import new_sink
 from strategy.maker_only_volatility_strategy.my_strategy import MakerOnlyLongOnlyVolatilityStrategy
+from strategy.status_recorder import StatusSampler
 
 # 0.02% 的交易手续费
 COMMISSION = 0.0002
@@ -16,6 +17,11 @@ LEVERAGE = 1.0
 # 数据区间
 FROM_DATE = datetime(2024, 12, 1, 0, 0)
 TO_DATE = datetime(2025, 1, 8, 0, 0)
+# 策略status/action数据的输出目标 clickhouse | parquet | journal | memory | null
+# 默认写入本地parquet文件（需要pyarrow） 回测不依赖数据库 写入clickhouse时改为'clickhouse'
+SINK = 'parquet'
+# status采样策略 为空则每个bar都写入 如 StatusSampler(every=None, tolerance=0.001, on_event=True, heartbeat=60)
+STATUS_SAMPLER: StatusSampler | None = None
 
 
 class BacktraderStrategy(bt.Strategy):
@@ -29,14 +35,21 @@ class BacktraderStrategy(bt.Strategy):
     def notify_order(self, order):
         self.strategy.notify_order(order)
 
+    def stop(self):
+        self.strategy.stop()
+
 
 def test():
     # 加载数据
-    kline_data = from_list_KlineBtcUSDT1mDao_to_KlineBtcUSDT1mDaoSimple(
-        KlineBTCUSDT1M().get_kline(from_date=FROM_DATE, to_date=TO_DATE)
-    )
-    df = pd.DataFrame(kline_data, columns=['datetime', 'open', 'high', 'low', 'close', 'volume'])
-    df['datetime'] = pd.to_datetime(df['datetime'], format='%Y-%m-%d %H:%M:%S')
+    columns = KlineBTCUSDT1M().get_kline_columns(from_date=FROM_DATE, to_date=TO_DATE)
+    df = pd.DataFrame({
+        'datetime': columns['open_time'].astype('datetime64[ms]'),
+        'open': columns['open_price'],
+        'high': columns['high_price'],
+        'low': columns['low_price'],
+        'close': columns['close_price'],
+        'volume': columns['volume'],
+    })
     # logging.info(df)
     data = bt.feeds.PandasData(
         dataname=df,
@@ -55,7 +68,7 @@ def test():
     cerebro.adddata(data)
 
     # 加载策略
-    strategy_interface = MakerOnlyLongOnlyVolatilityStrategy()
+    strategy_interface = MakerOnlyLongOnlyVolatilityStrategy(sink=new_sink(SINK), status_sampler=STATUS_SAMPLER)
     cerebro.addstrategy(BacktraderStrategy, strategy_interface)
 
     # 设置初始资金